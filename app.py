@@ -1,10 +1,11 @@
 import os
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory
+from flask.json.provider import DefaultJSONProvider
 from dotenv import load_dotenv
 import json
-from functools import lru_cache
 from pathlib import Path
 import pandas as pd
+import numpy as np
 # plotly imports moved to dashboard_routes.py
 from datetime import datetime, timedelta
 import calendar
@@ -25,16 +26,29 @@ from logic import (
     export_data_to_new_sheet,
     append_multiple_bookings_to_sheet,
     delete_booking_by_id, update_row_in_gsheet,
-    prepare_dashboard_data, delete_row_in_gsheet,
-    delete_multiple_rows_in_gsheet,
+    delete_row_in_gsheet,
+    delete_bookings_in_gsheet,
     import_message_templates_from_gsheet,
     export_message_templates_to_gsheet,
     scrape_booking_apartments, format_apartments_display,
     add_expense_to_sheet, get_expenses_from_sheet
 )
 
+# Write-behind queue cho các cập nhật một hàng trên Google Sheets
+from sheet_write_queue import (
+    WRITE_BEHIND_ENABLED, enqueue_sheet_update, start_write_queue_worker, get_write_queue
+)
+
 # Import dashboard logic module
-from dashboard_routes import process_dashboard_data, safe_to_dict_records
+from dashboard_routes import build_dashboard, safe_to_dict_records
+from booking_indexes import get_search_index, find_guest_bookings, get_sorted_bookings, get_booking_dates
+from money import format_vnd, parse_amount
+
+# Local booking snapshot (đọc từ đĩa thay vì tải lại toàn bộ Google Sheet)
+from booking_store import (
+    SharedBookingCache, invalidate_booking_snapshot,
+    apply_booking_update, apply_booking_append, apply_booking_delete
+)
 
 # Email & Reminder System imports removed per user request
 
@@ -49,6 +63,21 @@ app.config['ENV'] = 'production'
 app.config['DEBUG'] = False
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "a_default_secret_key_for_development")
 
+class BookingJSONProvider(DefaultJSONProvider):
+    """jsonify/tojson hiểu số numpy (cột tiền của booking là int64)"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, np.integer):
+            return int(o)
+        if isinstance(o, np.floating):
+            return float(o)
+        if isinstance(o, np.bool_):
+            return bool(o)
+        return DefaultJSONProvider.default(o)
+
+app.json = BookingJSONProvider(app)
+
 @app.context_processor
 def inject_pandas():
     return dict(pd=pd)
@@ -145,26 +174,85 @@ DEFAULT_SHEET_ID = os.getenv("DEFAULT_SHEET_ID")
 WORKSHEET_NAME = os.getenv("WORKSHEET_NAME")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 TOTAL_HOTEL_CAPACITY = 4
+# Số booking mỗi trang của /api/bookings
+API_BOOKINGS_DEFAULT_LIMIT = 50
+API_BOOKINGS_MAX_LIMIT = 500
 
 # --- Khởi tạo ---
 if GOOGLE_API_KEY:
     genai.configure(api_key=GOOGLE_API_KEY)
 
 # --- Hàm chính để tải dữ liệu ---
-@lru_cache(maxsize=1)
-def load_data():
+# Cache dùng chung giữa các gunicorn worker qua generation của snapshot SQLite
+booking_cache = SharedBookingCache(DEFAULT_SHEET_ID, GCP_CREDS_FILE_PATH, WORKSHEET_NAME)
+
+def _build_booking_data(df):
     print("Loading booking data from source...")
-    try:
-        df = import_from_gsheet(DEFAULT_SHEET_ID, GCP_CREDS_FILE_PATH, WORKSHEET_NAME)
-        if df.empty:
-            raise ValueError("Booking sheet is empty or inaccessible.")
-        active_bookings = df[df['Tình trạng'] != 'Đã hủy'].copy()
-        print("Successfully loaded data from Google Sheet!")
-        return df, active_bookings
-    except Exception as e:
-        print(f"Error loading booking data: {e}. Using demo data.")
-        df_demo, active_bookings_demo = create_demo_data()
-        return df_demo, active_bookings_demo
+    if df.empty:
+        raise ValueError("Booking sheet is empty or inaccessible.")
+    active_bookings = df[df['Tình trạng'] != 'Đã hủy'].copy()
+    print("Successfully loaded data from Google Sheet!")
+    return df, active_bookings
+
+def _demo_booking_data():
+    print("Error loading booking data. Using demo data.")
+    return create_demo_data()
+
+def load_data():
+    return booking_cache.get(_build_booking_data, fallback=_demo_booking_data)
+
+def invalidate_booking_cache():
+    """Xóa cache trong process và đánh dấu snapshot trên đĩa là cũ (mọi worker)"""
+    booking_cache.clear()
+    invalidate_booking_snapshot(DEFAULT_SHEET_ID, WORKSHEET_NAME)
+
+def sync_cache_after_update(booking_id, new_data):
+    """Vá booking vừa cập nhật vào snapshot thay vì tải lại cả sheet"""
+    if not apply_booking_update(DEFAULT_SHEET_ID, WORKSHEET_NAME, booking_id, new_data):
+        invalidate_booking_snapshot(DEFAULT_SHEET_ID, WORKSHEET_NAME)
+    booking_cache.clear()
+
+def sync_cache_after_append(bookings):
+    """Thêm các booking vừa lưu vào snapshot thay vì tải lại cả sheet"""
+    if not apply_booking_append(DEFAULT_SHEET_ID, WORKSHEET_NAME, bookings):
+        invalidate_booking_snapshot(DEFAULT_SHEET_ID, WORKSHEET_NAME)
+    booking_cache.clear()
+
+def sync_cache_after_delete(booking_ids):
+    """Xóa các booking vừa xóa khỏi snapshot thay vì tải lại cả sheet"""
+    if not apply_booking_delete(DEFAULT_SHEET_ID, WORKSHEET_NAME, booking_ids):
+        invalidate_booking_snapshot(DEFAULT_SHEET_ID, WORKSHEET_NAME)
+    booking_cache.clear()
+
+def _on_queued_writes_failed(items):
+    """Cập nhật bị bỏ khỏi hàng đợi: bỏ cache lạc quan để lần đọc sau lấy lại dữ liệu thật"""
+    if any(item['key_column'] == 'Số đặt phòng' for item in items):
+        invalidate_booking_cache()
+
+def write_booking_update(booking_id, new_data):
+    """
+    Ghi cập nhật booking lên Google Sheets qua write-behind queue (cache cập nhật ngay, thread nền gửi đi).
+    Ghi trực tiếp như trước nếu SHEETS_WRITE_BEHIND=false hoặc hàng đợi không dùng được.
+    """
+    if WRITE_BEHIND_ENABLED and enqueue_sheet_update(DEFAULT_SHEET_ID, WORKSHEET_NAME, 'Số đặt phòng', booking_id, new_data):
+        start_write_queue_worker(GCP_CREDS_FILE_PATH, on_failure=_on_queued_writes_failed)
+        sync_cache_after_update(booking_id, new_data)
+        return True
+
+    success = update_row_in_gsheet(
+        sheet_id=DEFAULT_SHEET_ID,
+        gcp_creds_file_path=GCP_CREDS_FILE_PATH,
+        worksheet_name=WORKSHEET_NAME,
+        booking_id=booking_id,
+        new_data=new_data
+    )
+    if success:
+        sync_cache_after_update(booking_id, new_data)
+    return success
+
+# Gửi nốt các cập nhật còn trong hàng đợi từ lần chạy trước
+if WRITE_BEHIND_ENABLED:
+    start_write_queue_worker(GCP_CREDS_FILE_PATH, on_failure=_on_queued_writes_failed)
 
 # --- CÁC ROUTE CỦA ỨNG DỤNG ---
 
@@ -188,10 +276,11 @@ def dashboard():
     df, _ = load_data()
     sort_by = request.args.get('sort_by', 'Tháng')
     sort_order = request.args.get('sort_order', 'desc')
-    dashboard_data = prepare_dashboard_data(df, start_date, end_date, sort_by, sort_order)
 
-    # Process all dashboard data using modular approach
-    processed_data = process_dashboard_data(df, start_date, end_date, sort_by, sort_order, dashboard_data)
+    # Process all dashboard data using modular approach (memoized per cache generation)
+    dashboard_data, processed_data = build_dashboard(df, start_date, end_date, sort_by, sort_order,
+                                                     total_capacity=TOTAL_HOTEL_CAPACITY,
+                                                     rollups=booking_cache.get_rollups(df))
 
     # Render template with processed data
     return render_template(
@@ -209,6 +298,11 @@ def dashboard():
 @app.route('/bookings')
 def view_bookings():
     df, _ = load_data()
+    all_df = df
+    # Cột tìm kiếm và cột ngày chuẩn dựng trên toàn bộ cache (một lần mỗi generation), dùng lại
+    # sau khi lọc active/tháng - index của df sau khi lọc vẫn là vị trí dòng trong all_df
+    search_index = get_search_index(df)
+    booking_dates = get_booking_dates(df)
     
     # Lấy tham số từ URL
     search_term = request.args.get('search_term', '').strip().lower()
@@ -241,41 +335,36 @@ def view_bookings():
         # 2. HOẶC chưa check-out (Check-out Date > hôm nay)
         # 3. VÀ không bị hủy
         
-        # Ensure datetime conversion
-        if 'Check-out Date' in df.columns:
-            df['Check-out Date'] = pd.to_datetime(df['Check-out Date'], errors='coerce')
-        
         # Create active mask
-        not_cancelled = df['Tình trạng'] != 'Đã hủy'
+        not_cancelled = booking_dates.active
         
         # Chưa thu tiền
         collected_values = ['LOC LE', 'THAO LE']
         collector_series = df['Người thu tiền'].fillna('').astype(str)
-        not_collected = ~collector_series.isin(collected_values)
+        not_collected = ~collector_series.isin(collected_values).to_numpy()
         
         # Chưa check-out (check-out date là hôm nay hoặc trong tương lai)
-        not_checked_out = df['Check-out Date'].dt.date >= today
+        not_checked_out = booking_dates.check_out_between(today, None)
         
         # Combine conditions: (chưa thu tiền HOẶC chưa check-out) VÀ không bị hủy
         active_mask = (not_collected | not_checked_out) & not_cancelled
         
-        df = df[active_mask].copy()
+        df = df[active_mask]
         
         print(f"DEBUG: Filtered to {len(df)} active bookings (unpaid OR not checked out)")
 
-    # Lọc theo từ khóa tìm kiếm
+    # Lọc theo từ khóa tìm kiếm (không phân biệt hoa thường/dấu)
     if search_term:
-        df = df[df.apply(lambda row: search_term in str(row).lower(), axis=1)]
+        df = search_index.filter(df, search_term)
 
     # Lọc theo tháng/năm
     if filter_month and filter_year:
         try:
             year = int(filter_year)
             month = int(filter_month)
-            df = df[
-                (df['Check-in Date'].dt.year == year) & 
-                (df['Check-in Date'].dt.month == month)
-            ]
+            _, last_day = calendar.monthrange(year, month)
+            month_mask = booking_dates.check_in_between(datetime(year, month, 1), datetime(year, month, last_day))
+            df = df[month_mask[df.index]]
             print(f"DEBUG: Filtered by month {month}/{year}, result: {len(df)} bookings")
         except (ValueError, AttributeError):
             pass
@@ -283,19 +372,15 @@ def view_bookings():
     # Lọc theo khoảng ngày cụ thể
     elif start_date and end_date:
         try:
-            start_dt = pd.to_datetime(start_date)
-            end_dt = pd.to_datetime(end_date)
-            df = df[
-                (df['Check-in Date'] >= start_dt) & 
-                (df['Check-in Date'] <= end_dt)
-            ]
+            range_mask = booking_dates.check_in_between(pd.to_datetime(start_date), pd.to_datetime(end_date))
+            df = df[range_mask[df.index]]
         except (ValueError, AttributeError):
             pass
 
-    # Sắp xếp dữ liệu
+    # Sắp xếp dữ liệu theo thứ tự dựng sẵn trên cache (không sort lại mỗi request)
     if sort_by in df.columns:
         ascending = order == 'asc'
-        df = df.sort_values(by=sort_by, ascending=ascending)
+        df = get_sorted_bookings(all_df, sort_by, ascending).take(all_df, df.index)
     
     # === AUTO DUPLICATE FILTERING ===
     auto_filter_duplicates = request.args.get('auto_filter', 'true').lower() == 'true'
@@ -305,7 +390,7 @@ def view_bookings():
     if auto_filter_duplicates:
         try:
             # Get duplicate analysis
-            duplicate_report = analyze_existing_duplicates()
+            duplicate_report = analyze_existing_duplicates(all_df)
             
             # Extract all duplicate booking IDs to filter out
             for group in duplicate_report.get("duplicate_groups", []):
@@ -321,19 +406,18 @@ def view_bookings():
         except Exception as e:
             print(f"ERROR: Failed to auto-filter duplicates: {e}")
     
-    bookings_list = safe_to_dict_records(df)
-    
     # Tạo danh sách tháng/năm có sẵn để dropdown
-    all_df, _ = load_data()
     available_months = []
     if not all_df.empty and 'Check-in Date' in all_df.columns:
-        unique_dates = all_df['Check-in Date'].dropna().dt.to_period('M').unique()
-        available_months = [(str(period), period.year, period.month) for period in sorted(unique_dates, reverse=True)]
+        available_months = [(f"{year:04d}-{month:02d}", year, month)
+                            for year, month in reversed(booking_dates.check_in_months())]
     
+    # render_template (không stream): base.html đọc flash message nên session phải được lưu
+    # sau khi render xong, nếu không flash sẽ hiện lại ở lần tải trang sau
     return render_template('bookings.html', 
-                         bookings=bookings_list, 
+                         bookings=safe_to_dict_records(df), 
                          search_term=search_term, 
-                         booking_count=len(bookings_list),
+                         booking_count=len(df),
                          current_sort_by=sort_by,
                          current_order=order,
                          filter_month=filter_month,
@@ -454,7 +538,7 @@ def add_booking():
         
         # Check for duplicates BEFORE saving
         print(f"[DUPLICATE_CHECK] Checking for duplicates...")
-        duplicate_check = check_duplicate_guests([booking_data])
+        duplicate_check = check_duplicate_guests([booking_data], load_data()[0])
         
         if duplicate_check['has_duplicates']:
             # Format duplicate warning message
@@ -502,8 +586,8 @@ def add_booking():
             worksheet_name=WORKSHEET_NAME
         )
         
-        # Clear cache
-        load_data.cache_clear()
+        # Cập nhật cache
+        sync_cache_after_append([formatted_booking])
         
         flash(f'✅ Đã thêm booking thành công: {booking_data["guest_name"]} ({auto_booking_id})', 'success')
         return redirect(url_for('view_bookings'))
@@ -523,7 +607,7 @@ def api_analyze_duplicates():
     """API endpoint để phân tích duplicate bookings hiện có"""
     try:
         print("[API] 🔍 Analyzing existing duplicates...")
-        duplicate_analysis = analyze_existing_duplicates()
+        duplicate_analysis = analyze_existing_duplicates(load_data()[0])
         
         return jsonify({
             "success": True,
@@ -553,7 +637,7 @@ def process_pasted_image():
             # Lọc bỏ các booking có lỗi
             valid_bookings = [b for b in extracted_data if not b.get('error')]
             if valid_bookings:
-                duplicate_check = check_duplicate_guests(valid_bookings)
+                duplicate_check = check_duplicate_guests(valid_bookings, load_data()[0])
                 return jsonify({
                     "bookings": extracted_data,
                     "duplicate_check": duplicate_check
@@ -569,7 +653,7 @@ def sync_bookings():
     Đây là nơi ĐÚNG và DUY NHẤT để gọi cache_clear.
     """
     try:
-        load_data.cache_clear()
+        invalidate_booking_cache()
         flash('Data has been synced from Google Sheets.', 'info')
         print("Cache cleared successfully via Sync button.")
     except Exception as e:
@@ -740,7 +824,7 @@ def save_extracted_bookings():
                 
                 # ⚠️ QUAN TRỌNG: Xóa cache sau khi lưu thành công
                 print("[CACHE] Clearing cache...")
-                load_data.cache_clear()
+                sync_cache_after_append(formatted_bookings)
                 print("[CACHE] Cache cleared successfully after saving")
                 
                 # Verify data was saved by checking fresh data  
@@ -751,9 +835,10 @@ def save_extracted_bookings():
                     print(f"[VERIFY] Looking for booking IDs: {saved_booking_ids}")
                     print(f"[VERIFY] Sample booking IDs in sheet: {fresh_df['Số đặt phòng'].head().tolist()}")
                     # Force string comparison to avoid type mismatches
-                    fresh_df['Số đặt phòng'] = fresh_df['Số đặt phòng'].astype(str)
+                    # fresh_df là DataFrame dùng chung của cache (kèm chỉ mục theo generation): không gán cột
+                    fresh_ids = fresh_df['Số đặt phòng'].astype(str)
                     saved_booking_ids_str = [str(id) for id in saved_booking_ids]
-                    recent_bookings = fresh_df[fresh_df['Số đặt phòng'].isin(saved_booking_ids_str)]
+                    recent_bookings = fresh_df[fresh_ids.isin(saved_booking_ids_str)]
                     print(f"[VERIFY] Found {len(recent_bookings)} newly saved bookings in fresh data")
                     if len(recent_bookings) > 0:
                         print(f"[VERIFY] Success! New booking found: {recent_bookings['Tên người đặt'].tolist()}")
@@ -843,7 +928,7 @@ def edit_booking(booking_id):
         
         if success:
             # ⚠️ CRITICAL: Force clear ALL caches for dashboard update
-            load_data.cache_clear()
+            sync_cache_after_update(booking_id, new_data)
             print(f"[EDIT_TAXI] Cache cleared after updating taxi fare for {booking_id}")
             
             # Verify data is actually updated
@@ -872,7 +957,7 @@ def delete_booking(booking_id):
     
     if success:
         flash(f'Đã xóa thành công đặt phòng có ID: {booking_id}', 'success')
-        load_data.cache_clear() # Xóa cache sau khi sửa đổi
+        sync_cache_after_delete([booking_id]) # Cập nhật cache sau khi sửa đổi
     else:
         flash('Lỗi khi xóa đặt phòng.', 'danger')
     return redirect(url_for('view_bookings'))
@@ -889,7 +974,7 @@ def api_delete_booking(booking_id):
         )
         
         if success:
-            load_data.cache_clear() # Clear cache after modification
+            sync_cache_after_delete([booking_id]) # Update cache after modification
             return jsonify({
                 'success': True, 
                 'message': f'Successfully deleted booking ID: {booking_id}'
@@ -926,20 +1011,26 @@ def delete_multiple_bookings():
             return jsonify({'success': False, 'message': 'Không có ID nào được cung cấp.'}), 400
 
         print(f"[DELETE_MULTIPLE] Attempting to delete {len(ids_to_delete)} bookings")
-        success = delete_multiple_rows_in_gsheet(
+        results = delete_bookings_in_gsheet(
             sheet_id=DEFAULT_SHEET_ID,
             gcp_creds_file_path=GCP_CREDS_FILE_PATH,
             worksheet_name=WORKSHEET_NAME,
             booking_ids=ids_to_delete
         )
+        deleted_ids = [booking_id for booking_id, status in results.items() if status == 'deleted']
         
-        if success:
+        if 'error' not in results.values():
             print("[DELETE_MULTIPLE] Delete successful, clearing cache")
-            load_data.cache_clear() # Xóa cache sau khi sửa đổi
-            return jsonify({'success': True, 'message': f'Đã xóa thành công {len(ids_to_delete)} booking(s)'})
+            if deleted_ids:
+                sync_cache_after_delete(deleted_ids) # Cập nhật cache sau khi sửa đổi
+            return jsonify({
+                'success': True,
+                'message': f'Đã xóa thành công {len(deleted_ids)} booking(s)',
+                'results': results
+            })
         else:
             print("[DELETE_MULTIPLE] Delete failed in Google Sheets")
-            return jsonify({'success': False, 'message': 'Lỗi khi xóa dữ liệu trên Google Sheets.'})
+            return jsonify({'success': False, 'message': 'Lỗi khi xóa dữ liệu trên Google Sheets.', 'results': results})
             
     except Exception as e:
         print(f"[DELETE_MULTIPLE] Exception: {e}")
@@ -969,7 +1060,8 @@ def collect_payment():
             return jsonify({'success': False, 'message': 'Không có dữ liệu'}), 400
         
         booking_id = data.get('booking_id')
-        collected_amount = data.get('collected_amount')
+        # Số tiền có thể gửi lên dạng số hoặc chuỗi ("500,000đ")
+        collected_amount = parse_amount(data.get('collected_amount'))
         collector_name = data.get('collector_name')
         payment_note = data.get('payment_note', '')
         payment_type = data.get('payment_type', 'room')  # 'room' hoặc 'taxi'
@@ -997,33 +1089,25 @@ def collect_payment():
         
         if payment_type == 'taxi':
             # Thu tiền taxi - cập nhật trường Taxi và checkbox Có taxi
-            new_data['Taxi'] = f"{collected_amount:,.0f}đ"
+            new_data['Taxi'] = format_vnd(collected_amount)
             new_data['Có taxi'] = True
             new_data['Không có taxi'] = False
             if payment_note:
-                new_data['Ghi chú thu tiền'] = f"Thu taxi {collected_amount:,.0f}đ - {payment_note}"
+                new_data['Ghi chú thu tiền'] = f"Thu taxi {format_vnd(collected_amount)} - {payment_note}"
             else:
-                new_data['Ghi chú thu tiền'] = f"Thu taxi {collected_amount:,.0f}đ"
+                new_data['Ghi chú thu tiền'] = f"Thu taxi {format_vnd(collected_amount)}"
         else:
             # Thu tiền phòng - cập nhật người thu tiền (như cũ)
             new_data['Người thu tiền'] = collector_name
             if payment_note:
-                new_data['Ghi chú thu tiền'] = f"Thu {collected_amount:,.0f}đ - {payment_note}"
+                new_data['Ghi chú thu tiền'] = f"Thu {format_vnd(collected_amount)} - {payment_note}"
             else:
-                new_data['Ghi chú thu tiền'] = f"Thu {collected_amount:,.0f}đ"
+                new_data['Ghi chú thu tiền'] = f"Thu {format_vnd(collected_amount)}"
         
-        success = update_row_in_gsheet(
-            sheet_id=DEFAULT_SHEET_ID,
-            gcp_creds_file_path=GCP_CREDS_FILE_PATH,
-            worksheet_name=WORKSHEET_NAME,
-            booking_id=booking_id,
-            new_data=new_data
-        )
+        # Ghi qua write-behind queue, cache được cập nhật ngay
+        success = write_booking_update(booking_id, new_data)
         
         if success:
-            # Xóa cache để cập nhật dữ liệu
-            load_data.cache_clear()
-            
             commission_msg = ""
             if commission_type == 'none':
                 commission_msg = " (Không có hoa hồng)"
@@ -1031,12 +1115,12 @@ def collect_payment():
             if payment_type == 'taxi':
                 return jsonify({
                     'success': True, 
-                    'message': f'Đã thu thành công {collected_amount:,.0f}đ tiền taxi từ {booking_id}{commission_msg}'
+                    'message': f'Đã thu thành công {format_vnd(collected_amount)} tiền taxi từ {booking_id}{commission_msg}'
                 })
             else:
                 return jsonify({
                     'success': True, 
-                    'message': f'Đã thu thành công {collected_amount:,.0f}đ từ {booking_id}{commission_msg}'
+                    'message': f'Đã thu thành công {format_vnd(collected_amount)} từ {booking_id}{commission_msg}'
                 })
         else:
             return jsonify({
@@ -1086,7 +1170,7 @@ def update_guest_amounts():
         
         # Handle taxi amount - format properly
         if taxi_amount > 0:
-            new_data['Taxi'] = f"{taxi_amount:,.0f}đ"
+            new_data['Taxi'] = format_vnd(taxi_amount)
         else:
             new_data['Taxi'] = ''  # Clear taxi field if amount is 0
         
@@ -1098,17 +1182,10 @@ def update_guest_amounts():
         print(f"[UPDATE_AMOUNTS] Prepared data: {new_data}")
         
         # Update Google Sheets - use the existing update function
-        success = update_row_in_gsheet(
-            sheet_id=DEFAULT_SHEET_ID,
-            gcp_creds_file_path=GCP_CREDS_FILE_PATH,
-            worksheet_name=WORKSHEET_NAME,
-            booking_id=booking_id,
-            new_data=new_data
-        )
+        # Write through the write-behind queue, cache is updated immediately
+        success = write_booking_update(booking_id, new_data)
         
         if success:
-            # Clear cache to get fresh data
-            load_data.cache_clear()
             print(f"[UPDATE_AMOUNTS] Successfully updated booking {booking_id}")
             
             return jsonify({
@@ -1709,7 +1786,7 @@ def debug_all_bookings():
     """Debug route để xem TẤT CẢ dữ liệu booking thô từ Google Sheets"""
     try:
         # Force clear cache và load fresh data
-        load_data.cache_clear()
+        invalidate_booking_cache()
         df, _ = load_data()
         
         if df.empty:
@@ -1739,6 +1816,69 @@ def debug_all_bookings():
             "traceback": traceback.format_exc()
         })
 
+def _encode_booking_cursor(cursor):
+    return base64.urlsafe_b64encode(json.dumps(list(cursor), ensure_ascii=False).encode('utf-8')).decode('ascii')
+
+def _decode_booking_cursor(token):
+    """Cursor rỗng -> None (trang đầu); cursor hỏng -> ValueError"""
+    if not token:
+        return None
+    try:
+        value, booking_id = json.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+    except Exception:
+        raise ValueError("cursor không hợp lệ")
+    return value, booking_id
+
+def _booking_records_for_json(df):
+    """Ngày -> 'YYYY-MM-DD', ô trống -> null"""
+    df = df.copy()
+    for column in df.select_dtypes(include=['datetime64[ns]']).columns:
+        df[column] = df[column].dt.strftime('%Y-%m-%d')
+    df = df.astype(object)
+    return safe_to_dict_records(df.where(df.notna(), None))
+
+@app.route('/api/bookings')
+def api_bookings():
+    """
+    Danh sách booking theo trang (keyset pagination): ?cursor=&limit=&sort_by=&order=&search_term=
+    Trang được cắt từ thứ tự sắp xếp dựng sẵn trên cache, next_cursor là cursor của trang sau
+    (null nếu đã hết).
+    """
+    df, _ = load_data()
+    sort_by = request.args.get('sort_by', 'Check-in Date')
+    order = request.args.get('order', 'desc')
+    search_term = request.args.get('search_term', '').strip()
+    try:
+        limit = int(request.args.get('limit', API_BOOKINGS_DEFAULT_LIMIT))
+        cursor = _decode_booking_cursor(request.args.get('cursor', ''))
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"Tham số không hợp lệ: {e}"}), 400
+    if sort_by not in df.columns:
+        return jsonify({"success": False, "message": f"Không thể sắp xếp theo cột '{sort_by}'"}), 400
+    limit = min(max(limit, 1), API_BOOKINGS_MAX_LIMIT)
+
+    sorted_bookings = get_sorted_bookings(df, sort_by, order == 'asc')
+    mask = get_search_index(df).mask(search_term).to_numpy() if search_term else None
+    positions, has_more = sorted_bookings.page(cursor, limit, mask)
+    next_cursor = _encode_booking_cursor(sorted_bookings.cursor_for(df, positions[-1])) if has_more else None
+
+    return jsonify({
+        "success": True,
+        "bookings": _booking_records_for_json(df.iloc[positions]),
+        "count": len(positions),
+        "next_cursor": next_cursor,
+        "sort_by": sort_by,
+        "order": order
+    })
+
+@app.route('/api/cache_stats')
+def cache_stats():
+    """Số liệu cache booking của worker hiện tại (hit/miss/refresh, TTL, generation) và write-behind queue"""
+    stats = booking_cache.get_stats()
+    write_queue = get_write_queue()
+    stats['write_queue'] = write_queue.get_stats() if write_queue else None
+    return jsonify(stats)
+
 @app.route('/api/debug_find_booking/<booking_id>')
 def debug_find_booking(booking_id):
     """Debug route để tìm booking cụ thể trong raw data"""
@@ -1815,22 +1955,22 @@ def view_all_bookings():
     
     print(f"DEBUG ALL BOOKINGS: Total raw bookings: {len(df)}")
     
+    all_df = df
+    
     # CHỈ filter theo search term, KHÔNG filter gì khác
     if search_term:
-        df = df[df.apply(lambda row: search_term in str(row).lower(), axis=1)]
+        df = get_search_index(df).filter(df, search_term)
         print(f"DEBUG: After search filter: {len(df)} bookings")
     
-    # Sắp xếp dữ liệu  
+    # Sắp xếp dữ liệu theo thứ tự dựng sẵn trên cache
     if sort_by in df.columns:
         ascending = order == 'asc'
-        df = df.sort_values(by=sort_by, ascending=ascending)
-    
-    bookings_list = safe_to_dict_records(df)
+        df = get_sorted_bookings(all_df, sort_by, ascending).take(all_df, df.index)
     
     return render_template('bookings.html',
-                         bookings=bookings_list,
+                         bookings=safe_to_dict_records(df),
                          search_term=search_term,
-                         booking_count=len(bookings_list),
+                         booking_count=len(df),
                          current_sort_by=sort_by,
                          current_order=order,
                          filter_month='',
@@ -2231,20 +2371,14 @@ def ai_chat_gemini_rag():
 def get_guest_booking_context(guest_name: str) -> dict:
     """Get guest booking information for RAG context"""
     try:
-        from logic import import_from_gsheet
-        
-        # Import current bookings
-        df = import_from_gsheet(
-            sheet_id=DEFAULT_SHEET_ID,
-            worksheet_name=WORKSHEET_NAME,
-            gcp_creds_file_path=GCP_CREDS_FILE_PATH
-        )
+        # Dùng dữ liệu đã cache/snapshot thay vì tải lại toàn bộ sheet
+        df, _ = load_data()
         
         if df is None or df.empty:
             return {}
         
-        # Find guest bookings (case insensitive)
-        guest_bookings = df[df['Tên người đặt'].str.contains(guest_name, case=False, na=False)]
+        # Find guest bookings (không phân biệt hoa thường/dấu, có khớp gần đúng)
+        guest_bookings = find_guest_bookings(df, guest_name)
         
         if guest_bookings.empty:
             return {}
@@ -2460,7 +2594,7 @@ def get_quick_notes():
     """API để lấy danh sách quick notes từ Google Sheets"""
     try:
         # Sử dụng logic tương tự như templates
-        from logic import _get_gspread_client
+        from logic import _get_gspread_client, remember_worksheet_header
         
         gc = _get_gspread_client(GCP_CREDS_FILE_PATH)
         sh = gc.open_by_key(DEFAULT_SHEET_ID)
@@ -2483,6 +2617,7 @@ def get_quick_notes():
         
         # Chuyển đổi dữ liệu
         headers = data[0]
+        remember_worksheet_header(worksheet, headers)
         notes = []
         for row in data[1:]:
             if len(row) >= len(headers) and row[0]:  # Có ID
@@ -2565,17 +2700,22 @@ def save_quick_note():
 def complete_quick_note(note_id):
     """API để đánh dấu hoàn thành quick note"""
     try:
-        from logic import _get_gspread_client
+        # Đánh dấu hoàn thành qua write-behind queue (thread nền tìm hàng theo ID và ghi)
+        if WRITE_BEHIND_ENABLED and enqueue_sheet_update(DEFAULT_SHEET_ID, 'QuickNotes', 'ID', note_id, {'Completed': 'true'}):
+            start_write_queue_worker(GCP_CREDS_FILE_PATH, on_failure=_on_queued_writes_failed)
+            return jsonify({'success': True, 'message': 'Đã đánh dấu hoàn thành!'})
+        
+        from logic import _get_gspread_client, get_column_index
         
         gc = _get_gspread_client(GCP_CREDS_FILE_PATH)
         sh = gc.open_by_key(DEFAULT_SHEET_ID)
         worksheet = sh.worksheet('QuickNotes')
         
-        # Tìm hàng có ID tương ứng
-        data = worksheet.get_all_values()
-        headers = data[0]
-        id_col_index = headers.index('ID') + 1  # gspread uses 1-based indexing
-        completed_col_index = headers.index('Completed') + 1
+        # Tìm cột theo header đã cache (gspread uses 1-based indexing)
+        id_col_index = get_column_index(worksheet, 'ID')
+        completed_col_index = get_column_index(worksheet, 'Completed')
+        if id_col_index is None or completed_col_index is None:
+            raise ValueError("QuickNotes sheet is missing 'ID' or 'Completed' column")
         
         # Tìm cell chứa note_id
         cell = worksheet.find(note_id, in_column=id_col_index)
@@ -2594,16 +2734,16 @@ def complete_quick_note(note_id):
 def delete_quick_note(note_id):
     """API để xóa quick note"""
     try:
-        from logic import _get_gspread_client
+        from logic import _get_gspread_client, get_column_index
         
         gc = _get_gspread_client(GCP_CREDS_FILE_PATH)
         sh = gc.open_by_key(DEFAULT_SHEET_ID)
         worksheet = sh.worksheet('QuickNotes')
         
-        # Tìm hàng có ID tương ứng
-        data = worksheet.get_all_values()
-        headers = data[0]
-        id_col_index = headers.index('ID') + 1
+        # Tìm cột ID theo header đã cache
+        id_col_index = get_column_index(worksheet, 'ID')
+        if id_col_index is None:
+            raise ValueError("QuickNotes sheet is missing 'ID' column")
         
         # Tìm cell chứa note_id
         cell = worksheet.find(note_id, in_column=id_col_index)
@@ -0,0 +1,187 @@
+"""
+Micro-benchmark cho các bước xử lý dữ liệu booking (không gọi Google Sheets).
+
+Chạy:
+    python benchmarks.py                 # parse: 1k / 10k / 100k dòng, search: 5k / 50k dòng
+    python benchmarks.py --sizes 5000    # chỉ một kích thước
+    python benchmarks.py --only search money
+"""
+import argparse
+import random
+import re
+import time
+from datetime import date, timedelta
+
+import pandas as pd
+
+from booking_duplicates import build_duplicate_report
+from booking_indexes import get_search_index
+from logic import parse_booking_rows
+from money import parse_amount, parse_money_series
+
+SHEET_COLUMNS = [
+    'Số đặt phòng', 'Tên người đặt', 'Tên chỗ nghỉ', 'Check-in Date', 'Check-out Date',
+    'Stay Duration', 'Tình trạng', 'Tổng thanh toán', 'Giá mỗi đêm', 'Booking Date',
+    'Ngày đến', 'Ngày đi', 'Vị trí', 'Thành viên Genius', 'Được đặt vào',
+    'Hoa hồng', 'Tiền tệ', 'Người nhận tiền', 'Ghi chú thanh toán', 'Người thu tiền', 'Taxi'
+]
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+DEFAULT_SEARCH_SIZES = [5_000, 50_000]
+
+
+def make_sheet_values(rows: int, seed: int = 42):
+    """Dữ liệu giống get_all_values(): header + các hàng toàn chuỗi, có vài hàng trống/lỗi"""
+    rng = random.Random(seed)
+    first_day = date(2023, 1, 1)
+    names = ['Nguyen Van A', 'Tran Thi B', 'John Smith', 'Le Van C', 'Maria Garcia', 'Pham Thi D']
+    values = [list(SHEET_COLUMNS)]
+    for i in range(rows):
+        check_in = first_day + timedelta(days=rng.randrange(900))
+        nights = rng.randint(1, 7)
+        check_out = check_in + timedelta(days=nights)
+        total = rng.randrange(200, 5000) * 1000
+        row = {
+            'Số đặt phòng': str(5_000_000_000 + i),
+            'Tên người đặt': f"{rng.choice(names)} {i % 997}",
+            'Tên chỗ nghỉ': '118 Hang Bac Hostel',
+            'Check-in Date': check_in.isoformat(),
+            'Check-out Date': check_out.isoformat(),
+            'Stay Duration': str(nights),
+            'Tình trạng': rng.choice(['OK', 'OK', 'OK', 'Đã hủy']),
+            'Tổng thanh toán': rng.choice([f"{total}", f"VND {total:,}", f"{total}.0"]),
+            'Giá mỗi đêm': str(total // nights),
+            'Booking Date': (check_in - timedelta(days=rng.randrange(60))).isoformat(),
+            'Ngày đến': f"ngày {check_in.day} tháng {check_in.month} năm {check_in.year}",
+            'Ngày đi': f"ngày {check_out.day} tháng {check_out.month} năm {check_out.year}",
+            'Vị trí': 'Hà Nội',
+            'Thành viên Genius': rng.choice(['Có', 'Không']),
+            'Được đặt vào': check_in.isoformat(),
+            'Hoa hồng': str(int(total * 0.15)),
+            'Tiền tệ': 'VND',
+            'Người nhận tiền': '',
+            'Ghi chú thanh toán': '',
+            'Người thu tiền': rng.choice(['LOC LE', 'THAO LE', '', 'N/A']),
+            'Taxi': rng.choice(['', '', '50000']),
+        }
+        values.append([row[col] for col in SHEET_COLUMNS])
+
+    # Hàng trống và hàng thiếu tên như trong sheet thật
+    for i in range(1, len(values), 250):
+        values[i] = [''] * len(SHEET_COLUMNS)
+    for i in range(2, len(values), 500):
+        values[i][1] = '  '
+    return values
+
+
+def time_call(func, *args, repeat: int = 3) -> float:
+    """Thời gian chạy nhanh nhất (giây) trong repeat lần"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def bench_parse(sizes=None):
+    print("parse_booking_rows (get_all_values -> DataFrame đã đúng kiểu)")
+    for rows in sizes or DEFAULT_SIZES:
+        values = make_sheet_values(rows)
+        seconds = time_call(parse_booking_rows, values, repeat=3 if rows <= 10_000 else 1)
+        print(f"  {rows:>8,} rows: {seconds * 1000:9.1f} ms  ({rows / seconds:,.0f} rows/s)")
+
+
+def _search_by_row_apply(df, search_term):
+    """Cách tìm kiếm cũ của /bookings: str(row) cho từng hàng"""
+    search_term = search_term.lower()
+    return df[df.apply(lambda row: search_term in str(row).lower(), axis=1)]
+
+
+def _search_by_index(df, search_term):
+    return get_search_index(df).filter(df, search_term)
+
+
+def bench_search(sizes=None):
+    print("Tìm kiếm /bookings: row apply (cũ) so với cột tìm kiếm dựng sẵn")
+    for rows in sizes or DEFAULT_SEARCH_SIZES:
+        df, _ = parse_booking_rows(make_sheet_values(rows))
+        started = time.perf_counter()
+        get_search_index(df)
+        build_seconds = time.perf_counter() - started
+        for term in ('smith', '5000001'):
+            old_seconds = time_call(_search_by_row_apply, df, term, repeat=1)
+            new_seconds = time_call(_search_by_index, df, term, repeat=3)
+            print(f"  {rows:>8,} rows '{term}': apply {old_seconds * 1000:9.1f} ms | "
+                  f"index {new_seconds * 1000:7.1f} ms (+{build_seconds * 1000:.1f} ms dựng một lần) "
+                  f"x{old_seconds / new_seconds:,.0f}")
+
+
+def bench_duplicates(sizes=None):
+    print("build_duplicate_report (blocking theo tên + tuần check-in)")
+    for rows in sizes or DEFAULT_SIZES:
+        df, _ = parse_booking_rows(make_sheet_values(rows))
+        seconds = time_call(build_duplicate_report, df, repeat=3 if rows <= 10_000 else 1)
+        groups = build_duplicate_report(df)['total_groups']
+        print(f"  {rows:>8,} rows: {seconds * 1000:9.1f} ms  ({groups:,} nhóm trùng)")
+
+
+def make_money_values(rows: int, seed: int = 42):
+    """Các kiểu ô tiền gặp trong sheet và giá cào về: VND, US, EU, có/không ký hiệu"""
+    rng = random.Random(seed)
+
+    def eu(amount):
+        return f"{amount:,.2f}".replace(',', ' ').replace('.', ',').replace(' ', '.')
+
+    formats = [
+        lambda v: f"{v}", lambda v: f"{v:,}đ", lambda v: f"VND {v:,}", lambda v: f"{v:,}".replace(',', '.'),
+        lambda v: f"{v:,}".replace(',', ' ') + " VND", lambda v: f"US${v / 24000:,.2f}",
+        lambda v: f"{eu(v / 26000)} €", lambda v: '',
+    ]
+    # Giá phòng lặp lại nhiều như trong sheet thật (vài trăm mức giá)
+    return [rng.choice(formats)(rng.randrange(20, 500) * 10_000) for _ in range(rows)]
+
+
+def _parse_money_per_cell(values):
+    """Cách cũ: một re.search cho từng ô"""
+    amounts = []
+    for value in values:
+        match = re.search(r'[\d,]+', value.replace('.', ''))
+        amounts.append(float(match.group().replace(',', '')) if match and match.group().strip(',') else 0.0)
+    return amounts
+
+
+def bench_money(sizes=None):
+    print("Đọc cột tiền: re.search từng ô (cũ) | parse_money_series | parse_amount (memo)")
+    for rows in sizes or DEFAULT_SIZES:
+        values = make_money_values(rows)
+        series = pd.Series(values, dtype=object)
+        old_seconds = time_call(_parse_money_per_cell, values, repeat=3 if rows <= 10_000 else 1)
+        series_seconds = time_call(parse_money_series, series, repeat=3)
+        scalar_seconds = time_call(lambda: [parse_amount(v) for v in values], repeat=3)
+        print(f"  {rows:>8,} rows: per-cell {old_seconds * 1000:8.1f} ms | series {series_seconds * 1000:8.1f} ms | "
+              f"scalar {scalar_seconds * 1000:8.1f} ms")
+
+
+BENCHMARKS = {
+    'parse': bench_parse,
+    'search': bench_search,
+    'duplicates': bench_duplicates,
+    'money': bench_money,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', help='Số dòng của sheet giả lập (mặc định tùy benchmark)')
+    parser.add_argument('--only', choices=sorted(BENCHMARKS), nargs='+', help='Chỉ chạy các benchmark này')
+    args = parser.parse_args()
+
+    for name, bench in BENCHMARKS.items():
+        if args.only and name not in args.only:
+            continue
+        bench(args.sizes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+"""
+Phát hiện booking trùng lặp bằng blocking thay vì so từng cặp.
+
+Hai booking (chưa hủy) được coi là trùng khi mọi từ trong tên khách này đều có trong tên
+khách kia (chứa nhau theo nguyên từ, bỏ dấu, chữ thường - không phải chứa chuỗi con: "van a"
+không khớp "nguyen van an"), ngày check-in lệch không quá DUPLICATE_DATE_TOLERANCE_DAYS và
+tổng tiền lệch không quá DUPLICATE_PRICE_TOLERANCE. Thay vì so mọi cặp (O(n²)), các booking
+được chia block theo (từ trong tên, tuần check-in): hai booking lệch <= 3 ngày luôn nằm cùng
+tuần hoặc hai tuần liền nhau. Vì tập từ của tên ngắn là tập con của tên dài, từ hiếm nhất của
+tên ngắn cũng có trong tên dài, nên mỗi booking chỉ cần tra từ hiếm nhất của mình trong các block
+đó. Điều này chỉ đúng với khớp nguyên từ - đổi sang khớp chuỗi con thì blocking sẽ bỏ sót cặp.
+
+Các cặp trùng (theo Số đặt phòng) được lưu cùng snapshot trong booking_store và chỉ tính lại
+cho các dòng bị vá; báo cáo nhóm được dựng từ các cặp này, một lần cho mỗi generation.
+"""
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from booking_indexes import fold_series, get_booking_dates, get_derived, guest_booking_rows
+
+DUPLICATE_DATE_TOLERANCE_DAYS = 3
+DUPLICATE_PRICE_TOLERANCE = 100000  # VND
+
+DUPLICATE_PAIR_COLUMNS = ['left_id', 'right_id', 'date_diff', 'price_diff']
+
+
+def _empty_report() -> Dict[str, Any]:
+    return {"duplicate_groups": [], "total_groups": 0, "total_duplicates": 0}
+
+
+def duplicate_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Các cột cần cho việc so trùng của những booking chưa hủy, có tên khách:
+    booking_id, guest_name, name (đã bỏ dấu), check_in, check_out, day (số ngày, -1 nếu thiếu),
+    payment, status. Index là vị trí dòng trong df.
+    """
+    if df is None or df.empty or 'Tên người đặt' not in df.columns:
+        return pd.DataFrame(columns=['booking_id', 'guest_name', 'name', 'check_in', 'check_out',
+                                     'day', 'payment', 'status'])
+    status = _column(df, 'Tình trạng', '').astype(object).fillna('')
+    payment = pd.to_numeric(_column(df, 'Tổng thanh toán', 0), errors='coerce')
+
+    dates = get_booking_dates(df)
+    frame = pd.DataFrame({
+        'booking_id': df['Số đặt phòng'].to_numpy(),
+        'guest_name': df['Tên người đặt'].to_numpy(),
+        'name': fold_series(df['Tên người đặt']).str.split().str.join(' ').to_numpy(),
+        'check_in': dates.check_in.astype('datetime64[ns]'),
+        'check_out': dates.check_out.astype('datetime64[ns]'),
+        'day': np.where(np.isnat(dates.check_in), -1, dates.check_in.astype(np.int64)),
+        'payment': payment.astype(float).to_numpy(),
+        'status': status.to_numpy(),
+    })
+    keep = (frame['status'] != 'Đã hủy') & (frame['name'] != '') & (frame['name'] != 'nan')
+    return frame[keep.to_numpy()]
+
+
+def _column(df: pd.DataFrame, column: str, default) -> pd.Series:
+    return df[column] if column in df.columns else pd.Series(default, index=df.index)
+
+
+def _name_blocks(frame: pd.DataFrame) -> pd.DataFrame:
+    """Một dòng cho mỗi (booking, từ trong tên, tuần check-in) của các booking có ngày check-in"""
+    dated = frame[frame['day'] >= 0]
+    blocks = pd.DataFrame({
+        'pos': dated.index.to_numpy(),
+        'token': dated['name'].str.split().to_numpy(),
+        'week': dated['day'].to_numpy() // 7,
+    }).explode('token')
+    return blocks.drop_duplicates(['pos', 'token'])
+
+
+def candidate_pairs(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    Các cặp (left < right) check-in cùng tuần hoặc tuần liền kề mà tên của một bên
+    có từ hiếm nhất của bên kia
+    """
+    blocks = _name_blocks(frame)
+    if blocks.empty:
+        return pd.DataFrame(columns=['left', 'right'], dtype=np.int64)
+    frequency = blocks['token'].map(blocks['token'].value_counts())
+    rarest = blocks.assign(frequency=frequency.to_numpy()).sort_values(['pos', 'frequency'], kind='stable')
+    rarest = rarest.drop_duplicates('pos')[['pos', 'token', 'week']]
+
+    # Mỗi booking nằm ở block của tuần mình và hai tuần bên cạnh
+    neighbourhood = pd.concat([blocks.assign(week=blocks['week'] + shift) for shift in (-1, 0, 1)])
+    matched = rarest.merge(neighbourhood, on=['token', 'week'], suffixes=('_a', '_b'))
+    left, right = matched['pos_a'].to_numpy(dtype=np.int64), matched['pos_b'].to_numpy(dtype=np.int64)
+    keep = left != right
+    left, right = np.minimum(left, right)[keep], np.maximum(left, right)[keep]
+    size = int(frame.index.max()) + 1
+    keys = np.unique(left * size + right)
+    return pd.DataFrame({'left': keys // size, 'right': keys % size})
+
+
+def _names_overlap(name_a: str, name_b: str) -> bool:
+    """Tập từ của tên này nằm trong tập từ của tên kia (cùng quy tắc mà blocking dựa vào)"""
+    tokens_a, tokens_b = set(name_a.split()), set(name_b.split())
+    return tokens_a <= tokens_b or tokens_b <= tokens_a
+
+
+def matching_pairs(frame: pd.DataFrame, pairs: pd.DataFrame) -> pd.DataFrame:
+    """Lọc candidate pairs theo ngày/giá (vectorized) rồi theo tên chứa nhau (nguyên từ)"""
+    if pairs.empty:
+        return pairs.assign(date_diff=pd.Series(dtype=np.int64), price_diff=pd.Series(dtype=float))
+    left, right = pairs['left'].to_numpy(), pairs['right'].to_numpy()
+    days, payments = frame['day'], frame['payment']
+    date_diff = np.abs(days.loc[left].to_numpy() - days.loc[right].to_numpy())
+    price_diff = np.abs(payments.loc[left].to_numpy() - payments.loc[right].to_numpy())
+    close = (date_diff <= DUPLICATE_DATE_TOLERANCE_DAYS) & (price_diff <= DUPLICATE_PRICE_TOLERANCE)
+
+    pairs = pairs.assign(date_diff=date_diff, price_diff=price_diff)[close]
+    names = frame['name']
+    overlap = [_names_overlap(a, b) for a, b in zip(names.loc[pairs['left']], names.loc[pairs['right']])]
+    return pairs[np.asarray(overlap, dtype=bool)]
+
+
+def _booking_summary(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "booking_id": row['booking_id'],
+        "guest_name": row['guest_name'],
+        "check_in_date": row['check_in'].strftime('%Y-%m-%d') if pd.notna(row['check_in']) else 'N/A',
+        "check_out_date": row['check_out'].strftime('%Y-%m-%d') if pd.notna(row['check_out']) else 'N/A',
+        "total_payment": float(row['payment']),
+        "status": row['status'],
+    }
+
+
+def group_duplicates(frame: pd.DataFrame, matches: pd.DataFrame) -> List[Dict[str, Any]]:
+    """
+    Gom nhóm theo thứ tự trong sheet: booking đầu tiên chưa thuộc nhóm nào là booking chính,
+    các booking khớp với nó (chưa thuộc nhóm nào) là similar_bookings.
+    """
+    neighbours: Dict[int, List[tuple]] = {}
+    columns = ['left', 'right', 'date_diff', 'price_diff']
+    for left, right, date_diff, price_diff in matches[columns].itertuples(index=False):
+        neighbours.setdefault(left, []).append((right, date_diff, price_diff))
+        neighbours.setdefault(right, []).append((left, date_diff, price_diff))
+
+    rows = frame.loc[sorted(neighbours)].to_dict('index')
+    groups = []
+    processed_ids = set()
+    for pos in sorted(neighbours):
+        main = rows[pos]
+        if main['booking_id'] in processed_ids:
+            continue
+        similar_bookings = []
+        for other_pos, date_diff, price_diff in sorted(neighbours[pos], key=lambda item: item[0]):
+            other = rows[other_pos]
+            if other['booking_id'] in processed_ids:
+                continue
+            similar_bookings.append({**_booking_summary(other),
+                                     "date_diff": int(date_diff), "price_diff": float(price_diff)})
+            processed_ids.add(other['booking_id'])
+        if similar_bookings:
+            groups.append({
+                "main_booking": _booking_summary(main),
+                "similar_bookings": similar_bookings,
+                "group_size": len(similar_bookings) + 1
+            })
+            processed_ids.add(main['booking_id'])
+    return groups
+
+
+def duplicate_pairs(df: pd.DataFrame, booking_ids: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Các cặp booking trùng: left_id, right_id (Số đặt phòng, left đứng trước trong sheet),
+    date_diff, price_diff. Với booking_ids chỉ tính các cặp có ít nhất một booking trong danh
+    sách, và chỉ so với các booking check-in gần chúng (dùng khi vá snapshot).
+    """
+    frame = duplicate_frame(df)
+    focus = None
+    if booking_ids is not None:
+        focus = frame.index[frame['booking_id'].astype(str).isin([str(b) for b in booking_ids])]
+        weeks = frame.loc[focus, 'day']
+        weeks = np.unique(weeks[weeks >= 0].to_numpy() // 7)
+        near_weeks = np.concatenate([weeks - 1, weeks, weeks + 1])
+        frame = frame[(frame['day'] >= 0) & np.isin(frame['day'] // 7, near_weeks)]
+    if frame.empty:
+        return pd.DataFrame(columns=DUPLICATE_PAIR_COLUMNS)
+
+    pairs = candidate_pairs(frame)
+    if focus is not None:
+        pairs = pairs[pairs['left'].isin(focus) | pairs['right'].isin(focus)]
+    matches = matching_pairs(frame, pairs)
+    ids = frame['booking_id'].astype(str)
+    return pd.DataFrame({
+        'left_id': ids.loc[matches['left']].to_numpy(),
+        'right_id': ids.loc[matches['right']].to_numpy(),
+        'date_diff': matches['date_diff'].to_numpy(dtype=np.int64),
+        'price_diff': matches['price_diff'].to_numpy(dtype=float),
+    })
+
+
+def duplicate_report_from_pairs(df: pd.DataFrame, pairs: pd.DataFrame) -> Dict[str, Any]:
+    """Báo cáo nhóm trùng (cùng định dạng analyze_existing_duplicates) từ các cặp của duplicate_pairs"""
+    if df is None or df.empty or pairs is None or pairs.empty:
+        return _empty_report()
+    ids = pd.Series(np.arange(len(df)), index=df['Số đặt phòng'].astype(str).to_numpy())
+    ids = ids[~ids.index.duplicated()]
+    left = ids.reindex(pairs['left_id'].astype(str)).to_numpy()
+    right = ids.reindex(pairs['right_id'].astype(str)).to_numpy()
+    known = ~(np.isnan(left) | np.isnan(right))
+    matches = pd.DataFrame({
+        'left': np.minimum(left, right)[known].astype(np.int64),
+        'right': np.maximum(left, right)[known].astype(np.int64),
+        'date_diff': pairs['date_diff'].to_numpy()[known],
+        'price_diff': pairs['price_diff'].to_numpy()[known],
+    })
+
+    # Chỉ dựng frame cho các dòng có trong cặp
+    positions = np.unique(np.concatenate([matches['left'].to_numpy(), matches['right'].to_numpy()]))
+    frame = duplicate_frame(df.iloc[positions])
+    frame.index = positions[frame.index.to_numpy()]
+    matches = matches[matches['left'].isin(frame.index) & matches['right'].isin(frame.index)]
+
+    groups = group_duplicates(frame, matches)
+    return {
+        "duplicate_groups": groups,
+        "total_groups": len(groups),
+        "total_duplicates": sum(group["group_size"] for group in groups)
+    }
+
+
+def build_duplicate_report(df: pd.DataFrame) -> Dict[str, Any]:
+    """Báo cáo các nhóm booking trùng lặp, tính lại toàn bộ từ df"""
+    return duplicate_report_from_pairs(df, duplicate_pairs(df))
+
+
+def get_duplicate_report(df: pd.DataFrame) -> Dict[str, Any]:
+    """Báo cáo trùng lặp của df, tính một lần cho mỗi generation"""
+    if df is None or df.empty:
+        return _empty_report()
+    return get_derived(df, 'duplicate_report', build_duplicate_report)
+
+
+def check_new_bookings(df: pd.DataFrame, new_bookings: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    So các booking sắp thêm (guest_name, check_in_date, check_out_date, total_payment) với df.
+    Ứng viên lấy từ chỉ mục tên khách, sau đó chấm điểm cả lô bằng một phép tính vectorized:
+    ngày lệch <= 3 (+30), giá lệch <= 100k (+25), trùng đúng ngày (+45); >= 50 là trùng.
+    Mỗi booking mới lấy booking cũ đầu tiên (theo thứ tự trong sheet) đạt ngưỡng.
+    """
+    if df is None or df.empty or not new_bookings:
+        return {"has_duplicates": False, "duplicates": [], "clean_bookings": list(new_bookings or [])}
+
+    # Cặp (booking mới, dòng cũ) có tên khớp
+    pairs = []
+    for new_pos, booking in enumerate(new_bookings):
+        guest_name = str(booking.get('guest_name', '') or '').strip()
+        if guest_name:
+            # Chỉ tên chứa nhau: khớp gần đúng sẽ coi booking của khách khác tên là trùng
+            rows = guest_booking_rows(df, guest_name, fuzzy=False)
+            pairs.append(pd.DataFrame({'new_pos': new_pos, 'row': df.index.get_indexer(rows)}))
+    if not pairs:
+        return {"has_duplicates": False, "duplicates": [], "clean_bookings": list(new_bookings)}
+    pairs = pd.concat(pairs, ignore_index=True)
+
+    new = pd.DataFrame({
+        'check_in': [booking.get('check_in_date', '') for booking in new_bookings],
+        'check_out': [booking.get('check_out_date', '') for booking in new_bookings],
+        'payment': [booking.get('total_payment', 0) for booking in new_bookings],
+    })
+    new_in = _day_values(new['check_in'])[pairs['new_pos']]
+    new_out = _day_values(new['check_out'])[pairs['new_pos']]
+    new_payment = pd.to_numeric(new['payment'], errors='coerce').to_numpy(dtype=float)[pairs['new_pos']]
+
+    # Ngày của dòng cũ lấy từ cột ngày chuẩn đã tính sẵn cho generation này (không parse lại)
+    rows = pairs['row'].to_numpy()
+    candidates = df.iloc[rows]
+    dates = get_booking_dates(df)
+    old_in, old_out = dates.check_in[rows], dates.check_out[rows]
+    old_payment = pd.to_numeric(_column(candidates, 'Tổng thanh toán', 0), errors='coerce').to_numpy(dtype=float)
+
+    # NaT/NaN so sánh luôn ra False
+    in_diff, out_diff = np.abs(new_in - old_in), np.abs(new_out - old_out)
+    date_match = (in_diff <= np.timedelta64(DUPLICATE_DATE_TOLERANCE_DAYS, 'D')) & \
+                 (out_diff <= np.timedelta64(DUPLICATE_DATE_TOLERANCE_DAYS, 'D'))
+    price_match = np.abs(new_payment - old_payment) <= DUPLICATE_PRICE_TOLERANCE
+    exact_dates = (new_in == old_in) & (new_out == old_out)
+    scores = pairs.assign(score=30 * date_match + 25 * price_match + 45 * exact_dates,
+                          date_match=date_match, price_match=price_match, exact_dates=exact_dates)
+    first_hits = scores[scores['score'] >= 50].drop_duplicates('new_pos').set_index('new_pos')
+
+    duplicates, clean_bookings = [], []
+    for new_pos, booking in enumerate(new_bookings):
+        if new_pos not in first_hits.index:
+            clean_bookings.append(booking)
+            continue
+        hit = first_hits.loc[new_pos]
+        existing = df.iloc[int(hit['row'])]
+        duplicates.append({
+            "new_booking": booking,
+            "existing_booking": {
+                "booking_id": existing['Số đặt phòng'],
+                "guest_name": existing['Tên người đặt'],
+                "check_in_date": existing['Check-in Date'].strftime('%Y-%m-%d') if pd.notna(existing['Check-in Date']) else 'N/A',
+                "check_out_date": existing['Check-out Date'].strftime('%Y-%m-%d') if pd.notna(existing['Check-out Date']) else 'N/A',
+                "total_payment": existing.get('Tổng thanh toán', 0),
+                "status": existing.get('Tình trạng', 'N/A')
+            },
+            "confidence_score": int(hit['score']),
+            "match_reasons": {
+                "date_match": bool(hit['date_match']),
+                "price_match": bool(hit['price_match']),
+                "exact_dates": bool(hit['exact_dates'])
+            }
+        })
+
+    return {
+        "has_duplicates": len(duplicates) > 0,
+        "duplicates": duplicates,
+        "clean_bookings": clean_bookings
+    }
+
+
+def _day_values(values) -> np.ndarray:
+    """Ngày của booking mới (chuỗi hoặc datetime) -> datetime64[D], không đọc được là NaT"""
+    days = pd.to_datetime(pd.Series(values), errors='coerce', format='mixed')
+    return days.to_numpy(dtype='datetime64[ns]').astype('datetime64[D]')
@@ -0,0 +1,841 @@
+"""
+Chỉ mục tính sẵn trên DataFrame booking, dùng chung cho calendar và dashboard.
+
+Mỗi chỉ mục chỉ được tính một lần cho mỗi DataFrame: SharedBookingCache trả về cùng
+một DataFrame cho mọi request cho tới khi snapshot sang generation mới, nên chỉ mục
+sống đúng bằng generation đó và tự bỏ đi khi DataFrame cũ được giải phóng.
+"""
+import calendar
+import re
+import threading
+import unicodedata
+import weakref
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# {(id(df), generation, số dòng, tên chỉ mục): (weakref tới df, giá trị)}
+_derived_cache: Dict[Tuple[int, Any, int, str], Tuple[weakref.ref, Any]] = {}
+_derived_lock = threading.Lock()
+
+
+def get_derived(df: pd.DataFrame, name: str, build: Callable[[pd.DataFrame], Any]) -> Any:
+    """Trả về build(df), chỉ tính lần đầu cho mỗi DataFrame (theo generation của snapshot)"""
+    key = (id(df), df.attrs.get('snapshot_generation'), len(df), name)
+    with _derived_lock:
+        cached = _derived_cache.get(key)
+    if cached is not None and cached[0]() is df:
+        return cached[1]
+
+    value = build(df)
+    with _derived_lock:
+        # Dọn các chỉ mục của DataFrame đã bị giải phóng (generation cũ)
+        for stale_key in [k for k, (ref, _) in _derived_cache.items() if ref() is None]:
+            del _derived_cache[stale_key]
+        _derived_cache[key] = (weakref.ref(df), value)
+    return value
+
+
+def _to_day_array(series: pd.Series) -> np.ndarray:
+    """Cột ngày -> mảng datetime64[D] (bỏ giờ), ô không đọc được là NaT"""
+    if not pd.api.types.is_datetime64_any_dtype(series.dtype):
+        series = pd.to_datetime(series, errors='coerce')
+    return series.to_numpy(dtype='datetime64[ns]').astype('datetime64[D]')
+
+
+def _to_day(value) -> np.datetime64:
+    return pd.Timestamp(value).to_datetime64().astype('datetime64[D]')
+
+
+# date(1970, 1, 1).toordinal(): ordinal = số ngày của datetime64[D] + _EPOCH_ORDINAL
+_EPOCH_ORDINAL = 719163
+
+
+def _day_ordinals(days: np.ndarray) -> np.ndarray:
+    """datetime64[D] -> date.toordinal() dạng int64, NaT -> 0 (ordinal hợp lệ bắt đầu từ 1)"""
+    return np.where(np.isnat(days), 0, days.astype(np.int64) + _EPOCH_ORDINAL)
+
+
+class BookingDates:
+    """
+    Cột ngày chuẩn của df, cùng thứ tự dòng: check_in / check_out dạng datetime64[D] (NaT nếu
+    thiếu), check_in_ordinal / check_out_ordinal (date.toordinal(), 0 nếu thiếu) và active
+    (không bị hủy). Các route và chỉ mục khác đọc từ đây thay vì gọi lại pd.to_datetime hay
+    .dt.date trên cột đã parse.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        def column(name, default):
+            return df[name] if name in df.columns else pd.Series(default, index=df.index)
+
+        self.check_in = _to_day_array(column('Check-in Date', pd.NaT))
+        self.check_out = _to_day_array(column('Check-out Date', pd.NaT))
+        self.check_in_ordinal = _day_ordinals(self.check_in)
+        self.check_out_ordinal = _day_ordinals(self.check_out)
+        self.active = (column('Tình trạng', '') != 'Đã hủy').to_numpy()
+        self._months = None
+
+    def __len__(self) -> int:
+        return len(self.check_in)
+
+    @staticmethod
+    def _between(days: np.ndarray, first_day=None, last_day=None) -> np.ndarray:
+        mask = ~np.isnat(days)
+        if first_day is not None:
+            mask &= days >= _to_day(first_day)
+        if last_day is not None:
+            mask &= days <= _to_day(last_day)
+        return mask
+
+    def check_in_between(self, first_day=None, last_day=None) -> np.ndarray:
+        """Dòng có ngày check-in trong [first_day, last_day] (None là không giới hạn)"""
+        return self._between(self.check_in, first_day, last_day)
+
+    def check_out_between(self, first_day=None, last_day=None) -> np.ndarray:
+        return self._between(self.check_out, first_day, last_day)
+
+    def check_in_months(self) -> list:
+        """Các tháng (year, month) có booking check-in, tăng dần"""
+        if self._months is None:
+            months = np.unique(self.check_in[~np.isnat(self.check_in)].astype('datetime64[M]'))
+            self._months = [(int(m) // 12 + 1970, int(m) % 12 + 1) for m in months.astype(np.int64)]
+        return self._months
+
+
+def get_booking_dates(df: pd.DataFrame) -> BookingDates:
+    """Cột ngày chuẩn của df, tính một lần cho mỗi generation"""
+    return get_derived(df, 'dates', BookingDates)
+
+
+class BookingDayIndex:
+    """
+    Ngày -> vị trí dòng của các booking check-in / check-out trong ngày đó. Mỗi bảng là các
+    vị trí sắp theo (ngày, thứ tự sheet) cùng dict {số ngày: (đầu, cuối)}, nên tra một ngày
+    là O(1) + số booking của ngày đó. Dùng chung cho thông báo khách đến/đi trên dashboard,
+    email nhắc check-in/check-out và RAG.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        dates = get_booking_dates(df)
+        self.active = dates.active
+        self._check_in = self._build(dates.check_in)
+        self._check_out = self._build(dates.check_out)
+
+    @staticmethod
+    def _build(days: np.ndarray) -> Tuple[np.ndarray, Dict[int, Tuple[int, int]]]:
+        valid = np.flatnonzero(~np.isnat(days))
+        positions = valid[np.argsort(days[valid], kind='stable')]
+        keys, starts, counts = np.unique(days[positions].astype(np.int64), return_index=True, return_counts=True)
+        slices = {key: (start, start + count) for key, start, count in
+                  zip(keys.tolist(), starts.tolist(), counts.tolist())}
+        return positions, slices
+
+    def _rows(self, table, first_day, last_day=None, active_only: bool = False) -> np.ndarray:
+        positions, slices = table
+        first = int(_to_day(first_day).astype(np.int64))
+        last = first if last_day is None else int(_to_day(last_day).astype(np.int64))
+        parts = [positions[slice(*slices[key])] for key in range(first, last + 1) if key in slices]
+        rows = np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+        return rows[self.active[rows]] if active_only else rows
+
+    def check_ins(self, first_day, last_day=None, active_only: bool = False) -> np.ndarray:
+        """Vị trí dòng có check-in trong ngày first_day (hoặc [first_day, last_day]), theo ngày rồi thứ tự sheet"""
+        return self._rows(self._check_in, first_day, last_day, active_only)
+
+    def check_outs(self, first_day, last_day=None, active_only: bool = False) -> np.ndarray:
+        return self._rows(self._check_out, first_day, last_day, active_only)
+
+
+def get_booking_day_index(df: pd.DataFrame) -> BookingDayIndex:
+    """BookingDayIndex của df, dựng một lần cho mỗi generation"""
+    return get_derived(df, 'day_index', BookingDayIndex)
+
+
+class BookingIntervalIndex:
+    """
+    Khoảng lưu trú [check-in, check-out) của các booking chưa hủy, sắp theo ngày check-in.
+    Khách đang ở ngày D có check-in < D < check-out: tìm nhị phân khoảng check-in trong
+    (D - số đêm dài nhất, D) rồi chỉ lọc check-out trên khoảng đó, không quét cả DataFrame.
+    Check-in / check-out đúng ngày D lấy từ BookingDayIndex. Vị trí trả về theo thứ tự sheet.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        dates = get_booking_dates(df)
+        self._day_index = get_booking_day_index(df)
+        valid = np.flatnonzero(~np.isnat(dates.check_in) & dates.active)
+        self.positions = valid[np.argsort(dates.check_in[valid], kind='stable')]
+        self.check_in = dates.check_in[self.positions]
+        self.check_out = dates.check_out[self.positions]
+        stays = (self.check_out - self.check_in).astype(np.int64)[~np.isnat(self.check_out)]
+        self.max_nights = int(stays.max()) if len(stays) else 0
+
+    def staying_over(self, date) -> np.ndarray:
+        """Vị trí dòng của khách đang ở ngày date (check-in trước đó, check-out sau đó)"""
+        day = _to_day(date)
+        lo = np.searchsorted(self.check_in, day - np.timedelta64(self.max_nights, 'D'), side='left')
+        hi = np.searchsorted(self.check_in, day, side='left')
+        window = slice(lo, hi)
+        return np.sort(self.positions[window][self.check_out[window] > day])
+
+    def activity(self, date) -> Dict[str, np.ndarray]:
+        """{'check_in', 'check_out', 'staying_over'}: vị trí dòng của từng nhóm khách trong ngày date"""
+        return {
+            'check_in': self._day_index.check_ins(date, active_only=True),
+            'check_out': self._day_index.check_outs(date, active_only=True),
+            'staying_over': self.staying_over(date),
+        }
+
+    def activity_between(self, first_date, last_date) -> Dict[Any, Dict[str, np.ndarray]]:
+        """{datetime.date: activity(ngày đó)} cho mọi ngày từ first_date tới last_date (vd. cả tuần)"""
+        first, last = _to_day(first_date), _to_day(last_date)
+        return {day.astype(object): self.activity(day)
+                for day in np.arange(first, last + np.timedelta64(1, 'D'), dtype='datetime64[D]')}
+
+
+def get_booking_interval_index(df: pd.DataFrame) -> BookingIntervalIndex:
+    """BookingIntervalIndex của df, dựng một lần cho mỗi generation"""
+    return get_derived(df, 'interval_index', BookingIntervalIndex)
+
+
+class OccupancyIndex:
+    """
+    Số booking đang ở theo từng đêm, tính một lần bằng difference array:
+    +1 tại ngày check-in, -1 tại ngày check-out rồi cộng dồn.
+    Booking chiếm phòng đêm D nếu Check-in <= D < Check-out và không bị hủy.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.start = None
+        self.counts = np.zeros(0, dtype=np.int64)
+        if df is None or df.empty or 'Check-in Date' not in df.columns or 'Check-out Date' not in df.columns:
+            return
+
+        dates = get_booking_dates(df)
+        check_in, check_out = dates.check_in, dates.check_out
+        valid = ~np.isnat(check_in) & ~np.isnat(check_out) & (check_out > check_in) & dates.active
+        if not valid.any():
+            return
+
+        check_in, check_out = check_in[valid], check_out[valid]
+        self.start = check_in.min()
+        span = int((check_out.max() - self.start).astype(np.int64))
+        starts = (check_in - self.start).astype(np.int64)
+        ends = (check_out - self.start).astype(np.int64)
+        diff = np.bincount(starts, minlength=span + 1) - np.bincount(ends, minlength=span + 1)
+        self.counts = np.cumsum(diff)[:span]
+
+    def occupied_on(self, date) -> int:
+        """Số phòng có khách trong đêm của ngày date - O(1)"""
+        if self.start is None:
+            return 0
+        offset = int((_to_day(date) - self.start).astype(np.int64))
+        if 0 <= offset < len(self.counts):
+            return int(self.counts[offset])
+        return 0
+
+    def occupancy_between(self, first_date, last_date) -> np.ndarray:
+        """Số phòng có khách cho từng ngày từ first_date tới last_date (tính cả hai đầu)"""
+        first, last = _to_day(first_date), _to_day(last_date)
+        days = int((last - first).astype(np.int64)) + 1
+        result = np.zeros(max(days, 0), dtype=np.int64)
+        if self.start is None or days <= 0:
+            return result
+
+        begin = int((first - self.start).astype(np.int64))
+        src_from, src_to = max(begin, 0), min(begin + days, len(self.counts))
+        if src_from < src_to:
+            result[src_from - begin:src_to - begin] = self.counts[src_from:src_to]
+        return result
+
+    def occupancy_for_month(self, year: int, month: int) -> np.ndarray:
+        """Số phòng có khách cho từng ngày trong tháng (phần tử 0 là ngày 1)"""
+        _, last_day = calendar.monthrange(year, month)
+        return self.occupancy_between(pd.Timestamp(year, month, 1), pd.Timestamp(year, month, last_day))
+
+
+def get_occupancy_index(df: pd.DataFrame) -> OccupancyIndex:
+    """OccupancyIndex của df, dựng một lần cho mỗi generation của cache"""
+    if df is None:
+        return OccupancyIndex(df)
+    return get_derived(df, 'occupancy', OccupancyIndex)
+
+
+class DayRevenue(dict):
+    """
+    Doanh thu một ngày: {'daily_total', 'guest_count', 'bookings'}.
+    'bookings' (chi tiết từng booking) chỉ được tính khi có người đọc tới.
+    """
+
+    def __init__(self, daily_total: float, guest_count: int, load_bookings: Callable[[], list]):
+        super().__init__(daily_total=daily_total, guest_count=guest_count)
+        self._load_bookings = load_bookings
+
+    def __missing__(self, key):
+        if key != 'bookings':
+            raise KeyError(key)
+        bookings = self._load_bookings()
+        self['bookings'] = bookings
+        return bookings
+
+    def get(self, key, default=None):
+        return self[key] if key == 'bookings' else super().get(key, default)
+
+
+class NightlyRevenue:
+    """
+    Doanh thu chia đều theo đêm ở (Tổng thanh toán / số đêm) cho mọi booking không hủy.
+    Mỗi booking được tách thành các dòng "đêm" bằng np.repeat/arange, sắp theo ngày,
+    nên tổng theo ngày là một lần reduceat và chi tiết một ngày là một lần searchsorted.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self._windows = {}
+        self._windows_lock = threading.Lock()
+        empty_days = np.array([], dtype='datetime64[D]')
+        self.check_in = self.check_out = self.night = empty_days
+        self.nights = self.booking = np.array([], dtype=np.int64)
+        self.total = self.rate = np.array([], dtype=np.float64)
+        self.booking_ids = self.guest_names = np.array([], dtype=object)
+
+        required = {'Check-in Date', 'Check-out Date', 'Tổng thanh toán'}
+        if df is None or df.empty or not required <= set(df.columns):
+            return
+
+        dates = get_booking_dates(df)
+        check_in, check_out = dates.check_in, dates.check_out
+        total = pd.to_numeric(df['Tổng thanh toán'], errors='coerce').to_numpy(dtype=np.float64)
+        # Booking check-out <= check-in không có đêm nào nên không tính
+        valid = ~np.isnat(check_in) & ~np.isnat(check_out) & (check_out > check_in) & (total > 0) & dates.active
+
+        self.check_in, self.check_out, self.total = check_in[valid], check_out[valid], total[valid]
+        self.nights = (self.check_out - self.check_in).astype(np.int64)
+        self.rate = self.total / np.maximum(self.nights, 1)
+        self.booking_ids = self._column(df, 'Số đặt phòng', valid)
+        self.guest_names = self._column(df, 'Tên người đặt', valid)
+
+        # Tách mỗi booking thành từng đêm: ngày check-in + 0, 1, ..., số đêm - 1
+        booking = np.repeat(np.arange(len(self.nights)), self.nights)
+        first_night_pos = np.repeat(np.cumsum(self.nights) - self.nights, self.nights)
+        offsets = np.arange(len(booking)) - first_night_pos
+        night = self.check_in[booking] + offsets.astype('timedelta64[D]')
+
+        order = np.argsort(night, kind='stable')
+        self.night = night[order]
+        self.booking = booking[order]
+
+    @staticmethod
+    def _column(df: pd.DataFrame, column: str, mask: np.ndarray) -> np.ndarray:
+        if column not in df.columns:
+            return np.full(int(mask.sum()), 'N/A', dtype=object)
+        return df[column].to_numpy(dtype=object)[mask]
+
+    def _night_mask(self, first_check_in, last_check_in) -> np.ndarray:
+        """Các dòng đêm thuộc booking có check-in trong [first_check_in, last_check_in]"""
+        check_in = self.check_in[self.booking]
+        return (check_in >= _to_day(first_check_in)) & (check_in <= _to_day(last_check_in))
+
+    def daily_revenue(self, first_check_in, last_check_in) -> Dict[Any, DayRevenue]:
+        """
+        {date: DayRevenue} cho các booking có check-in trong khoảng đã cho (tính cả hai đầu).
+        Kết quả được giữ lại theo khoảng, các lần gọi sau trả về cùng dict.
+        """
+        window = (_to_day(first_check_in), _to_day(last_check_in))
+        with self._windows_lock:
+            cached = self._windows.get(window)
+        if cached is not None:
+            return cached
+
+        mask = self._night_mask(*window)
+        nights = self.night[mask]
+        rates = self.rate[self.booking[mask]]
+        result = {}
+        if len(nights):
+            days, starts, counts = np.unique(nights, return_index=True, return_counts=True)
+            totals = np.add.reduceat(rates, starts)
+            for day, total, count in zip(days.astype(object), totals.tolist(), counts.tolist()):
+                result[day] = DayRevenue(total, count, lambda day=day: self.bookings_on(day, *window))
+
+        with self._windows_lock:
+            self._windows[window] = result
+        return result
+
+    def bookings_on(self, date, first_check_in=None, last_check_in=None) -> list:
+        """Chi tiết doanh thu từng booking ở trong đêm date (lọc theo khoảng check-in nếu có)"""
+        day = _to_day(date)
+        lo, hi = np.searchsorted(self.night, day, side='left'), np.searchsorted(self.night, day, side='right')
+        bookings = self.booking[lo:hi]
+        if first_check_in is not None and last_check_in is not None:
+            check_in = self.check_in[bookings]
+            bookings = bookings[(check_in >= _to_day(first_check_in)) & (check_in <= _to_day(last_check_in))]
+
+        return [{
+            'guest_name': self.guest_names[b],
+            'booking_id': self.booking_ids[b],
+            'daily_amount': float(self.rate[b]),
+            'total_amount': float(self.total[b]),
+            'nights': int(self.nights[b]),
+            'checkin': self.check_in[b].astype(object),
+            'checkout': self.check_out[b].astype(object),
+        } for b in bookings.tolist()]
+
+
+def get_nightly_revenue(df: pd.DataFrame) -> NightlyRevenue:
+    """NightlyRevenue của df, dựng một lần cho mỗi generation của cache"""
+    if df is None:
+        return NightlyRevenue(df)
+    return get_derived(df, 'nightly_revenue', NightlyRevenue)
+
+
+# Người thu tiền được tính là "đã thu" trên dashboard
+COLLECTED_BY = ['LOC LE', 'THAO LE']
+
+# Các chiều của bảng rollup toàn thời gian (lưu cùng snapshot, xem booking_store)
+ROLLUP_DIMENSIONS = ('month', 'week', 'collector', 'genius')
+ROLLUP_COLUMNS = ['dimension', 'bucket', 'revenue', 'collected_revenue', 'collected_count', 'booking_count']
+
+
+def normalize_booking_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Các cột dashboard/rollup cần, chuẩn hóa một lần: ngày check-in/check-out (bỏ giờ),
+    tháng, tuần, tiền, người thu, Genius, đã hủy. Index là vị trí dòng trong df (0..n-1).
+    """
+    if df is None:
+        df = pd.DataFrame()
+
+    def column(name, default):
+        series = df[name] if name in df.columns else pd.Series(default, index=df.index)
+        return series.reset_index(drop=True)
+
+    # Ngày lấy từ cột ngày chuẩn của generation (không parse lại)
+    dates = get_booking_dates(df)
+    check_in = pd.Series(dates.check_in.astype('datetime64[ns]'))
+    collector = column('Người thu tiền', '').fillna('').astype(str)
+    frame = pd.DataFrame({
+        'check_in': check_in,
+        'check_in_day': check_in,
+        'check_out_day': dates.check_out.astype('datetime64[ns]'),
+        'month': check_in.dt.to_period('M'),
+        'week': check_in.dt.to_period('W'),
+        'amount': pd.to_numeric(column('Tổng thanh toán', 0), errors='coerce').fillna(0),
+        'collector': collector,
+        'genius': column('Thành viên Genius', None),
+        'cancelled': ~dates.active,
+    }, index=pd.RangeIndex(len(df)))
+    frame['has_collector'] = ~frame['collector'].isin(['', 'N/A'])
+    frame['is_collected'] = frame['collector'].isin(COLLECTED_BY)
+    return frame
+
+
+def rollups_from_frame(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    Bảng rollup (dimension, bucket, revenue, collected_revenue, collected_count, booking_count)
+    theo tháng, tuần ISO, người thu tiền và Genius. Dòng không có khóa (ngày lỗi...) bị bỏ qua
+    giống groupby của pandas.
+    """
+    values = pd.DataFrame({
+        'revenue': frame['amount'],
+        'collected_revenue': frame['amount'].where(frame['has_collector'], 0),
+        'collected_count': frame['has_collector'].astype(np.int64),
+        'booking_count': np.ones(len(frame), dtype=np.int64),
+    }, index=frame.index)
+
+    keys = {
+        'month': frame['month'].dt.strftime('%Y-%m'),
+        'week': frame['week'].astype(str).where(frame['week'].notna()),
+        'collector': frame['collector'],
+        'genius': frame['genius'].astype(object).where(frame['genius'].notna()),
+    }
+    parts = []
+    for dimension in ROLLUP_DIMENSIONS:
+        grouped = values.groupby(keys[dimension].astype(object).to_numpy()).sum()
+        if grouped.empty:
+            continue
+        grouped.insert(0, 'bucket', grouped.index.astype(str))
+        grouped.insert(0, 'dimension', dimension)
+        parts.append(grouped.reset_index(drop=True))
+
+    if not parts:
+        return pd.DataFrame(columns=ROLLUP_COLUMNS)
+    return pd.concat(parts, ignore_index=True)[ROLLUP_COLUMNS]
+
+
+def compute_booking_rollups(df: pd.DataFrame) -> pd.DataFrame:
+    """Bảng rollup toàn thời gian của df (dùng khi lưu snapshot và khi vá dòng)"""
+    return rollups_from_frame(normalize_booking_frame(df))
+
+
+def rollup_tables(rollups: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """Các bảng toàn thời gian của dashboard dựng từ bảng rollup (vài trăm dòng)"""
+    def dimension(name):
+        return rollups[rollups['dimension'] == name].sort_values('bucket')
+
+    month = dimension('month')
+    collected = month[month['collected_count'] > 0]
+    week = dimension('week')
+    genius = dimension('genius')
+    collector = dimension('collector')
+    return {
+        'monthly_revenue': pd.DataFrame({'Tháng': month['bucket'].to_numpy(), 'Doanh thu': month['revenue'].to_numpy()}),
+        'monthly_collected_revenue': pd.DataFrame({'Tháng': collected['bucket'].to_numpy(),
+                                                   'Doanh thu đã thu': collected['collected_revenue'].to_numpy()}),
+        'monthly_guests': pd.DataFrame({'Tháng': month['bucket'].to_numpy(), 'Số khách': month['booking_count'].to_numpy()}),
+        'weekly_guests': pd.DataFrame({'Tuần': week['bucket'].to_numpy(), 'Số khách': week['booking_count'].to_numpy()}),
+        'genius_stats': pd.DataFrame({'Thành viên Genius': genius['bucket'].to_numpy(),
+                                      'Tổng doanh thu': genius['revenue'].to_numpy(),
+                                      'Số lượng booking': genius['booking_count'].to_numpy()}),
+        'collector_revenue': pd.DataFrame({'Người thu tiền': collector['bucket'].to_numpy(),
+                                           'Tổng thanh toán': collector['revenue'].to_numpy(),
+                                           'Số booking': collector['booking_count'].to_numpy()}),
+    }
+
+
+class DashboardAggregates:
+    """
+    Các cột dashboard cần được chuẩn hóa một lần cho mỗi generation (normalize_booking_frame).
+    Bảng toàn thời gian lấy từ rollup đã lưu cùng snapshot nếu có, nếu không thì tính từ frame.
+    Không giữ tham chiếu tới df để df cũ được giải phóng khi sang generation mới.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.frame = normalize_booking_frame(df)
+        self._all_time = None
+
+    def all_time_tables(self, rollups: Optional[pd.DataFrame] = None) -> Dict[str, pd.DataFrame]:
+        """Bảng toàn thời gian; rollups là bảng đã lưu (đúng generation), None thì tính từ frame"""
+        if rollups is not None:
+            return rollup_tables(rollups)
+        if self._all_time is None:
+            self._all_time = rollup_tables(rollups_from_frame(self.frame))
+        return self._all_time
+
+    def check_in_mask(self, first_day, last_day) -> pd.Series:
+        """Booking có ngày check-in trong [first_day, last_day]"""
+        day = self.frame['check_in_day']
+        return (day >= pd.Timestamp(first_day).normalize()) & (day <= pd.Timestamp(last_day).normalize())
+
+    def period_summary(self, start_date, end_date, today) -> dict:
+        """
+        Thống kê cho khoảng check-in [start_date, end_date] (bỏ booking tương lai sau today):
+        tổng doanh thu, số khách, doanh thu theo người thu, đã thu/chưa thu theo tháng.
+        """
+        frame = self.frame
+        last_day = min(pd.Timestamp(end_date).normalize(), pd.Timestamp(today).normalize())
+        period = frame[self.check_in_mask(start_date, last_day)]
+
+        by_collector = period[period['has_collector']].groupby('collector')['amount'].sum()
+        collector_revenue = pd.DataFrame({'Người thu tiền': by_collector.index.astype(object),
+                                          'Tổng thanh toán': by_collector.to_numpy()})
+
+        monthly = period.assign(
+            collected_amount=period['amount'].where(period['is_collected'], 0),
+            uncollected_amount=period['amount'].where(~period['is_collected'], 0),
+            uncollected=~period['is_collected'],
+        ).groupby('month').agg(
+            collected=('collected_amount', 'sum'),
+            uncollected=('uncollected_amount', 'sum'),
+            uncollected_count=('uncollected', 'sum'),
+        )
+        monthly_with_unpaid = [{
+            'Tháng': month.strftime('%Y-%m'),
+            'Đã thu': collected,
+            'Chưa thu': uncollected,
+            'Số khách chưa thu': uncollected_count,
+        } for month, collected, uncollected, uncollected_count in zip(
+            monthly.index, monthly['collected'].tolist(), monthly['uncollected'].tolist(),
+            monthly['uncollected_count'].tolist())]
+
+        return {
+            'total_revenue': period['amount'].sum(),
+            'total_guests': len(period),
+            'collector_revenue': collector_revenue,
+            'monthly_revenue_with_unpaid': monthly_with_unpaid,
+        }
+
+
+def get_dashboard_aggregates(df: pd.DataFrame) -> DashboardAggregates:
+    """DashboardAggregates của df, dựng một lần cho mỗi generation của cache"""
+    if df is None:
+        return DashboardAggregates(df)
+    return get_derived(df, 'dashboard', DashboardAggregates)
+
+
+# Các cột được đưa vào ô tìm kiếm của trang Bookings
+SEARCH_COLUMNS = ['Số đặt phòng', 'Tên người đặt', 'Tên chỗ nghỉ', 'Tình trạng', 'Người thu tiền',
+                  'Ghi chú thanh toán', 'Ghi chú']
+# Ngăn cách giữa các cột để từ khóa không khớp "vắt" qua hai cột
+_FIELD_SEPARATOR = '\x1f'
+
+
+def fold_text(text: str) -> str:
+    """Chữ thường, bỏ dấu tiếng Việt ('Nguyễn Đức' -> 'nguyen duc') để tìm không cần gõ dấu"""
+    text = unicodedata.normalize('NFD', str(text).lower())
+    return ''.join(ch for ch in text if not unicodedata.combining(ch)).replace('đ', 'd')
+
+
+def fold_series(series: pd.Series) -> pd.Series:
+    """fold_text cho cả cột (vectorized)"""
+    return (series.fillna('').astype(str).str.lower().str.normalize('NFD')
+            .str.replace(r'[̀-ͯ]', '', regex=True).str.replace('đ', 'd', regex=False))
+
+
+class BookingSearchIndex:
+    """
+    Cột tìm kiếm dựng sẵn cho mỗi generation: các cột trong SEARCH_COLUMNS được ghép lại,
+    chuyển chữ thường và bỏ dấu. Mỗi truy vấn chỉ còn một lần str.contains trên cột này.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        if df is None:
+            df = pd.DataFrame()
+        self.index = df.index
+        columns = [column for column in SEARCH_COLUMNS if column in df.columns]
+        if columns:
+            joined = df[columns[0]].fillna('').astype(str)
+            for column in columns[1:]:
+                joined = joined + _FIELD_SEPARATOR + df[column].fillna('').astype(str)
+            self.text = fold_series(joined)
+        else:
+            self.text = pd.Series('', index=df.index, dtype=object)
+
+    def mask(self, query: str, prefix: bool = False) -> pd.Series:
+        """
+        Mask (theo index của df) các booking chứa query.
+        prefix=True: query phải khớp từ đầu một từ ('ngu' khớp 'Nguyễn' nhưng không khớp 'Tnguyen').
+        """
+        folded = fold_text(query).strip()
+        if not folded:
+            return pd.Series(True, index=self.index)
+        if prefix:
+            pattern = r'(?:^|[\s' + _FIELD_SEPARATOR + r'])' + re.escape(folded)
+            return self.text.str.contains(pattern, regex=True)
+        return self.text.str.contains(folded, regex=False)
+
+    def filter(self, df: pd.DataFrame, query: str, prefix: bool = False) -> pd.DataFrame:
+        """Lọc df (có thể là một phần của DataFrame đã dựng index) theo query"""
+        if not fold_text(query).strip():
+            return df
+        matches = self.mask(query, prefix)
+        return df[matches.reindex(df.index, fill_value=False).to_numpy()]
+
+
+def get_search_index(df: pd.DataFrame) -> BookingSearchIndex:
+    """BookingSearchIndex của df, dựng một lần cho mỗi generation của cache"""
+    if df is None:
+        return BookingSearchIndex(df)
+    return get_derived(df, 'search', BookingSearchIndex)
+
+
+class GuestNameIndex:
+    """
+    Chỉ mục tên khách: tên được bỏ dấu/chữ thường rồi tách thành trigram ký tự.
+    - rows_containing(name): các dòng có tên chứa name (giao các danh sách trigram rồi kiểm tra lại)
+    - lookup(name): ứng viên xếp hạng theo độ giống (Jaccard trên trigram), bắt được cả
+      'Nguyen' / 'Nguyễn' hay gõ sai một vài ký tự
+    Tên giống nhau chỉ được lập chỉ mục một lần.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        if df is None or 'Tên người đặt' not in df.columns:
+            df = pd.DataFrame({'Tên người đặt': []})
+        self.index = df.index
+        folded = fold_series(df['Tên người đặt']).str.split().str.join(' ')
+        # codes[i] là mã tên (trong self.names) của dòng thứ i
+        self._codes, names = pd.factorize(folded)
+        self.names = np.asarray(names, dtype=object)
+
+        postings: Dict[str, list] = {}
+        self._trigram_counts = np.zeros(len(self.names), dtype=np.int32)
+        for name_id, name in enumerate(self.names):
+            grams = _trigrams(name)
+            self._trigram_counts[name_id] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(name_id)
+        self._postings = {gram: np.asarray(ids, dtype=np.int32) for gram, ids in postings.items()}
+
+    def _rows_of(self, name_ids: np.ndarray) -> np.ndarray:
+        """Vị trí (trong df) các dòng có tên thuộc name_ids, theo thứ tự trong df"""
+        selected = np.zeros(len(self.names) + 1, dtype=bool)
+        selected[name_ids] = True
+        # codes = -1 (tên trống) trỏ vào phần tử cuối, luôn False
+        return np.flatnonzero(selected[self._codes])
+
+    def _names_containing(self, query: str) -> np.ndarray:
+        grams = _trigrams(query, pad=False)
+        if not grams:
+            # Chuỗi 1-2 ký tự: quét danh sách tên (không trùng), vẫn nhỏ hơn nhiều so với số dòng
+            return np.asarray([i for i, name in enumerate(self.names) if query in name], dtype=np.int32)
+        candidates = None
+        for gram in sorted(grams, key=lambda g: len(self._postings.get(g, ()))):
+            ids = self._postings.get(gram)
+            if ids is None:
+                return np.empty(0, dtype=np.int32)
+            candidates = ids if candidates is None else np.intersect1d(candidates, ids, assume_unique=True)
+            if len(candidates) == 0:
+                return candidates
+        return np.asarray([i for i in candidates if query in self.names[i]], dtype=np.int32)
+
+    def rows_containing(self, name: str) -> pd.Index:
+        """Index các booking có tên khách chứa name (không phân biệt hoa thường, dấu)"""
+        query = ' '.join(fold_text(name).split())
+        if not query:
+            return self.index[:0]
+        return self.index[self._rows_of(self._names_containing(query))]
+
+    def lookup(self, name: str, limit: int = 10, min_score: float = 0.3) -> list:
+        """
+        Các tên khách gần giống name nhất: [(tên đã bỏ dấu, điểm 0-1, Index các booking), ...]
+        Tên chứa nguyên chuỗi tìm kiếm được xếp trước, sau đó theo độ giống trigram.
+        """
+        query = ' '.join(fold_text(name).split())
+        grams = _trigrams(query)
+        if not grams:
+            return []
+        hits = [self._postings[gram] for gram in grams if gram in self._postings]
+        if not hits:
+            return []
+        shared = np.bincount(np.concatenate(hits), minlength=len(self.names))
+        name_ids = np.flatnonzero(shared)
+        scores = shared[name_ids] / (len(grams) + self._trigram_counts[name_ids] - shared[name_ids])
+        contains = np.isin(name_ids, self._names_containing(query))
+        keep = (scores >= min_score) | contains
+        name_ids, scores, contains = name_ids[keep], scores[keep], contains[keep]
+        ranked = np.lexsort((-scores, ~contains))[:limit]
+        return [(self.names[name_ids[i]], round(float(scores[i]), 3), self.index[self._rows_of(name_ids[i:i + 1])])
+                for i in ranked]
+
+
+def _trigrams(text: str, pad: bool = True) -> set:
+    """Tập trigram ký tự; pad thêm khoảng trắng hai đầu để đầu/cuối tên có trọng số"""
+    if pad:
+        text = f"  {text} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def get_guest_name_index(df: pd.DataFrame) -> GuestNameIndex:
+    """GuestNameIndex của df, dựng một lần cho mỗi generation của snapshot"""
+    if df is None:
+        return GuestNameIndex(df)
+    return get_derived(df, 'guest_names', GuestNameIndex)
+
+
+def guest_booking_rows(df: pd.DataFrame, guest_name: str, fuzzy: bool = True,
+                       min_score: float = 0.5) -> pd.Index:
+    """
+    Index các booking của khách guest_name theo thứ tự trong sheet.
+    Ưu tiên các tên chứa guest_name (bỏ dấu); nếu không có và fuzzy=True thì lấy
+    (các) tên giống nhất có điểm >= min_score. Khớp gần đúng chỉ dành cho tra cứu (RAG,
+    ngữ cảnh khách): kiểm tra trùng phải gọi với fuzzy=False, nếu không "Nguyen Van Binh"
+    sẽ khớp booking của "Nguyen Van Anh".
+    """
+    index = get_guest_name_index(df)
+    rows = index.rows_containing(guest_name)
+    if len(rows) == 0 and fuzzy:
+        candidates = index.lookup(guest_name, limit=1, min_score=min_score)
+        if candidates:
+            rows = candidates[0][2]
+    return rows
+
+
+def find_guest_bookings(df: pd.DataFrame, guest_name: str, fuzzy: bool = True,
+                        min_score: float = 0.5) -> pd.DataFrame:
+    """Các booking của khách guest_name (xem guest_booking_rows)"""
+    if df is None or df.empty or not str(guest_name or '').strip():
+        return df.iloc[0:0] if df is not None else pd.DataFrame()
+    return df.loc[guest_booking_rows(df, guest_name, fuzzy, min_score)]
+
+
+class SortedBookings:
+    """
+    Thứ tự sắp xếp dựng sẵn theo một cột (mỗi generation một lần) cho keyset pagination.
+    Các dòng được xếp theo (giá trị cột, Số đặt phòng), giá trị trống luôn ở cuối.
+    Cursor là (giá trị, Số đặt phòng) của dòng cuối trang trước nên vẫn đúng khi
+    snapshot sang generation mới giữa hai lần tải trang.
+    """
+
+    def __init__(self, df: pd.DataFrame, column: str, ascending: bool = True):
+        self.column = column
+        self.ascending = ascending
+        values = df[column] if column in df.columns else pd.Series(np.nan, index=df.index)
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(object)
+        self.is_datetime = pd.api.types.is_datetime64_any_dtype(values.dtype)
+        self.is_numeric = not self.is_datetime and pd.api.types.is_numeric_dtype(values.dtype)
+        if not self.is_datetime and not self.is_numeric:
+            values = values.where(values.isna(), values.astype(str))
+
+        codes, self._uniques = pd.factorize(values, sort=True)
+        self._null_code = len(self._uniques)
+        codes = np.where(codes < 0, self._null_code, codes if ascending else self._null_code - 1 - codes)
+        ids = df['Số đặt phòng'].astype(str).to_numpy() if 'Số đặt phòng' in df.columns else \
+            np.arange(len(df)).astype(str)
+
+        self.order = np.lexsort((ids, codes))
+        self._sorted_codes = codes[self.order]
+        self._sorted_ids = ids[self.order]
+
+    def _code_after(self, value) -> Tuple[int, bool]:
+        """(code của value, value có trong dữ liệu hay không) theo chiều sắp xếp"""
+        if value is None:
+            return self._null_code, True
+        if self.is_datetime:
+            value = pd.Timestamp(value)
+        elif self.is_numeric:
+            value = float(value)
+        else:
+            value = str(value)
+        pos = int(self._uniques.searchsorted(value))
+        exact = pos < len(self._uniques) and self._uniques[pos] == value
+        if self.ascending:
+            return pos, exact
+        # Giảm dần: các giá trị nhỏ hơn value có code từ null_code - pos trở đi
+        return (self._null_code - 1 - pos, True) if exact else (self._null_code - pos, False)
+
+    def start_after(self, cursor: Optional[Tuple[Any, str]]) -> int:
+        """Vị trí (trong self.order) của dòng đầu tiên đứng sau cursor"""
+        if cursor is None:
+            return 0
+        value, booking_id = cursor
+        code, exact = self._code_after(value)
+        if not exact:
+            return int(np.searchsorted(self._sorted_codes, code, 'left'))
+        lo = int(np.searchsorted(self._sorted_codes, code, 'left'))
+        hi = int(np.searchsorted(self._sorted_codes, code, 'right'))
+        return lo + int(np.searchsorted(self._sorted_ids[lo:hi], str(booking_id), 'right'))
+
+    def page(self, cursor: Optional[Tuple[Any, str]] = None, limit: int = 50,
+             mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, bool]:
+        """
+        (vị trí các dòng của trang, còn trang sau hay không).
+        mask: mảng bool theo vị trí dòng trong df (ví dụ kết quả tìm kiếm).
+        """
+        rest = self.order[self.start_after(cursor):]
+        if mask is not None:
+            rest = rest[mask[rest]]
+        return rest[:limit], len(rest) > limit
+
+    def take(self, df: pd.DataFrame, subset_index: Optional[pd.Index] = None) -> pd.DataFrame:
+        """df theo thứ tự này (không cần sort lại); subset_index: chỉ lấy các dòng có index trong đó"""
+        order = self.order
+        if subset_index is not None:
+            order = order[df.index.isin(subset_index)[order]]
+        return df.iloc[order]
+
+    def cursor_for(self, df: pd.DataFrame, position: int) -> Tuple[Any, str]:
+        """Cursor (giá trị, Số đặt phòng) của dòng ở vị trí position"""
+        value = df[self.column].iloc[position] if self.column in df.columns else None
+        if pd.isna(value):
+            value = None
+        elif self.is_datetime:
+            value = pd.Timestamp(value).isoformat()
+        elif self.is_numeric:
+            value = float(value)
+        else:
+            value = str(value)
+        return value, str(df['Số đặt phòng'].iloc[position])
+
+
+def get_sorted_bookings(df: pd.DataFrame, column: str, ascending: bool = True) -> SortedBookings:
+    """SortedBookings của df theo column, dựng một lần cho mỗi generation"""
+    return get_derived(df, f"sorted:{column}:{'asc' if ascending else 'desc'}",
+                       lambda frame: SortedBookings(frame, column, ascending))
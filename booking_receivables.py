@@ -0,0 +1,103 @@
+"""
+Bảng công nợ (khách đã check-in nhưng chưa thu tiền) tính sẵn cho mỗi generation.
+
+Tiền phòng và tiền taxi đi qua cùng một bộ đọc tiền dạng cột (money.parse_money_series),
+số ngày quá hạn tính bằng phép trừ datetime64[D] của NumPy. Bảng chỉ phụ thuộc dữ liệu,
+không phụ thuộc ngày hôm nay: mọi khách chưa thu, chưa hủy đều được giữ lại và sắp theo
+ngày check-in, mỗi lần hỏi chỉ cắt lấy phần check-in <= hôm nay. Panel quá hạn trên
+dashboard và email nhắc thanh toán (reminder_system) dùng chung bảng này.
+"""
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from booking_indexes import COLLECTED_BY, _to_day, get_booking_dates, get_derived
+from money import parse_money_series
+
+
+class Receivables:
+    """
+    Các booking chưa hủy, chưa thu (Người thu tiền không phải LOC LE/THAO LE), có ngày
+    check-in hợp lệ, sắp theo check-in tăng dần (giữ thứ tự sheet khi trùng ngày).
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        def column(name, default):
+            return df[name] if name in df.columns else pd.Series(default, index=df.index)
+
+        dates = get_booking_dates(df)
+        check_in = dates.check_in
+        collector = column('Người thu tiền', '').astype(object).fillna('').astype(str)
+        unpaid = ~np.isnat(check_in) & ~collector.isin(COLLECTED_BY).to_numpy() & dates.active
+
+        positions = np.flatnonzero(unpaid)
+        order = np.argsort(check_in[positions], kind='stable')
+        self.positions = positions[order]
+        self.check_in = check_in[self.positions]
+
+        room = parse_money_series(column('Tổng thanh toán', 0)).to_numpy()
+        taxi = parse_money_series(column('Taxi', '')).to_numpy()
+        self.room_fee = room[self.positions]
+        self.taxi_fee = taxi[self.positions]
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def due_count(self, today) -> int:
+        """Số khách đã check-in tới hết ngày today mà chưa thu tiền"""
+        return int(np.searchsorted(self.check_in, _to_day(today), side='right'))
+
+    def overdue(self, today) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (chỉ số trong bảng, số ngày quá hạn) của khách quá hạn tới ngày today,
+        quá hạn lâu nhất trước; cùng số ngày thì giữ thứ tự sheet.
+        """
+        count = self.due_count(today)
+        days = (_to_day(today) - self.check_in[:count]).astype('int64')
+        order = np.lexsort((self.positions[:count], -days))
+        return order, days[order]
+
+    def totals(self, today) -> Dict[str, float]:
+        count = self.due_count(today)
+        room = float(self.room_fee[:count].sum())
+        taxi = float(self.taxi_fee[:count].sum())
+        return {'count': count, 'room_fee': room, 'taxi_fee': taxi, 'total': room + taxi}
+
+
+def get_receivables(df: pd.DataFrame) -> Receivables:
+    """Bảng công nợ của df, chỉ tính một lần cho mỗi generation"""
+    return get_derived(df, 'receivables', Receivables)
+
+
+def overdue_bookings(df: pd.DataFrame, today: Optional[date] = None) -> pd.DataFrame:
+    """
+    Các dòng của df đã check-in (<= today) mà chưa thu tiền, kèm days_overdue,
+    calculated_room_fee, calculated_taxi_fee, calculated_total_amount.
+    """
+    if df is None or df.empty:
+        return pd.DataFrame()
+
+    today = today or datetime.today().date()
+    receivables = get_receivables(df)
+    rows, days = receivables.overdue(today)
+
+    overdue_df = df.iloc[receivables.positions[rows]].copy()
+    overdue_df['days_overdue'] = days
+    overdue_df['calculated_room_fee'] = receivables.room_fee[rows]
+    overdue_df['calculated_taxi_fee'] = receivables.taxi_fee[rows]
+    overdue_df['calculated_total_amount'] = overdue_df['calculated_room_fee'] + overdue_df['calculated_taxi_fee']
+    return overdue_df
+
+
+def overdue_guest_records(df: pd.DataFrame, today: Optional[date] = None) -> Tuple[List[Dict[str, Any]], float]:
+    """(danh sách khách quá hạn dạng records, tổng tiền phòng + taxi phải thu)"""
+    if df is None or df.empty or 'Check-in Date' not in df.columns:
+        return [], 0
+
+    today = today or datetime.today().date()
+    overdue_df = overdue_bookings(df, today)
+    if overdue_df.empty:
+        return [], 0
+    return overdue_df.to_dict('records'), get_receivables(df).totals(today)['total']
@@ -0,0 +1,1016 @@
+"""
+Booking Snapshot Store - Local persistent booking cache
+Lưu DataFrame booking đã parse (đúng kiểu dữ liệu) vào SQLite cạnh ứng dụng,
+để worker khởi động lại hoặc cache miss đọc từ đĩa trong vài mili-giây và chỉ
+tải lại từ Google Sheets khi snapshot đã cũ.
+
+Shared cache: mỗi gunicorn worker giữ một bản DataFrame trong bộ nhớ nhưng chỉ
+dùng lại khi `generation` trong SQLite chưa đổi, nên invalidate ở một worker có
+hiệu lực ngay với mọi worker.
+
+Row index: snapshot giữ thêm map Số đặt phòng -> số hàng trong sheet (lấy lúc tải
+toàn bộ, cập nhật khi append/xóa hàng) để update_row_in_gsheet không phải tải cả
+sheet chỉ để tìm một hàng. Trong lúc đang xóa hàng (số hàng đang dịch chuyển) map
+này không được dùng.
+
+Delta sync: sau khi ghi một booking lên Sheets, dòng đó được vá thẳng vào
+snapshot (kèm fingerprint theo Số đặt phòng) thay vì tải lại cả sheet. Việc
+tải lại toàn bộ chỉ xảy ra theo lịch (BOOKING_SNAPSHOT_MAX_AGE) hoặc khi
+header của sheet thay đổi.
+
+Rollup: bảng booking_rollups lưu doanh thu/số booking theo tháng, tuần ISO, người thu
+tiền và Genius cho mỗi snapshot. Bảng được dựng lại khi lưu toàn bộ và cộng/trừ phần
+chênh lệch của các dòng bị vá, nên biểu đồ toàn thời gian của dashboard chỉ đọc vài
+trăm dòng thay vì groupby lại toàn bộ lịch sử.
+
+Duplicate pairs: bảng booking_duplicate_pairs lưu các cặp booking trùng (xem booking_duplicates).
+Khi vá snapshot chỉ các cặp của booking bị thêm/sửa/xóa được tính lại, nên trang Bookings và
+/api/analyze_duplicates không phải phân tích trùng lặp trên toàn bộ dữ liệu.
+
+Trong một process, load() trả về cùng một DataFrame cho tới khi generation đổi, nên
+dashboard, kiểm tra trùng, RAG và reminder dùng chung các chỉ mục trong booking_indexes.
+"""
+
+import bisect
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import pandas as pd
+
+from logic import import_from_gsheet, convert_booking_dtypes, update_booking_by_id, delete_booking_by_id
+from booking_indexes import compute_booking_rollups, get_derived, ROLLUP_COLUMNS
+from booking_duplicates import (
+    duplicate_pairs, duplicate_report_from_pairs, build_duplicate_report, get_duplicate_report,
+    DUPLICATE_PAIR_COLUMNS
+)
+
+BASE_DIR = Path(__file__).resolve().parent
+SNAPSHOT_DB_PATH = os.getenv("BOOKING_SNAPSHOT_DB", str(BASE_DIR / "booking_snapshot.db"))
+SNAPSHOT_MAX_AGE_SECONDS = int(os.getenv("BOOKING_SNAPSHOT_MAX_AGE", "600"))
+# Sau TTL, snapshot cũ vẫn được trả về thêm tối đa chừng này giây trong lúc làm mới ở nền
+CACHE_MAX_STALE_SECONDS = int(os.getenv("BOOKING_CACHE_MAX_STALE", "3600"))
+DELTA_SYNC_ENABLED = os.getenv("BOOKING_DELTA_SYNC", "true").lower() == "true"
+
+# Một thao tác xóa hàng "treo" quá lâu (worker chết giữa chừng) thì coi như đã kết thúc
+ROW_OPERATION_TIMEOUT_SECONDS = 120
+
+# Tăng số này khi thay đổi cách parse trong import_from_gsheet để bỏ snapshot cũ
+SNAPSHOT_SCHEMA_VERSION = 3
+
+
+class BookingSnapshotStore:
+    """
+    Snapshot của booking DataFrame trong SQLite:
+    - Mỗi nguồn (sheet_id + worksheet) có một hàng duy nhất
+    - `generation` là version stamp, tăng sau mỗi lần lưu, vá hoặc invalidate
+    - `synced_at` là thời điểm tải toàn bộ từ Sheets gần nhất (vá dòng không đổi giá trị này)
+    - Payload là DataFrame đã pickle nên giữ nguyên dtype (datetime64, float)
+    - `fingerprints` là hash của từng dòng theo Số đặt phòng, `header` là header của sheet
+    - `row_index` là map Số đặt phòng -> số hàng trong sheet; `row_ops_pending`/`row_ops_seq`
+      đánh dấu các thao tác xóa hàng đang chạy để không dùng map khi số hàng đang dịch chuyển
+    """
+
+    def __init__(self, db_path: str = SNAPSHOT_DB_PATH, max_age_seconds: int = SNAPSHOT_MAX_AGE_SECONDS):
+        self.db_path = db_path
+        self.max_age_seconds = max_age_seconds
+        # {source_key: (generation, DataFrame)} - DataFrame đã unpickle gần nhất của mỗi nguồn
+        self._frames: Dict[str, Any] = {}
+        self._frames_lock = threading.Lock()
+        self._initialize_database()
+
+    def _connect(self) -> sqlite3.Connection:
+        # timeout lớn để các gunicorn worker chờ nhau thay vì lỗi "database is locked"
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def _initialize_database(self):
+        """Tạo bảng snapshot nếu chưa có"""
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS booking_snapshot (
+                    source_key TEXT PRIMARY KEY,
+                    generation INTEGER NOT NULL DEFAULT 0,
+                    schema_version INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    row_count INTEGER NOT NULL DEFAULT 0,
+                    is_valid INTEGER NOT NULL DEFAULT 1,
+                    payload BLOB
+                )
+            ''')
+            # Các cột thêm cho delta sync (DB cũ chưa có)
+            existing_columns = {row[1] for row in conn.execute('PRAGMA table_info(booking_snapshot)')}
+            for column, column_type in [('synced_at', 'REAL'), ('header', 'TEXT'), ('fingerprints', 'BLOB'),
+                                        ('row_index', 'BLOB'), ('row_ops_pending', 'INTEGER NOT NULL DEFAULT 0'),
+                                        ('row_ops_seq', 'INTEGER NOT NULL DEFAULT 0'), ('row_ops_started_at', 'REAL')]:
+                if column not in existing_columns:
+                    conn.execute(f'ALTER TABLE booking_snapshot ADD COLUMN {column} {column_type}')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS booking_rollups (
+                    source_key TEXT NOT NULL,
+                    dimension TEXT NOT NULL,
+                    bucket TEXT NOT NULL,
+                    revenue NUMERIC NOT NULL DEFAULT 0,
+                    collected_revenue NUMERIC NOT NULL DEFAULT 0,
+                    collected_count INTEGER NOT NULL DEFAULT 0,
+                    booking_count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (source_key, dimension, bucket)
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS booking_duplicate_pairs (
+                    source_key TEXT NOT NULL,
+                    left_id TEXT NOT NULL,
+                    right_id TEXT NOT NULL,
+                    date_diff INTEGER NOT NULL,
+                    price_diff REAL NOT NULL,
+                    PRIMARY KEY (source_key, left_id, right_id)
+                )
+            ''')
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_duplicate_pairs_right ON booking_duplicate_pairs (source_key, right_id)
+            ''')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_info(self, source_key: str) -> Optional[Dict[str, Any]]:
+        """Lấy metadata của snapshot (không đọc payload)"""
+        conn = self._connect()
+        try:
+            row = conn.execute('''
+                SELECT generation, schema_version, created_at, synced_at, row_count, is_valid, header
+                FROM booking_snapshot WHERE source_key = ?
+            ''', (source_key,)).fetchone()
+        finally:
+            conn.close()
+
+        if not row:
+            return None
+
+        generation, schema_version, created_at, synced_at, row_count, is_valid, header = row
+        synced_at = synced_at or created_at
+        return {
+            'generation': generation,
+            'schema_version': schema_version,
+            'created_at': created_at,
+            'synced_at': synced_at,
+            'age_seconds': time.time() - synced_at,
+            'row_count': row_count,
+            'is_valid': bool(is_valid),
+            'header': json.loads(header) if header else None,
+        }
+
+    def load(self, source_key: str, max_age_seconds: Optional[int] = None) -> Optional[pd.DataFrame]:
+        """
+        Đọc DataFrame từ snapshot.
+        Trả về None nếu chưa có, đã bị invalidate, khác schema hoặc quá cũ.
+        Cùng generation thì trả lại đúng DataFrame đã đọc lần trước (không unpickle lại).
+        """
+        max_age = self.max_age_seconds if max_age_seconds is None else max_age_seconds
+
+        conn = self._connect()
+        try:
+            # Đọc metadata và payload trong cùng một transaction để khớp generation
+            conn.execute('BEGIN')
+            row = conn.execute('''
+                SELECT generation, schema_version, created_at, synced_at, is_valid, payload IS NOT NULL
+                FROM booking_snapshot WHERE source_key = ?
+            ''', (source_key,)).fetchone()
+            if not row:
+                return None
+
+            generation, schema_version, created_at, synced_at, is_valid, has_payload = row
+            if not is_valid or not has_payload or schema_version != SNAPSHOT_SCHEMA_VERSION:
+                return None
+            if max_age >= 0 and time.time() - (synced_at or created_at) > max_age:
+                return None
+
+            with self._frames_lock:
+                cached = self._frames.get(source_key)
+            if cached is not None and cached[0] == generation:
+                return cached[1]
+
+            payload = conn.execute('SELECT payload FROM booking_snapshot WHERE source_key = ?',
+                                   (source_key,)).fetchone()[0]
+        finally:
+            conn.close()
+
+        df = pickle.loads(payload)
+        df.attrs['snapshot_generation'] = generation
+        with self._frames_lock:
+            self._frames[source_key] = (generation, df)
+        return df
+
+    def save(self, df: pd.DataFrame, source_key: str, header: Optional[List[str]] = None,
+             fingerprints: Optional[Dict[str, int]] = None, row_index: Optional[Dict[str, int]] = None,
+             row_ops_seq: Optional[int] = None) -> int:
+        """
+        Ghi DataFrame tải toàn bộ từ Sheets vào snapshot, trả về generation mới.
+        row_ops_seq là giá trị get_row_ops_seq() đọc TRƯỚC khi tải sheet: nếu có thao tác xóa hàng
+        chen vào giữa thì row_index có thể đã lệch nên không được lưu.
+        """
+        payload = pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL)
+        fingerprints_blob = pickle.dumps(fingerprints or {}, protocol=pickle.HIGHEST_PROTOCOL)
+        header_json = json.dumps(header if header is not None else list(df.columns), ensure_ascii=False)
+        now = time.time()
+
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('''
+                SELECT generation, row_ops_pending, row_ops_seq, row_ops_started_at
+                FROM booking_snapshot WHERE source_key = ?
+            ''', (source_key,)).fetchone()
+            generation, pending, seq, started_at = row if row else (0, 0, 0, None)
+            generation += 1
+            if pending and started_at and now - started_at > ROW_OPERATION_TIMEOUT_SECONDS:
+                pending = 0
+            if pending or row_ops_seq is None or row_ops_seq != seq:
+                row_index = None
+            row_index_blob = pickle.dumps(row_index, protocol=pickle.HIGHEST_PROTOCOL) if row_index else None
+
+            conn.execute('''
+                INSERT OR REPLACE INTO booking_snapshot
+                    (source_key, generation, schema_version, created_at, synced_at, row_count,
+                     is_valid, payload, header, fingerprints, row_index, row_ops_pending, row_ops_seq,
+                     row_ops_started_at)
+                VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?)
+            ''', (source_key, generation, SNAPSHOT_SCHEMA_VERSION, now, now, len(df),
+                  payload, header_json, fingerprints_blob, row_index_blob, pending, seq,
+                  started_at if pending else None))
+            conn.execute('DELETE FROM booking_rollups WHERE source_key = ?', (source_key,))
+            self._add_rollups(conn, source_key, compute_booking_rollups(df))
+            conn.execute('DELETE FROM booking_duplicate_pairs WHERE source_key = ?', (source_key,))
+            self._add_duplicate_pairs(conn, source_key, duplicate_pairs(df))
+            conn.commit()
+        finally:
+            conn.close()
+
+        return generation
+
+    def get_row_ops_seq(self, source_key: str) -> int:
+        """Bộ đếm thao tác xóa hàng, đọc trước khi tải toàn bộ sheet (xem save)"""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT row_ops_seq FROM booking_snapshot WHERE source_key = ?', (source_key,)
+            ).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else 0
+
+    def get_row_number(self, source_key: str, booking_id: str) -> Optional[int]:
+        """Số hàng (từ 1, tính cả header) của booking trong sheet, None nếu không chắc chắn"""
+        conn = self._connect()
+        try:
+            row = conn.execute('''
+                SELECT is_valid, row_index, row_ops_pending, row_ops_started_at
+                FROM booking_snapshot WHERE source_key = ?
+            ''', (source_key,)).fetchone()
+        finally:
+            conn.close()
+
+        if not row:
+            return None
+        is_valid, row_index_blob, pending, started_at = row
+        if not is_valid or not row_index_blob:
+            return None
+        if pending and not (started_at and time.time() - started_at > ROW_OPERATION_TIMEOUT_SECONDS):
+            return None
+        return pickle.loads(row_index_blob).get(str(booking_id))
+
+    def begin_row_operation(self, source_key: str):
+        """Đánh dấu bắt đầu xóa hàng: từ giờ tới finish_row_operation() không dùng row_index"""
+        conn = self._connect()
+        try:
+            conn.execute('''
+                UPDATE booking_snapshot
+                SET row_ops_pending = row_ops_pending + 1, row_ops_seq = row_ops_seq + 1, row_ops_started_at = ?
+                WHERE source_key = ?
+            ''', (time.time(), source_key))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def finish_row_operation(self, source_key: str, deleted_rows: Optional[List[int]] = None,
+                             deleted_ids: Optional[List[str]] = None, success: bool = True):
+        """
+        Kết thúc thao tác xóa hàng. Nếu thành công thì dịch các số hàng phía sau lên,
+        nếu lỗi (có thể đã xóa một phần) thì bỏ row_index cho tới lần tải toàn bộ sau.
+        """
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                'SELECT row_index FROM booking_snapshot WHERE source_key = ?', (source_key,)
+            ).fetchone()
+            if not row:
+                conn.rollback()
+                return
+
+            row_index = pickle.loads(row[0]) if row[0] else None
+            if row_index is not None:
+                if success:
+                    row_index = shift_row_index(row_index, deleted_rows or [], deleted_ids or [])
+                else:
+                    row_index = None
+
+            conn.execute('''
+                UPDATE booking_snapshot
+                SET row_index = ?, row_ops_pending = MAX(row_ops_pending - 1, 0), row_ops_seq = row_ops_seq + 1
+                WHERE source_key = ?
+            ''', (pickle.dumps(row_index, protocol=pickle.HIGHEST_PROTOCOL) if row_index else None, source_key))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def add_row_numbers(self, source_key: str, new_rows: Dict[str, int]):
+        """Thêm số hàng của các booking vừa append (bỏ row_index nếu đang có thao tác xóa hàng)"""
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                'SELECT row_index, row_ops_pending FROM booking_snapshot WHERE source_key = ?', (source_key,)
+            ).fetchone()
+            if not row or not row[0]:
+                conn.rollback()
+                return
+
+            row_index = None
+            if not row[1]:
+                row_index = pickle.loads(row[0])
+                row_index.update({str(booking_id): row_number for booking_id, row_number in new_rows.items()})
+
+            conn.execute(
+                'UPDATE booking_snapshot SET row_index = ? WHERE source_key = ?',
+                (pickle.dumps(row_index, protocol=pickle.HIGHEST_PROTOCOL) if row_index else None, source_key)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def load_fingerprints(self, source_key: str) -> Dict[str, int]:
+        """Đọc fingerprint của lần đồng bộ trước (rỗng nếu chưa có)"""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT fingerprints FROM booking_snapshot WHERE source_key = ?', (source_key,)
+            ).fetchone()
+        finally:
+            conn.close()
+        return pickle.loads(row[0]) if row and row[0] else {}
+
+    def patch(self, source_key: str, patch_fn: Callable[[pd.DataFrame], pd.DataFrame],
+              affected_ids: List[str]) -> Optional[int]:
+        """
+        Vá snapshot trong một transaction (đọc - sửa - ghi) để hai worker không ghi đè nhau.
+        Không đổi synced_at nên lịch tải lại toàn bộ vẫn giữ nguyên.
+        Trả về generation mới, hoặc None nếu snapshot không hợp lệ.
+        """
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('''
+                SELECT generation, schema_version, is_valid, payload, fingerprints
+                FROM booking_snapshot WHERE source_key = ?
+            ''', (source_key,)).fetchone()
+            if not row:
+                conn.rollback()
+                return None
+
+            generation, schema_version, is_valid, payload, fingerprints_blob = row
+            if not is_valid or payload is None or schema_version != SNAPSHOT_SCHEMA_VERSION:
+                conn.rollback()
+                return None
+
+            df = pickle.loads(payload)
+            # Rollup của các dòng bị vá trước khi sửa (patch_fn có thể sửa df tại chỗ)
+            rollups_before = compute_booking_rollups(_rows_with_ids(df, affected_ids))
+            df = patch_fn(df)
+            rollups_delta = _subtract_rollups(compute_booking_rollups(_rows_with_ids(df, affected_ids)), rollups_before)
+            fingerprints = pickle.loads(fingerprints_blob) if fingerprints_blob else {}
+            fingerprints.update(compute_row_fingerprints(df, affected_ids))
+            present_ids = set(df['Số đặt phòng'].astype(str)) if 'Số đặt phòng' in df.columns else set()
+            for booking_id in affected_ids:
+                if str(booking_id) not in present_ids:
+                    fingerprints.pop(str(booking_id), None)
+
+            generation += 1
+            conn.execute('''
+                UPDATE booking_snapshot
+                SET generation = ?, created_at = ?, row_count = ?, payload = ?, fingerprints = ?
+                WHERE source_key = ?
+            ''', (generation, time.time(), len(df),
+                  pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL),
+                  pickle.dumps(fingerprints, protocol=pickle.HIGHEST_PROTOCOL), source_key))
+            self._add_rollups(conn, source_key, rollups_delta)
+            # Cặp trùng: bỏ các cặp cũ của booking bị vá rồi tính lại quanh chúng
+            conn.executemany('''
+                DELETE FROM booking_duplicate_pairs WHERE source_key = ? AND (left_id = ? OR right_id = ?)
+            ''', [(source_key, str(booking_id), str(booking_id)) for booking_id in affected_ids])
+            self._add_duplicate_pairs(conn, source_key, duplicate_pairs(df, affected_ids))
+            conn.commit()
+            return generation
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _add_rollups(conn: sqlite3.Connection, source_key: str, rollups: pd.DataFrame):
+        """Cộng bảng rollup (hoặc phần chênh lệch) vào booking_rollups, bỏ bucket không còn booking"""
+        if rollups.empty:
+            return
+        rows = [(source_key, dimension, bucket, _sql_number(revenue), _sql_number(collected_revenue),
+                 int(collected_count), int(booking_count))
+                for dimension, bucket, revenue, collected_revenue, collected_count, booking_count
+                in rollups[ROLLUP_COLUMNS].itertuples(index=False, name=None)]
+        conn.executemany('''
+            INSERT INTO booking_rollups
+                (source_key, dimension, bucket, revenue, collected_revenue, collected_count, booking_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (source_key, dimension, bucket) DO UPDATE SET
+                revenue = revenue + excluded.revenue,
+                collected_revenue = collected_revenue + excluded.collected_revenue,
+                collected_count = collected_count + excluded.collected_count,
+                booking_count = booking_count + excluded.booking_count
+        ''', rows)
+        conn.execute('DELETE FROM booking_rollups WHERE source_key = ? AND booking_count <= 0', (source_key,))
+
+    @staticmethod
+    def _add_duplicate_pairs(conn: sqlite3.Connection, source_key: str, pairs: pd.DataFrame):
+        conn.executemany('''
+            INSERT OR REPLACE INTO booking_duplicate_pairs (source_key, left_id, right_id, date_diff, price_diff)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(source_key, str(left_id), str(right_id), int(date_diff), float(price_diff))
+              for left_id, right_id, date_diff, price_diff
+              in pairs[DUPLICATE_PAIR_COLUMNS].itertuples(index=False, name=None)])
+
+    def _load_table(self, source_key: str, generation: Optional[int], table: str,
+                    columns: List[str]) -> Optional[pd.DataFrame]:
+        """Đọc bảng phụ của snapshot; None nếu snapshot không hợp lệ hoặc generation đã khác"""
+        conn = self._connect()
+        try:
+            # Kiểm tra generation và đọc bảng trong cùng một transaction (như load())
+            conn.execute('BEGIN')
+            row = conn.execute('''
+                SELECT generation, schema_version, is_valid FROM booking_snapshot WHERE source_key = ?
+            ''', (source_key,)).fetchone()
+            if not row or not row[2] or row[1] != SNAPSHOT_SCHEMA_VERSION:
+                return None
+            if generation is not None and row[0] != generation:
+                return None
+            rows = conn.execute(f'''
+                SELECT {', '.join(columns)} FROM {table} WHERE source_key = ?
+            ''', (source_key,)).fetchall()
+        finally:
+            conn.close()
+        return pd.DataFrame(rows, columns=columns)
+
+    def load_rollups(self, source_key: str, generation: Optional[int] = None) -> Optional[pd.DataFrame]:
+        """
+        Bảng rollup của snapshot. Trả về None nếu snapshot không hợp lệ hoặc generation
+        đã khác (rollup không còn khớp với DataFrame đang dùng).
+        """
+        return self._load_table(source_key, generation, 'booking_rollups', ROLLUP_COLUMNS)
+
+    def load_duplicate_pairs(self, source_key: str, generation: Optional[int] = None) -> Optional[pd.DataFrame]:
+        """Các cặp booking trùng của snapshot (None như load_rollups)"""
+        return self._load_table(source_key, generation, 'booking_duplicate_pairs', DUPLICATE_PAIR_COLUMNS)
+
+    def invalidate(self, source_key: Optional[str] = None):
+        """Đánh dấu snapshot là cũ (một nguồn hoặc tất cả) để lần đọc sau tải lại từ Sheets"""
+        conn = self._connect()
+        try:
+            if source_key is None:
+                conn.execute('UPDATE booking_snapshot SET is_valid = 0, generation = generation + 1')
+            else:
+                conn.execute('''
+                    UPDATE booking_snapshot SET is_valid = 0, generation = generation + 1
+                    WHERE source_key = ?
+                ''', (source_key,))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def compute_row_fingerprints(df: pd.DataFrame, booking_ids: Optional[List[str]] = None) -> Dict[str, int]:
+    """
+    Hash từng dòng theo Số đặt phòng để so sánh giữa hai lần đồng bộ.
+    Nếu truyền booking_ids thì chỉ tính cho các booking đó.
+    """
+    if df is None or df.empty or 'Số đặt phòng' not in df.columns:
+        return {}
+
+    if booking_ids is not None:
+        df = df[df['Số đặt phòng'].astype(str).isin([str(b) for b in booking_ids])]
+        if df.empty:
+            return {}
+
+    try:
+        hashes = pd.util.hash_pandas_object(df, index=False)
+    except TypeError:
+        # Cột object chứa giá trị không hash được (list, dict...) - hash theo chuỗi
+        hashes = pd.util.hash_pandas_object(df.astype(str), index=False)
+
+    return dict(zip(df['Số đặt phòng'].astype(str), hashes.astype('uint64').tolist()))
+
+
+def _rows_with_ids(df: pd.DataFrame, booking_ids: List[str]) -> pd.DataFrame:
+    """Các dòng của những booking trong booking_ids"""
+    if df is None or df.empty or 'Số đặt phòng' not in df.columns:
+        return pd.DataFrame(columns=df.columns if df is not None else [])
+    return df[df['Số đặt phòng'].astype(str).isin([str(b) for b in booking_ids])]
+
+
+def _subtract_rollups(after: pd.DataFrame, before: pd.DataFrame) -> pd.DataFrame:
+    """Phần chênh lệch after - before theo (dimension, bucket)"""
+    if before.empty:
+        return after
+    negated = before.copy()
+    for column in ROLLUP_COLUMNS[2:]:
+        negated[column] = -negated[column]
+    combined = pd.concat([after, negated], ignore_index=True)
+    delta = combined.groupby(['dimension', 'bucket'], as_index=False, sort=False)[ROLLUP_COLUMNS[2:]].sum()
+    changed = (delta[ROLLUP_COLUMNS[2:]] != 0).any(axis=1)
+    return delta[changed][ROLLUP_COLUMNS]
+
+
+def _sql_number(value):
+    """Số numpy -> int/float Python cho sqlite3 (giữ int nếu là số nguyên)"""
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def shift_row_index(row_index: Dict[str, int], deleted_rows: List[int], deleted_ids: List[str]) -> Dict[str, int]:
+    """Cập nhật map booking -> số hàng sau khi xóa các hàng deleted_rows khỏi sheet"""
+    deleted_rows = sorted(set(deleted_rows))
+    deleted_row_set = set(deleted_rows)
+    deleted_ids = {str(booking_id) for booking_id in deleted_ids}
+
+    shifted = {}
+    for booking_id, row_number in row_index.items():
+        if booking_id in deleted_ids or row_number in deleted_row_set:
+            continue
+        shifted[booking_id] = row_number - bisect.bisect_left(deleted_rows, row_number)
+    return shifted
+
+
+def diff_fingerprints(old: Dict[str, int], new: Dict[str, int]) -> Dict[str, List[str]]:
+    """So sánh fingerprint hai lần đồng bộ: booking thêm mới, bị xóa, bị sửa"""
+    old_ids, new_ids = set(old), set(new)
+    return {
+        'added': sorted(new_ids - old_ids),
+        'removed': sorted(old_ids - new_ids),
+        'changed': sorted(b for b in old_ids & new_ids if old[b] != new[b]),
+    }
+
+
+# Global instance
+_snapshot_store = None
+
+
+def get_snapshot_store() -> Optional[BookingSnapshotStore]:
+    """Get global snapshot store (None nếu không tạo được file SQLite)"""
+    global _snapshot_store
+    if _snapshot_store is None:
+        try:
+            _snapshot_store = BookingSnapshotStore()
+        except Exception as e:
+            print(f"[SNAPSHOT] Cannot open snapshot store at {SNAPSHOT_DB_PATH}: {e}")
+            return None
+    return _snapshot_store
+
+
+def make_source_key(sheet_id: Optional[str], worksheet_name: Optional[str] = None) -> str:
+    """Khóa snapshot cho một worksheet cụ thể"""
+    return f"{sheet_id}:{worksheet_name or 'sheet1'}"
+
+
+def load_booking_snapshot(sheet_id: str, gcp_creds_file_path: str, worksheet_name: Optional[str] = None,
+                          max_age_seconds: Optional[int] = None) -> pd.DataFrame:
+    """
+    Đọc booking từ snapshot local nếu còn mới, nếu không thì tải lại từ Google Sheets.
+    Đây là hàm thay thế cho import_from_gsheet ở các chỗ chỉ cần đọc dữ liệu.
+    """
+    store = get_snapshot_store()
+    if store is not None:
+        try:
+            df = store.load(make_source_key(sheet_id, worksheet_name), max_age_seconds)
+            if df is not None:
+                print(f"[SNAPSHOT] Loaded {len(df)} bookings from local snapshot "
+                      f"(generation {df.attrs.get('snapshot_generation')})")
+                return df
+        except Exception as e:
+            print(f"[SNAPSHOT] Error reading snapshot, falling back to Google Sheets: {e}")
+
+    return refresh_booking_snapshot(sheet_id, gcp_creds_file_path, worksheet_name)
+
+
+def refresh_booking_snapshot(sheet_id: str, gcp_creds_file_path: str, worksheet_name: Optional[str] = None) -> pd.DataFrame:
+    """Tải lại toàn bộ dữ liệu từ Google Sheets và ghi đè snapshot"""
+    store = get_snapshot_store()
+    source_key = make_source_key(sheet_id, worksheet_name)
+    row_ops_seq = None
+    if store is not None:
+        try:
+            row_ops_seq = store.get_row_ops_seq(source_key)
+        except Exception as e:
+            print(f"[SNAPSHOT] Cannot read row operation counter: {e}")
+
+    df, sheet_row_numbers = import_from_gsheet(sheet_id, gcp_creds_file_path, worksheet_name, with_row_numbers=True)
+    df = _apply_pending_sheet_writes(df, sheet_id, worksheet_name)
+
+    if store is not None and not df.empty:
+        try:
+            fingerprints = compute_row_fingerprints(df)
+            previous = store.get_info(source_key)
+            previous_fingerprints = store.load_fingerprints(source_key)
+            if previous and previous.get('header') and previous['header'] != list(df.columns):
+                print(f"[SNAPSHOT] Sheet header changed, full snapshot rebuilt")
+            elif previous_fingerprints:
+                changes = diff_fingerprints(previous_fingerprints, fingerprints)
+                print(f"[SNAPSHOT] Full sync diff: {len(changes['added'])} added, "
+                      f"{len(changes['changed'])} changed, {len(changes['removed'])} removed")
+
+            row_index = dict(zip(df['Số đặt phòng'].astype(str), sheet_row_numbers)) if 'Số đặt phòng' in df.columns else None
+            generation = store.save(df, source_key, list(df.columns), fingerprints, row_index, row_ops_seq)
+            df.attrs['snapshot_generation'] = generation
+            print(f"[SNAPSHOT] Saved {len(df)} bookings to local snapshot (generation {generation})")
+        except Exception as e:
+            print(f"[SNAPSHOT] Error saving snapshot: {e}")
+
+    return df
+
+
+def _apply_pending_sheet_writes(df: pd.DataFrame, sheet_id: str, worksheet_name: Optional[str]) -> pd.DataFrame:
+    """Áp lại các cập nhật còn nằm trong write-behind queue (Sheets chưa có) lên dữ liệu vừa tải"""
+    if df.empty:
+        return df
+    from sheet_write_queue import get_pending_sheet_updates  # Import tại chỗ để tránh import vòng
+    pending = get_pending_sheet_updates(sheet_id, worksheet_name, 'Số đặt phòng')
+    for update in pending:
+        df = update_booking_by_id(df, update['key_value'], update['data'])
+    if pending:
+        print(f"[SNAPSHOT] Re-applied {len(pending)} queued update(s) not yet written to Google Sheets")
+    return df
+
+
+def _patch_booking_snapshot(sheet_id: str, worksheet_name: Optional[str],
+                            patch_fn: Callable[[pd.DataFrame], pd.DataFrame],
+                            affected_ids: List[str], action: str) -> bool:
+    """
+    Vá snapshot sau khi đã ghi thành công lên Google Sheets.
+    Trả về False nếu không vá được - khi đó caller phải invalidate để lần đọc sau tải lại toàn bộ.
+    """
+    if not DELTA_SYNC_ENABLED:
+        return False
+
+    store = get_snapshot_store()
+    if store is None:
+        return False
+
+    try:
+        generation = store.patch(make_source_key(sheet_id, worksheet_name), patch_fn, affected_ids)
+    except Exception as e:
+        print(f"[SNAPSHOT] Delta {action} failed for {affected_ids}: {e}")
+        return False
+
+    if generation is None:
+        return False
+
+    print(f"[SNAPSHOT] Delta {action} applied to {len(affected_ids)} booking(s) (generation {generation})")
+    return True
+
+
+def apply_booking_update(sheet_id: str, worksheet_name: Optional[str], booking_id: str, new_data: Dict[str, Any]) -> bool:
+    """Vá một booking đã được cập nhật trên Sheets vào snapshot"""
+    def patch_fn(df: pd.DataFrame) -> pd.DataFrame:
+        if not (df['Số đặt phòng'] == booking_id).any():
+            raise KeyError(booking_id)
+        return update_booking_by_id(df, booking_id, new_data)
+
+    return _patch_booking_snapshot(sheet_id, worksheet_name, patch_fn, [booking_id], 'update')
+
+
+def apply_booking_append(sheet_id: str, worksheet_name: Optional[str], bookings: List[Dict[str, Any]]) -> bool:
+    """Thêm các booking vừa append lên Sheets vào cuối snapshot (giống thứ tự trong sheet)"""
+    booking_ids = [str(b.get('Số đặt phòng', '')) for b in bookings]
+    if not bookings or not all(booking_ids):
+        return False
+
+    def patch_fn(df: pd.DataFrame) -> pd.DataFrame:
+        # Sheet lưu mọi giá trị dưới dạng chuỗi, cột thiếu để trống như khi append_rows
+        new_rows = pd.DataFrame(bookings).reindex(columns=df.columns).fillna('')
+        new_rows = convert_booking_dtypes(new_rows.astype(str))
+        # concat hai cột category khác tập giá trị sẽ ra object - chuyển lại kiểu theo schema
+        return convert_booking_dtypes(pd.concat([df, new_rows], ignore_index=True))
+
+    return _patch_booking_snapshot(sheet_id, worksheet_name, patch_fn, booking_ids, 'append')
+
+
+def apply_booking_delete(sheet_id: str, worksheet_name: Optional[str], booking_ids: List[str]) -> bool:
+    """Xóa các booking vừa bị xóa trên Sheets khỏi snapshot"""
+    if not booking_ids:
+        return False
+
+    def patch_fn(df: pd.DataFrame) -> pd.DataFrame:
+        for booking_id in booking_ids:
+            df = delete_booking_by_id(df, booking_id)
+        return df
+
+    return _patch_booking_snapshot(sheet_id, worksheet_name, patch_fn, list(booking_ids), 'delete')
+
+
+def get_booking_row_number(sheet_id: str, worksheet_name: Optional[str], booking_id: str) -> Optional[int]:
+    """Số hàng của booking trong sheet theo row index của snapshot (None: phải tự tìm trên sheet)"""
+    store = get_snapshot_store()
+    if store is None:
+        return None
+    try:
+        return store.get_row_number(make_source_key(sheet_id, worksheet_name), booking_id)
+    except Exception as e:
+        print(f"[SNAPSHOT] Error reading row index: {e}")
+        return None
+
+
+def begin_sheet_row_deletion(sheet_id: str, worksheet_name: Optional[str]):
+    """Gọi trước khi xóa hàng trên sheet (các worker khác sẽ không dùng row index)"""
+    store = get_snapshot_store()
+    if store is None:
+        return
+    try:
+        store.begin_row_operation(make_source_key(sheet_id, worksheet_name))
+    except Exception as e:
+        print(f"[SNAPSHOT] Error marking row deletion: {e}")
+
+
+def finish_sheet_row_deletion(sheet_id: str, worksheet_name: Optional[str], deleted_rows: Optional[List[int]] = None,
+                              deleted_ids: Optional[List[str]] = None, success: bool = True):
+    """Gọi sau khi xóa hàng trên sheet (kể cả khi lỗi) để cập nhật row index"""
+    store = get_snapshot_store()
+    if store is None:
+        return
+    try:
+        store.finish_row_operation(make_source_key(sheet_id, worksheet_name), deleted_rows, deleted_ids, success)
+    except Exception as e:
+        print(f"[SNAPSHOT] Error updating row index after deletion: {e}")
+
+
+def register_appended_rows(sheet_id: str, worksheet_name: Optional[str], new_rows: Dict[str, int]):
+    """Ghi số hàng của các booking vừa append vào row index"""
+    store = get_snapshot_store()
+    if store is None or not new_rows:
+        return
+    try:
+        store.add_row_numbers(make_source_key(sheet_id, worksheet_name), new_rows)
+    except Exception as e:
+        print(f"[SNAPSHOT] Error updating row index after append: {e}")
+
+
+def load_duplicate_report(df: pd.DataFrame, sheet_id: Optional[str],
+                          worksheet_name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Báo cáo booking trùng lặp của df, dựng từ các cặp lưu cùng snapshot (một lần mỗi generation).
+    Chỉ phân tích lại toàn bộ khi df không đến từ snapshot hoặc snapshot đã sang generation khác.
+    """
+    generation = df.attrs.get('snapshot_generation') if df is not None else None
+    store = get_snapshot_store()
+    if generation is None or store is None:
+        return get_duplicate_report(df)
+    source_key = make_source_key(sheet_id, worksheet_name)
+
+    def build(frame: pd.DataFrame) -> Dict[str, Any]:
+        try:
+            pairs = store.load_duplicate_pairs(source_key, generation)
+        except Exception as e:
+            print(f"[SNAPSHOT] Cannot read duplicate pairs: {e}")
+            pairs = None
+        if pairs is None:
+            return build_duplicate_report(frame)
+        return duplicate_report_from_pairs(frame, pairs)
+
+    return get_derived(df, 'duplicate_report', build)
+
+
+def invalidate_booking_snapshot(sheet_id: Optional[str] = None, worksheet_name: Optional[str] = None):
+    """Invalidate snapshot sau khi ghi dữ liệu lên Google Sheets"""
+    store = get_snapshot_store()
+    if store is None:
+        return
+    try:
+        source_key = make_source_key(sheet_id, worksheet_name) if sheet_id else None
+        store.invalidate(source_key)
+        print(f"[SNAPSHOT] Invalidated snapshot {source_key or '(all)'}")
+    except Exception as e:
+        print(f"[SNAPSHOT] Error invalidating snapshot: {e}")
+
+
+class SharedBookingCache:
+    """
+    Bản booking trong bộ nhớ của một worker, gắn với generation của snapshot dùng chung.
+    Mỗi lần get() chỉ đọc metadata (một SELECT nhỏ); khi worker khác vá/invalidate snapshot
+    thì generation đổi và bản trong bộ nhớ được đọc lại từ đĩa.
+
+    Stale-while-revalidate: khi snapshot quá TTL nhưng chưa quá TTL + max_stale, dữ liệu cũ
+    vẫn được trả về ngay và một thread nền tải lại từ Google Sheets. Chỉ khi snapshot bị
+    invalidate (sau khi ghi / bấm Sync) hoặc quá cũ thì request mới phải chờ Sheets.
+    """
+
+    def __init__(self, sheet_id: str, gcp_creds_file_path: str, worksheet_name: Optional[str] = None,
+                 ttl_seconds: Optional[int] = None, max_stale_seconds: Optional[int] = None):
+        self.sheet_id = sheet_id
+        self.gcp_creds_file_path = gcp_creds_file_path
+        self.worksheet_name = worksheet_name
+        self.ttl_seconds = SNAPSHOT_MAX_AGE_SECONDS if ttl_seconds is None else ttl_seconds
+        self.max_stale_seconds = CACHE_MAX_STALE_SECONDS if max_stale_seconds is None else max_stale_seconds
+        self._lock = threading.Lock()
+        self._value = None
+        self._generation = None
+        self._loaded = False
+        self._refreshing = False
+        self._stats = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'load_seconds_total': 0.0,
+            'refreshes': 0,
+            'refresh_errors': 0,
+            'refresh_seconds_total': 0.0,
+            'last_refresh_seconds': None,
+            'last_refresh_at': None,
+        }
+
+    def _shared_state(self):
+        """
+        Trạng thái snapshot dùng chung: (generation, status) với status là
+        'fresh', 'stale' (quá TTL nhưng vẫn được dùng), 'expired' hoặc 'missing'
+        """
+        store = get_snapshot_store()
+        if store is None:
+            return None, 'missing'
+        info = store.get_info(make_source_key(self.sheet_id, self.worksheet_name))
+        if not info or not info['is_valid'] or info['schema_version'] != SNAPSHOT_SCHEMA_VERSION:
+            return None, 'missing'
+
+        age = info['age_seconds']
+        if self.ttl_seconds < 0 or age <= self.ttl_seconds:
+            status = 'fresh'
+        elif self.max_stale_seconds < 0 or age <= self.ttl_seconds + self.max_stale_seconds:
+            status = 'stale'
+        else:
+            status = 'expired'
+        return info['generation'], status
+
+    def get(self, build: Callable[[pd.DataFrame], Any], fallback: Optional[Callable[[], Any]] = None) -> Any:
+        """
+        Trả về build(df) cho bản booking hiện tại.
+        Nếu tải lỗi và có fallback thì lưu kết quả fallback() cho tới lần invalidate sau.
+        """
+        with self._lock:
+            try:
+                generation, status = self._shared_state()
+            except Exception as e:
+                print(f"[SNAPSHOT] Cannot read snapshot generation: {e}")
+                if self._loaded:
+                    self._stats['hits'] += 1
+                    return self._value
+                generation, status = None, 'missing'
+
+            if self._loaded:
+                if self._generation is None and status == 'missing':
+                    # Lần trước tải lỗi (đang dùng dữ liệu dự phòng): chỉ thử lại khi
+                    # worker khác đã có snapshot hợp lệ hoặc sau clear()
+                    self._stats['hits'] += 1
+                    return self._value
+                if self._generation is not None and generation == self._generation and status in ('fresh', 'stale'):
+                    if status == 'stale':
+                        self._stats['stale_hits'] += 1
+                        self._start_background_refresh()
+                    else:
+                        self._stats['hits'] += 1
+                    return self._value
+
+            self._stats['misses'] += 1
+            start = time.time()
+            # Snapshot cũ nhưng còn dùng được: đọc từ đĩa ngay, làm mới ở nền
+            max_age = -1 if status == 'stale' else self.ttl_seconds
+            try:
+                df = load_booking_snapshot(self.sheet_id, self.gcp_creds_file_path, self.worksheet_name, max_age)
+                value = build(df)
+                generation = df.attrs.get('snapshot_generation')
+            except Exception:
+                if fallback is None:
+                    raise
+                value = fallback()
+                generation = None
+            self._stats['load_seconds_total'] += time.time() - start
+
+            self._value = value
+            self._generation = generation
+            self._loaded = True
+            if status == 'stale':
+                self._start_background_refresh()
+            return value
+
+    def _start_background_refresh(self):
+        """Chạy tối đa một thread làm mới mỗi worker (gọi khi đang giữ _lock)"""
+        if self._refreshing:
+            return
+        self._refreshing = True
+        threading.Thread(target=self._background_refresh, name='booking-cache-refresh', daemon=True).start()
+
+    def _background_refresh(self):
+        start = time.time()
+        try:
+            # Worker khác có thể đã làm mới snapshot trong lúc chờ
+            _, status = self._shared_state()
+            if status == 'fresh':
+                return
+            refresh_booking_snapshot(self.sheet_id, self.gcp_creds_file_path, self.worksheet_name)
+            duration = time.time() - start
+            # Thread request cũng cập nhật _stats (dưới _lock) nên ở đây phải giữ cùng lock
+            with self._lock:
+                self._stats['refreshes'] += 1
+                self._stats['refresh_seconds_total'] += duration
+                self._stats['last_refresh_seconds'] = round(duration, 3)
+                self._stats['last_refresh_at'] = time.time()
+            print(f"[SNAPSHOT] Background refresh finished in {duration:.2f}s")
+        except Exception as e:
+            with self._lock:
+                self._stats['refresh_errors'] += 1
+            print(f"[SNAPSHOT] Background refresh failed: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def get_rollups(self, df: pd.DataFrame) -> Optional[pd.DataFrame]:
+        """
+        Bảng rollup lưu cùng snapshot cho đúng generation của df (đọc SQLite một lần mỗi generation).
+        None nếu df không đến từ snapshot (dữ liệu demo) hoặc snapshot đã sang generation khác.
+        """
+        generation = df.attrs.get('snapshot_generation') if df is not None else None
+        store = get_snapshot_store()
+        if generation is None or store is None:
+            return None
+        source_key = make_source_key(self.sheet_id, self.worksheet_name)
+        try:
+            return get_derived(df, 'rollups', lambda _: store.load_rollups(source_key, generation))
+        except Exception as e:
+            print(f"[SNAPSHOT] Cannot read rollups: {e}")
+            return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Số liệu hit/miss/refresh của cache trong worker này"""
+        with self._lock:
+            stats = dict(self._stats)
+            generation, refreshing = self._generation, self._refreshing
+        requests_count = stats['hits'] + stats['stale_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['hits'] + stats['stale_hits']) / requests_count, 3) if requests_count else None
+        stats['avg_load_seconds'] = round(stats['load_seconds_total'] / stats['misses'], 3) if stats['misses'] else None
+        stats['avg_refresh_seconds'] = (round(stats['refresh_seconds_total'] / stats['refreshes'], 3)
+                                        if stats['refreshes'] else None)
+        stats['ttl_seconds'] = self.ttl_seconds
+        stats['max_stale_seconds'] = self.max_stale_seconds
+        stats['generation'] = generation
+        stats['refreshing'] = refreshing
+        stats['worker_pid'] = os.getpid()
+        return stats
+
+    def clear(self):
+        """Bỏ bản trong bộ nhớ của worker này (snapshot trên đĩa không đổi)"""
+        with self._lock:
+            self._value = None
+            self._generation = None
+            self._loaded = False
+
+
+# Mỗi worksheet một SharedBookingCache cho các chỗ chỉ đọc ngoài view (kiểm tra trùng, reminder, RAG)
+_frame_caches: Dict[str, SharedBookingCache] = {}
+_frame_caches_lock = threading.Lock()
+
+
+def _same_frame(df: pd.DataFrame) -> pd.DataFrame:
+    return df
+
+
+def read_booking_frame(sheet_id: str, gcp_creds_file_path: str, worksheet_name: Optional[str] = None) -> pd.DataFrame:
+    """
+    DataFrame booking hiện tại, đọc qua SharedBookingCache: snapshot quá TTL vẫn được trả về ngay
+    và làm mới ở nền, chỉ phải chờ Google Sheets khi chưa có snapshot hoặc vừa bị invalidate.
+    Cùng generation thì là đúng DataFrame mà app đang dùng (BookingSnapshotStore.load).
+    """
+    source_key = make_source_key(sheet_id, worksheet_name)
+    with _frame_caches_lock:
+        cache = _frame_caches.get(source_key)
+        if cache is None:
+            cache = _frame_caches[source_key] = SharedBookingCache(sheet_id, gcp_creds_file_path, worksheet_name)
+    return cache.get(_same_frame)
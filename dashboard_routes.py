@@ -7,6 +7,17 @@ import plotly.express as px
 import json
 import warnings
 
+import threading
+from collections import OrderedDict
+
+from booking_indexes import get_occupancy_index, get_nightly_revenue, get_dashboard_aggregates, get_derived, get_booking_dates, get_booking_day_index
+from booking_receivables import overdue_guest_records
+from logic import prepare_dashboard_data
+
+# Số kết quả dashboard (khoảng ngày/sắp xếp khác nhau) giữ lại cho mỗi generation của cache
+DASHBOARD_MEMO_SIZE = 16
+_dashboard_memo_lock = threading.Lock()
+
 def safe_to_dict_records(df):
     """
     Safely convert DataFrame to dict records, handling duplicate columns
@@ -30,7 +41,32 @@ def safe_to_dict_records(df):
         return []
 
 
-def process_dashboard_data(df, start_date, end_date, sort_by, sort_order, dashboard_data):
+def build_dashboard(df, start_date, end_date, sort_by, sort_order, total_capacity=4, rollups=None):
+    """
+    Trả về (dashboard_data, processed_data) cho trang Dashboard.
+    rollups: bảng rollup lưu cùng snapshot (SharedBookingCache.get_rollups), None thì tính từ df.
+    Kết quả được giữ theo (generation của cache, khoảng ngày, sắp xếp, hôm nay) nên
+    tải lại dashboard với cùng bộ lọc không phải tính lại gì.
+    """
+    key = (pd.Timestamp(start_date).date(), pd.Timestamp(end_date).date(), sort_by, sort_order,
+           total_capacity, datetime.today().date())
+    memo = get_derived(df, 'dashboard_memo', lambda _: OrderedDict())
+    with _dashboard_memo_lock:
+        if key in memo:
+            memo.move_to_end(key)
+            return memo[key]
+
+    dashboard_data = prepare_dashboard_data(df, start_date, end_date, sort_by, sort_order, rollups=rollups)
+    processed_data = process_dashboard_data(df, start_date, end_date, sort_by, sort_order, dashboard_data,
+                                            total_capacity=total_capacity)
+    with _dashboard_memo_lock:
+        memo[key] = (dashboard_data, processed_data)
+        while len(memo) > DASHBOARD_MEMO_SIZE:
+            memo.popitem(last=False)
+    return dashboard_data, processed_data
+
+
+def process_dashboard_data(df, start_date, end_date, sort_by, sort_order, dashboard_data, total_capacity=4):
     """
     Xử lý dữ liệu dashboard phức tạp
     """
@@ -44,6 +80,8 @@ def process_dashboard_data(df, start_date, end_date, sort_by, sort_order, dashbo
     # Tạo biểu đồ doanh thu hàng tháng
     monthly_revenue_chart_json = create_revenue_chart(monthly_revenue_list)
     
+    today = datetime.today().date()
+    
     # Xử lý khách chưa thu tiền quá hạn
     overdue_unpaid_guests, overdue_total_amount = process_overdue_guests(df)
     
@@ -52,6 +90,9 @@ def process_dashboard_data(df, start_date, end_date, sort_by, sort_order, dashbo
     
     # Phát hiện ngày có quá nhiều khách
     overcrowded_days = detect_overcrowded_days(df)
+
+    # Công suất phòng trong khoảng thời gian đã chọn
+    occupancy_summary = get_occupancy_summary(df, start_date, end_date, total_capacity)
     
     # Tính tổng doanh thu theo ngày cho calendar (chia theo số đêm ở)
     daily_revenue_by_stay = get_daily_revenue_by_stay(df)
@@ -59,7 +100,6 @@ def process_dashboard_data(df, start_date, end_date, sort_by, sort_order, dashbo
     # Convert to daily_totals format for compatibility
     daily_totals = []
     for date, data in daily_revenue_by_stay.items():
-        today = datetime.today().date()
         days_from_today = (date - today).days
         
         daily_totals.append({
@@ -90,6 +130,7 @@ def process_dashboard_data(df, start_date, end_date, sort_by, sort_order, dashbo
         'overdue_unpaid_guests': overdue_unpaid_guests,
         'overdue_total_amount': overdue_total_amount,
         'overcrowded_days': overcrowded_days,
+        'occupancy_summary': occupancy_summary,
         'daily_totals': daily_totals,
         'collector_chart_json': collector_chart_data,
         'arrival_notifications': arrival_notifications,
@@ -144,115 +185,12 @@ def create_revenue_chart(monthly_revenue_list):
 
 def process_overdue_guests(df):
     """Xử lý logic khách chưa thu tiền quá hạn"""
-    overdue_unpaid_guests = []
-    overdue_total_amount = 0
-    
     try:
-        if df.empty or 'Check-in Date' not in df.columns:
-            return overdue_unpaid_guests, overdue_total_amount
-            
-        today = datetime.today().date()
-        df_work = df.copy()
-        
-        # Convert dates
-        df_work['Check-in Date'] = pd.to_datetime(df_work['Check-in Date'], errors='coerce', dayfirst=True)
-        valid_dates_mask = df_work['Check-in Date'].notna()
-        
-        if not valid_dates_mask.any():
-            return overdue_unpaid_guests, overdue_total_amount
-            
-        df_valid = df_work[valid_dates_mask].copy()
-        
-        # Create filters
-        past_checkin = df_valid['Check-in Date'].dt.date <= today
-        collected_values = ['LOC LE', 'THAO LE']
-        collector_series = df_valid['Người thu tiền'].fillna('').astype(str)
-        not_collected = ~collector_series.isin(collected_values)
-        not_cancelled = df_valid['Tình trạng'] != 'Đã hủy'
-        
-        overdue_mask = past_checkin & not_collected & not_cancelled
-        overdue_df = df_valid[overdue_mask].copy()
-        
-        if not overdue_df.empty:
-            # Calculate overdue days
-            checkin_dates = overdue_df['Check-in Date'].dt.date
-            days_overdue_list = [(today - date).days if date else 0 for date in checkin_dates]
-            overdue_df['days_overdue'] = [max(0, days) for days in days_overdue_list]
-            
-            # Calculate total amount including taxi fees
-            overdue_df = overdue_df.sort_values('days_overdue', ascending=False)
-            
-            # Calculate room fees
-            room_total = 0
-            if 'Tổng thanh toán' in overdue_df.columns:
-                room_total = pd.to_numeric(overdue_df['Tổng thanh toán'], errors='coerce').fillna(0).sum()
-            
-            # Calculate taxi fees
-            taxi_total = 0
-            if 'Taxi' in overdue_df.columns:
-                # Extract numeric values from taxi column (handles formats like "50,000đ", "50000", etc.)
-                taxi_series = overdue_df['Taxi'].fillna('').astype(str)
-                for taxi_value in taxi_series:
-                    if taxi_value and taxi_value.strip():
-                        # Remove currency symbols and commas, extract numbers
-                        import re
-                        numeric_match = re.search(r'[\d,]+', taxi_value.replace('.', ''))
-                        if numeric_match:
-                            try:
-                                taxi_amount = float(numeric_match.group().replace(',', ''))
-                                taxi_total += taxi_amount
-                            except ValueError:
-                                pass
-            
-            # Total amount = room fees + taxi fees
-            overdue_total_amount = room_total + taxi_total
-            
-            # Add calculated totals to DataFrame BEFORE converting to records
-            calculated_room_fees = []
-            calculated_taxi_fees = []
-            calculated_total_amounts = []
-            
-            for idx, (_, guest_row) in enumerate(overdue_df.iterrows()):
-                # Fix: Better room fee calculation
-                guest_room_payment = guest_row.get('Tổng thanh toán', 0)
-                if guest_room_payment is not None and guest_room_payment != '':
-                    try:
-                        guest_room_fee = float(guest_room_payment)
-                    except (ValueError, TypeError):
-                        guest_room_fee = 0
-                else:
-                    guest_room_fee = 0
-                
-                guest_taxi_fee = 0
-                
-                # Fix: Better taxi fee extraction for this guest
-                taxi_value = guest_row.get('Taxi', '')
-                if taxi_value and str(taxi_value).strip() and str(taxi_value).strip() not in ['nan', 'None', 'N/A']:
-                    import re
-                    # More robust regex to handle various formats
-                    taxi_str = str(taxi_value).replace('.', '').replace(' ', '')
-                    numeric_match = re.search(r'(\d{1,3}(?:,\d{3})*|\d+)', taxi_str)
-                    if numeric_match:
-                        try:
-                            guest_taxi_fee = float(numeric_match.group().replace(',', ''))
-                        except ValueError:
-                            guest_taxi_fee = 0
-                
-                calculated_room_fees.append(guest_room_fee)
-                calculated_taxi_fees.append(guest_taxi_fee)  
-                calculated_total_amounts.append(guest_room_fee + guest_taxi_fee)
-            
-            # Add calculated columns to DataFrame
-            overdue_df['calculated_room_fee'] = calculated_room_fees
-            overdue_df['calculated_taxi_fee'] = calculated_taxi_fees
-            overdue_df['calculated_total_amount'] = calculated_total_amounts
-            
-            overdue_unpaid_guests = overdue_df.to_dict('records')
-    
+        # Bảng công nợ (tiền phòng + taxi đã đọc sẵn) được tính một lần cho mỗi generation
+        return overdue_guest_records(df, datetime.today().date())
     except Exception as e:
         print(f"Process overdue guests error: {e}")
-    
-    return overdue_unpaid_guests, overdue_total_amount
+        return [], 0
 
 
 def process_monthly_revenue_with_unpaid(df, start_date, end_date):
@@ -263,58 +201,9 @@ def process_monthly_revenue_with_unpaid(df, start_date, end_date):
         if df.empty or 'Check-in Date' not in df.columns:
             return monthly_revenue_with_unpaid
             
-        df_period = df[
-            (df['Check-in Date'] >= pd.Timestamp(start_date)) & 
-            (df['Check-in Date'] <= pd.Timestamp(end_date)) &
-            (df['Check-in Date'] <= pd.Timestamp.now()) &
-            (df['Check-in Date'].notna())
-        ].copy()
-        
-        if df_period.empty:
-            return monthly_revenue_with_unpaid
-            
-        # Tính doanh thu đã thu và chưa thu
-        collected_df = df_period[df_period['Người thu tiền'].isin(['LOC LE', 'THAO LE'])].copy()
-        uncollected_df = df_period[~df_period['Người thu tiền'].isin(['LOC LE', 'THAO LE'])].copy()
-        
-        # Process collected revenue
-        if not collected_df.empty:
-            collected_df['Month_Period'] = collected_df['Check-in Date'].dt.to_period('M')
-            collected_monthly = collected_df.groupby('Month_Period').agg({'Tổng thanh toán': 'sum'}).reset_index()
-            collected_monthly['Tháng'] = collected_monthly['Month_Period'].dt.strftime('%Y-%m')
-        else:
-            collected_monthly = pd.DataFrame(columns=['Tháng', 'Tổng thanh toán'])
-        
-        # Process uncollected revenue
-        if not uncollected_df.empty:
-            uncollected_df['Month_Period'] = uncollected_df['Check-in Date'].dt.to_period('M')
-            uncollected_monthly = uncollected_df.groupby('Month_Period').agg({
-                'Tổng thanh toán': 'sum', 'Số đặt phòng': 'count'
-            }).reset_index()
-            uncollected_monthly['Tháng'] = uncollected_monthly['Month_Period'].dt.strftime('%Y-%m')
-            uncollected_monthly = uncollected_monthly.rename(columns={'Số đặt phòng': 'Số khách chưa thu'})
-        else:
-            uncollected_monthly = pd.DataFrame(columns=['Tháng', 'Tổng thanh toán', 'Số khách chưa thu'])
-        
-        # Merge data
-        if not collected_monthly.empty and not uncollected_monthly.empty:
-            merged_data = pd.merge(
-                collected_monthly[['Tháng', 'Tổng thanh toán']].rename(columns={'Tổng thanh toán': 'Đã thu'}),
-                uncollected_monthly[['Tháng', 'Tổng thanh toán', 'Số khách chưa thu']].rename(columns={'Tổng thanh toán': 'Chưa thu'}),
-                on='Tháng', how='outer'
-            ).fillna(0)
-        elif not collected_monthly.empty:
-            merged_data = collected_monthly.rename(columns={'Tổng thanh toán': 'Đã thu'})
-            merged_data[['Chưa thu', 'Số khách chưa thu']] = 0
-        elif not uncollected_monthly.empty:
-            merged_data = uncollected_monthly.rename(columns={'Tổng thanh toán': 'Chưa thu'})
-            merged_data['Đã thu'] = 0
-        else:
-            merged_data = pd.DataFrame(columns=['Tháng', 'Đã thu', 'Chưa thu', 'Số khách chưa thu'])
-        
-        if not merged_data.empty:
-            merged_data = merged_data.sort_values('Tháng')
-            monthly_revenue_with_unpaid = safe_to_dict_records(merged_data)
+        # Đã thu (LOC LE / THAO LE) và chưa thu theo tháng check-in, tính cùng một lần groupby
+        period = get_dashboard_aggregates(df).period_summary(start_date, end_date, datetime.today())
+        monthly_revenue_with_unpaid = period['monthly_revenue_with_unpaid']
     
     except Exception as e:
         print(f"Process monthly revenue error: {e}")
@@ -331,24 +220,19 @@ def detect_overcrowded_days(df):
             return overcrowded_days
             
         today = datetime.today()
-        check_start = today - timedelta(days=30)
-        check_end = today + timedelta(days=30)
         
-        df_check = df.copy()
-        df_check['Check-in Date'] = pd.to_datetime(df_check['Check-in Date'], errors='coerce', dayfirst=True)
+        # Check-in từ 29 ngày trước tới 30 ngày sau (giống so sánh với now - 30 ngày có giờ trước đây)
+        dates = get_booking_dates(df)
+        window_mask = dates.check_in_between(today - timedelta(days=29), today + timedelta(days=30)) & dates.active
         
-        valid_checkins = df_check[
-            (df_check['Check-in Date'].notna()) &
-            (df_check['Check-in Date'] >= pd.Timestamp(check_start)) &
-            (df_check['Check-in Date'] <= pd.Timestamp(check_end)) &
-            (df_check['Tình trạng'] != 'Đã hủy')
-        ].copy()
+        valid_checkins = df[window_mask]
         
         if valid_checkins.empty:
             return overcrowded_days
             
         # Group by date and count guests + calculate daily totals
-        daily_checkins = valid_checkins.groupby(valid_checkins['Check-in Date'].dt.date).agg({
+        checkin_days = dates.check_in[window_mask].astype(object)
+        daily_checkins = valid_checkins.groupby(checkin_days).agg({
             'Số đặt phòng': ['count', lambda x: list(x)],
             'Tên người đặt': lambda x: list(x),
             'Tổng thanh toán': ['sum', lambda x: list(x)]
@@ -389,6 +273,31 @@ def detect_overcrowded_days(df):
     return overcrowded_days
 
 
+def get_occupancy_summary(df, start_date, end_date, total_capacity):
+    """Công suất phòng từ start_date tới end_date, đọc từ occupancy index dùng chung với calendar"""
+    summary = {'occupied_nights': 0, 'available_nights': 0, 'occupancy_rate': 0.0, 'today_occupied': 0,
+               'total_capacity': total_capacity}
+    try:
+        if df.empty or total_capacity <= 0:
+            return summary
+
+        occupancy = get_occupancy_index(df)
+        per_day = occupancy.occupancy_between(start_date, end_date)
+        # Ngày nhận quá số phòng chỉ tính tối đa total_capacity
+        occupied_nights = int(per_day.clip(max=total_capacity).sum())
+        available_nights = total_capacity * len(per_day)
+        summary.update({
+            'occupied_nights': occupied_nights,
+            'available_nights': available_nights,
+            'occupancy_rate': round(occupied_nights * 100 / available_nights, 1) if available_nights else 0.0,
+            'today_occupied': occupancy.occupied_on(datetime.today()),
+        })
+    except Exception as e:
+        print(f"Occupancy summary error: {e}")
+
+    return summary
+
+
 def get_daily_totals(df):
     """Tính tổng doanh thu theo ngày cho calendar"""
     daily_totals = []
@@ -398,24 +307,19 @@ def get_daily_totals(df):
             return daily_totals
             
         today = datetime.today()
-        check_start = today - timedelta(days=7)  # 7 days ago
-        check_end = today + timedelta(days=14)   # 14 days ahead
         
-        df_check = df.copy()
-        df_check['Check-in Date'] = pd.to_datetime(df_check['Check-in Date'], errors='coerce', dayfirst=True)
+        # Check-in từ 6 ngày trước tới 14 ngày sau (giống so sánh với now - 7 ngày có giờ trước đây),
+        # đọc trên cột ngày chuẩn của generation thay vì copy df và parse lại
+        dates = get_booking_dates(df)
+        window_mask = dates.check_in_between(today - timedelta(days=6), today + timedelta(days=14)) & dates.active
         
-        valid_checkins = df_check[
-            (df_check['Check-in Date'].notna()) &
-            (df_check['Check-in Date'] >= pd.Timestamp(check_start)) &
-            (df_check['Check-in Date'] <= pd.Timestamp(check_end)) &
-            (df_check['Tình trạng'] != 'Đã hủy')
-        ].copy()
+        valid_checkins = df[window_mask]
         
         if valid_checkins.empty:
             return daily_totals
             
         # Group by date and calculate totals
-        daily_checkins = valid_checkins.groupby(valid_checkins['Check-in Date'].dt.date).agg({
+        daily_checkins = valid_checkins.groupby(dates.check_in[window_mask].astype(object)).agg({
             'Số đặt phòng': ['count', lambda x: list(x)],
             'Tên người đặt': lambda x: list(x),
             'Tổng thanh toán': ['sum', lambda x: list(x)]
@@ -447,75 +351,24 @@ def get_daily_totals(df):
 
 
 def get_daily_revenue_by_stay(df):
-    """Calculate daily revenue by dividing total booking amount by stay duration"""
+    """
+    Calculate daily revenue by dividing total booking amount by stay duration.
+    Trả về {date: {'daily_total', 'guest_count', 'bookings'}} cho các booking check-in
+    trong khoảng 30 ngày trước tới 60 ngày sau hôm nay; 'bookings' chỉ tính khi được đọc.
+    """
     daily_revenue = {}
     
     try:
         if df.empty:
             return daily_revenue
             
-        today = datetime.today()
-        check_start = today - timedelta(days=30)  # 30 days ago
-        check_end = today + timedelta(days=60)    # 60 days ahead
-        
-        df_clean = df.copy()
-        
-        # Parse dates
-        df_clean['Check-in Date'] = pd.to_datetime(df_clean['Check-in Date'], errors='coerce', dayfirst=True)
-        df_clean['Check-out Date'] = pd.to_datetime(df_clean['Check-out Date'], errors='coerce', dayfirst=True)
-        
-        # Filter valid bookings
-        valid_bookings = df_clean[
-            (df_clean['Check-in Date'].notna()) &
-            (df_clean['Check-out Date'].notna()) &
-            (df_clean['Check-in Date'] >= pd.Timestamp(check_start)) &
-            (df_clean['Check-in Date'] <= pd.Timestamp(check_end)) &
-            (df_clean['Tình trạng'] != 'Đã hủy') &
-            (df_clean['Tổng thanh toán'].notna()) &
-            (df_clean['Tổng thanh toán'] > 0)
-        ].copy()
-        
-        if valid_bookings.empty:
-            return daily_revenue
-        
-        for _, booking in valid_bookings.iterrows():
-            checkin_date = booking['Check-in Date'].date()
-            checkout_date = booking['Check-out Date'].date()
-            total_amount = float(booking['Tổng thanh toán'])
-            
-            # Calculate number of nights
-            nights = (checkout_date - checkin_date).days
-            if nights <= 0:
-                nights = 1  # Minimum 1 night
-            
-            # Calculate daily rate
-            daily_rate = total_amount / nights
-            
-            # Add daily rate to each date in the stay
-            current_date = checkin_date
-            while current_date < checkout_date:
-                if current_date not in daily_revenue:
-                    daily_revenue[current_date] = {
-                        'daily_total': 0,
-                        'guest_count': 0,
-                        'bookings': []
-                    }
-                
-                daily_revenue[current_date]['daily_total'] += daily_rate
-                daily_revenue[current_date]['guest_count'] += 1
-                daily_revenue[current_date]['bookings'].append({
-                    'guest_name': booking.get('Tên người đặt', 'N/A'),
-                    'booking_id': booking.get('Số đặt phòng', 'N/A'),
-                    'daily_amount': daily_rate,
-                    'total_amount': total_amount,
-                    'nights': nights,
-                    'checkin': checkin_date,
-                    'checkout': checkout_date
-                })
-                
-                current_date += timedelta(days=1)
+        today = datetime.today().date()
+        # Giống điều kiện cũ Check-in >= now - 30 ngày (có giờ) nên ngày today - 30 không được tính
+        first_check_in = today - timedelta(days=29)
+        last_check_in = today + timedelta(days=60)
         
-        print(f"✅ Calculated daily revenue for {len(daily_revenue)} dates")
+        # Dựng một lần cho mỗi generation của cache, dùng chung cho dashboard/calendar/calendar details
+        daily_revenue = get_nightly_revenue(df).daily_revenue(first_check_in, last_check_in)
         
     except Exception as e:
         print(f"Error calculating daily revenue by stay: {e}")
@@ -564,6 +417,17 @@ def create_collector_chart(dashboard_data):
     }
 
 
+def _day_rows(df, positions):
+    """(guest_name, booking_id, total_amount, hoa_hong) cho các dòng ở vị trí positions"""
+    rows = df.iloc[positions]
+
+    def values(column, default):
+        return rows[column].tolist() if column in rows.columns else [default] * len(rows)
+
+    return zip(values('Tên người đặt', 'Không có tên'), values('Số đặt phòng', 'N/A'),
+               values('Tổng thanh toán', 0), values('Hoa hồng', 0))
+
+
 def process_arrival_notifications(df):
     """
     Xử lý thông báo khách đến - chỉ hiển thị khách đến hôm nay và ngày mai
@@ -578,68 +442,24 @@ def process_arrival_notifications(df):
         
         notifications = []
         
-        # Lọc khách check-in - chỉ xử lý khách đến từ hôm nay trở đi
-        for index, row in df.iterrows():
-            try:
-                checkin_date = row.get('Check-in Date')
-                if checkin_date:
-                    # Xử lý nhiều định dạng ngày
-                    if isinstance(checkin_date, str):
-                        try:
-                            checkin_date = datetime.strptime(checkin_date, '%Y-%m-%d').date()
-                        except ValueError:
-                            try:
-                                checkin_date = datetime.strptime(checkin_date, '%d/%m/%Y').date()
-                            except ValueError:
-                                continue
-                    elif hasattr(checkin_date, 'date'):
-                        checkin_date = checkin_date.date()
-                    
-                    # Bỏ qua khách đã check-in trước hôm nay
-                    if checkin_date < today:
-                        continue
-                    
-                    # Khách đến ngày mai
-                    if checkin_date == tomorrow:
-                        guest_name = row.get('Tên người đặt', 'Không có tên')
-                        booking_id = row.get('Số đặt phòng', 'N/A')
-                        total_amount = row.get('Tổng thanh toán', 0)
-                        hoa_hong = row.get('Hoa hồng', 0)
-                        
-                        notifications.append({
-                            'type': 'arrival',
-                            'priority': 'high',
-                            'guest_name': guest_name,
-                            'booking_id': booking_id,
-                            'checkin_date': checkin_date.strftime('%d/%m/%Y'),
-                            'total_amount': total_amount,
-                            'Hoa hồng': hoa_hong,
-                            'days_until': 1,
-                            'message': f'Khách {guest_name} sẽ đến vào ngày mai ({checkin_date.strftime("%d/%m/%Y")})'
-                        })
-                    
-                    # Khách đến hôm nay
-                    elif checkin_date == today:
-                        guest_name = row.get('Tên người đặt', 'Không có tên')
-                        booking_id = row.get('Số đặt phòng', 'N/A')
-                        total_amount = row.get('Tổng thanh toán', 0)
-                        hoa_hong = row.get('Hoa hồng', 0)
-                        
-                        notifications.append({
-                            'type': 'arrival',
-                            'priority': 'urgent',
-                            'guest_name': guest_name,
-                            'booking_id': booking_id,
-                            'checkin_date': checkin_date.strftime('%d/%m/%Y'),
-                            'total_amount': total_amount,
-                            'Hoa hồng': hoa_hong,
-                            'days_until': 0,
-                            'message': f'Khách {guest_name} đến HÔM NAY ({checkin_date.strftime("%d/%m/%Y")})'
-                        })
-                        
-            except Exception as e:
-                print(f"Error processing arrival for row {index}: {e}")
-                continue
+        # Tra thẳng theo ngày trong chỉ mục check-in dựng sẵn cho generation này
+        day_index = get_booking_day_index(df)
+        for checkin_date, days_until, priority, message in (
+                (today, 0, 'urgent', 'Khách {guest} đến HÔM NAY ({date})'),
+                (tomorrow, 1, 'high', 'Khách {guest} sẽ đến vào ngày mai ({date})')):
+            checkin_text = checkin_date.strftime('%d/%m/%Y')
+            for guest_name, booking_id, total_amount, hoa_hong in _day_rows(df, day_index.check_ins(checkin_date)):
+                notifications.append({
+                    'type': 'arrival',
+                    'priority': priority,
+                    'guest_name': guest_name,
+                    'booking_id': booking_id,
+                    'checkin_date': checkin_text,
+                    'total_amount': total_amount,
+                    'Hoa hồng': hoa_hong,
+                    'days_until': days_until,
+                    'message': message.format(guest=guest_name, date=checkin_text)
+                })
         
         # Sắp xếp theo độ ưu tiên
         notifications.sort(key=lambda x: (x['days_until'], x['guest_name']))
@@ -665,60 +485,23 @@ def process_departure_notifications(df):
         
         notifications = []
         
-        # Lọc khách check-out ngày mai (để chuẩn bị dịch vụ)
-        for index, row in df.iterrows():
-            try:
-                checkout_date = row.get('Check-out Date')
-                if checkout_date:
-                    # Xử lý nhiều định dạng ngày
-                    if isinstance(checkout_date, str):
-                        try:
-                            checkout_date = datetime.strptime(checkout_date, '%Y-%m-%d').date()
-                        except ValueError:
-                            try:
-                                checkout_date = datetime.strptime(checkout_date, '%d/%m/%Y').date()
-                            except ValueError:
-                                continue
-                    elif hasattr(checkout_date, 'date'):
-                        checkout_date = checkout_date.date()
-                    
-                    # Khách đi ngày mai
-                    if checkout_date == tomorrow:
-                        guest_name = row.get('Tên người đặt', 'Không có tên')
-                        booking_id = row.get('Số đặt phòng', 'N/A')
-                        total_amount = row.get('Tổng thanh toán', 0)
-                        
-                        notifications.append({
-                            'type': 'departure',
-                            'priority': 'high',
-                            'guest_name': guest_name,
-                            'booking_id': booking_id,
-                            'checkout_date': checkout_date.strftime('%d/%m/%Y'),
-                            'total_amount': total_amount,
-                            'days_until': 1,
-                            'message': f'Khách {guest_name} sẽ đi vào ngày mai ({checkout_date.strftime("%d/%m/%Y")}) - Chuẩn bị taxi/dịch vụ'
-                        })
-                    
-                    # Khách đi hôm nay
-                    elif checkout_date == today:
-                        guest_name = row.get('Tên người đặt', 'Không có tên')
-                        booking_id = row.get('Số đặt phòng', 'N/A')
-                        total_amount = row.get('Tổng thanh toán', 0)
-                        
-                        notifications.append({
-                            'type': 'departure',
-                            'priority': 'urgent',
-                            'guest_name': guest_name,
-                            'booking_id': booking_id,
-                            'checkout_date': checkout_date.strftime('%d/%m/%Y'),
-                            'total_amount': total_amount,
-                            'days_until': 0,
-                            'message': f'Khách {guest_name} đi HÔM NAY ({checkout_date.strftime("%d/%m/%Y")}) - Hỗ trợ taxi ngay'
-                        })
-                        
-            except Exception as e:
-                print(f"Error processing departure for row {index}: {e}")
-                continue
+        # Tra thẳng theo ngày trong chỉ mục check-out dựng sẵn cho generation này
+        day_index = get_booking_day_index(df)
+        for checkout_date, days_until, priority, message in (
+                (today, 0, 'urgent', 'Khách {guest} đi HÔM NAY ({date}) - Hỗ trợ taxi ngay'),
+                (tomorrow, 1, 'high', 'Khách {guest} sẽ đi vào ngày mai ({date}) - Chuẩn bị taxi/dịch vụ')):
+            checkout_text = checkout_date.strftime('%d/%m/%Y')
+            for guest_name, booking_id, total_amount, _ in _day_rows(df, day_index.check_outs(checkout_date)):
+                notifications.append({
+                    'type': 'departure',
+                    'priority': priority,
+                    'guest_name': guest_name,
+                    'booking_id': booking_id,
+                    'checkout_date': checkout_text,
+                    'total_amount': total_amount,
+                    'days_until': days_until,
+                    'message': message.format(guest=guest_name, date=checkout_text)
+                })
         
         # Sắp xếp theo độ ưu tiên
         notifications.sort(key=lambda x: (x['days_until'], x['guest_name']))
@@ -1,7 +1,185 @@
 import os
 import json
+import threading
+import time
 import gspread
-import tempfile
+
+# Thời gian giữ handle spreadsheet/worksheet trước khi đọc lại metadata (giây)
+HANDLE_TTL_SECONDS = int(os.getenv("GSPREAD_HANDLE_TTL", "1800"))
+
+# Client dùng chung trong process: giữ OAuth token đã refresh và HTTP session (keep-alive)
+_client_pool = {}
+_pool_lock = threading.Lock()
+
+# Header theo worksheet: {(spreadsheet_id, worksheet_id): (header, {tên cột: index từ 1}, thời điểm đọc)}
+_header_cache = {}
+_header_lock = threading.Lock()
+
+
+class PooledSpreadsheet(gspread.Spreadsheet):
+    """
+    Spreadsheet giữ sẵn worksheet handle theo title, để worksheet()/sheet1
+    không phải gọi lại fetch_sheet_metadata mỗi lần.
+    """
+
+    def __init__(self, client, properties):
+        super().__init__(client, properties)
+        self._worksheet_handles = {}
+        self._handles_lock = threading.Lock()
+
+    def worksheet(self, title):
+        with self._handles_lock:
+            handle = self._worksheet_handles.get(title)
+        if handle is None:
+            handle = super().worksheet(title)
+            with self._handles_lock:
+                self._worksheet_handles[title] = handle
+        return handle
+
+    @property
+    def sheet1(self):
+        with self._handles_lock:
+            handle = self._worksheet_handles.get(None)
+        if handle is None:
+            handle = self.get_worksheet(0)
+            with self._handles_lock:
+                self._worksheet_handles[None] = handle
+                self._worksheet_handles[handle.title] = handle
+        return handle
+
+    def add_worksheet(self, title, rows, cols, index=None):
+        handle = super().add_worksheet(title, rows, cols, index)
+        with self._handles_lock:
+            self._worksheet_handles[title] = handle
+        return handle
+
+    def del_worksheet(self, worksheet):
+        result = super().del_worksheet(worksheet)
+        self.forget_worksheet(worksheet.title)
+        return result
+
+    def forget_worksheet(self, title=None):
+        """Bỏ handle đã lưu (title=None: bỏ tất cả), lần sau sẽ đọc lại metadata"""
+        with self._handles_lock:
+            if title is None:
+                self._worksheet_handles.clear()
+            else:
+                self._worksheet_handles = {
+                    key: handle for key, handle in self._worksheet_handles.items()
+                    if key != title and handle.title != title
+                }
+
+
+class PooledClient(gspread.Client):
+    """
+    gspread Client dùng lại cho mọi request trong process.
+    open_by_key() trả về spreadsheet handle đã mở (trong HANDLE_TTL_SECONDS) thay vì gọi API lại.
+    """
+
+    def __init__(self, auth, session=None):
+        super().__init__(auth, session)
+        self._spreadsheets = {}
+        self._spreadsheets_lock = threading.Lock()
+
+    def open_by_key(self, key):
+        with self._spreadsheets_lock:
+            cached = self._spreadsheets.get(key)
+        if cached and time.time() - cached[1] < HANDLE_TTL_SECONDS:
+            return cached[0]
+
+        spreadsheet = PooledSpreadsheet(self, {"id": key})
+        with self._spreadsheets_lock:
+            self._spreadsheets[key] = (spreadsheet, time.time())
+        return spreadsheet
+
+    def forget_spreadsheet(self, key=None):
+        """Bỏ spreadsheet handle đã lưu (key=None: bỏ tất cả)"""
+        with self._spreadsheets_lock:
+            if key is None:
+                self._spreadsheets.clear()
+            else:
+                self._spreadsheets.pop(key, None)
+
+
+def _get_pooled_client(pool_key, factory):
+    """Lấy client trong pool, tạo mới nếu chưa có"""
+    with _pool_lock:
+        client = _client_pool.get(pool_key)
+        if client is None:
+            client = factory()
+            _client_pool[pool_key] = client
+        return client
+
+
+def reset_gspread_pool():
+    """Xóa toàn bộ client/handle đã lưu (ví dụ sau khi đổi credentials)"""
+    with _pool_lock:
+        _client_pool.clear()
+
+
+def _header_key(worksheet):
+    return (worksheet.spreadsheet.id, worksheet.id)
+
+
+def remember_worksheet_header(worksheet, header):
+    """
+    Ghi nhớ header vừa đọc/ghi được (ví dụ hàng đầu của get_all_values).
+    Trả về True nếu header khác với bản đã lưu - khi đó các index cột cũ bị thay thế.
+    """
+    header = [str(col) for col in header]
+    column_index = {}
+    for i, col in enumerate(header):
+        # Giữ cột đầu tiên nếu trùng tên, giống header.index()
+        column_index.setdefault(col, i + 1)
+
+    key = _header_key(worksheet)
+    with _header_lock:
+        previous = _header_cache.get(key)
+        _header_cache[key] = (header, column_index, time.time())
+
+    changed = previous is not None and previous[0] != header
+    if changed:
+        print(f"[SHEETS] Header of worksheet '{worksheet.title}' changed, column cache rebuilt")
+    return changed
+
+
+def get_worksheet_header(worksheet, refresh=False):
+    """Header của worksheet, chỉ gọi row_values(1) khi chưa có trong cache hoặc đã quá HANDLE_TTL_SECONDS"""
+    key = _header_key(worksheet)
+    with _header_lock:
+        cached = _header_cache.get(key)
+    if not refresh and cached and time.time() - cached[2] < HANDLE_TTL_SECONDS:
+        return list(cached[0])
+
+    header = worksheet.row_values(1)
+    remember_worksheet_header(worksheet, header)
+    return list(header)
+
+
+def get_column_index(worksheet, column_name):
+    """
+    Index (từ 1) của cột theo tên, tra trong cache header.
+    Nếu không thấy thì đọc lại header một lần (có thể vừa thêm cột); trả về None nếu vẫn không có.
+    """
+    get_worksheet_header(worksheet)
+    with _header_lock:
+        column_index = _header_cache[_header_key(worksheet)][1]
+    if column_name in column_index:
+        return column_index[column_name]
+
+    get_worksheet_header(worksheet, refresh=True)
+    with _header_lock:
+        return _header_cache[_header_key(worksheet)][1].get(column_name)
+
+
+def invalidate_worksheet_header(worksheet=None):
+    """Bỏ header đã lưu của một worksheet (None: tất cả)"""
+    with _header_lock:
+        if worksheet is None:
+            _header_cache.clear()
+        else:
+            _header_cache.pop(_header_key(worksheet), None)
+
 
 def _get_gspread_client_production():
     """
@@ -13,22 +191,22 @@ def _get_gspread_client_production():
         gcp_credentials_json = os.getenv('GCP_CREDENTIALS_JSON')
         
         if gcp_credentials_json:
-            print("Sử dụng credentials từ environment variable")
-            # Parse JSON string từ environment variable
-            credentials_dict = json.loads(gcp_credentials_json)
-            
-            # Tạo temporary file để gspread có thể đọc
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as temp_file:
-                json.dump(credentials_dict, temp_file)
-                temp_file_path = temp_file.name
-            
-            return gspread.service_account(filename=temp_file_path)
+            def create_client():
+                print("Sử dụng credentials từ environment variable")
+                # Parse JSON string từ environment variable, không cần ghi ra file tạm
+                credentials_dict = json.loads(gcp_credentials_json)
+                return gspread.service_account_from_dict(credentials_dict, client_factory=PooledClient)
+
+            return _get_pooled_client(('env', hash(gcp_credentials_json)), create_client)
         
         # Fallback về file local nếu có
         local_creds_path = os.getenv("GCP_CREDS_FILE_PATH", "gcp_credentials.json")
         if os.path.exists(local_creds_path):
-            print(f"Sử dụng credentials từ file local: {local_creds_path}")
-            return gspread.service_account(filename=local_creds_path)
+            def create_client():
+                print(f"Sử dụng credentials từ file local: {local_creds_path}")
+                return gspread.service_account(filename=local_creds_path, client_factory=PooledClient)
+
+            return _get_pooled_client(('file', os.path.abspath(local_creds_path)), create_client)
         
         raise Exception("Không tìm thấy Google credentials")
         
@@ -38,7 +216,8 @@ def _get_gspread_client_production():
 
 def get_gspread_client_safe(gcp_creds_file_path=None):
     """
-    Wrapper function để tự động chọn phương thức kết nối phù hợp
+    Wrapper function để tự động chọn phương thức kết nối phù hợp.
+    Client được tạo một lần mỗi process và dùng lại cho các lần gọi sau.
     """
     # Kiểm tra nếu đang chạy trong production (có GCP_CREDENTIALS_JSON)
     if os.getenv('GCP_CREDENTIALS_JSON'):
@@ -46,7 +225,10 @@ def get_gspread_client_safe(gcp_creds_file_path=None):
     
     # Nếu không, sử dụng file path truyền vào
     if gcp_creds_file_path and os.path.exists(gcp_creds_file_path):
-        return gspread.service_account(filename=gcp_creds_file_path)
+        return _get_pooled_client(
+            ('file', os.path.abspath(gcp_creds_file_path)),
+            lambda: gspread.service_account(filename=gcp_creds_file_path, client_factory=PooledClient)
+        )
     
     # Cuối cùng, thử production method
     return _get_gspread_client_production()
@@ -7,6 +7,7 @@ import os
 from typing import Dict, List, Optional, Tuple, Any
 import json
 import calendar
+import functools
 from io import BytesIO
 
 # Import các thư viện có thể không có sẵn
@@ -35,11 +36,25 @@ except ImportError:
     plotly = None
 
 try:
-    from gcp_helper import get_gspread_client_safe
+    from gcp_helper import get_gspread_client_safe, get_worksheet_header, get_column_index, remember_worksheet_header
 except ImportError:
     def get_gspread_client_safe(gcp_creds_file_path):
         raise ImportError("gcp_helper module not available")
 
+    def get_worksheet_header(worksheet, refresh=False):
+        return worksheet.row_values(1)
+
+    def get_column_index(worksheet, column_name):
+        header = worksheet.row_values(1)
+        return header.index(column_name) + 1 if column_name in header else None
+
+    def remember_worksheet_header(worksheet, header):
+        return False
+
+from booking_indexes import get_occupancy_index, get_dashboard_aggregates, get_booking_dates, get_booking_interval_index
+from booking_duplicates import get_duplicate_report, check_new_bookings
+from money import parse_amount, parse_money_series
+
 # ==============================================================================
 # GOOGLE SHEETS HELPER
 # ==============================================================================
@@ -54,141 +69,150 @@ def _get_gspread_client(gcp_creds_file_path: str):
         print(f"ERROR: Authentication failed with credentials file '{gcp_creds_file_path}': {e}")
         raise
 
-def import_from_gsheet(sheet_id: str, gcp_creds_file_path: str, worksheet_name: Optional[str] = None) -> pd.DataFrame:
+# In thêm chi tiết khi import booking (tên cột, dòng bị loại, giá trị ngày không đọc được)
+IMPORT_DEBUG = os.getenv("BOOKING_IMPORT_DEBUG", "false").lower() == "true"
+
+# Kiểu dữ liệu của các cột booking sau khi đọc từ sheet; cột không có ở đây giữ nguyên chuỗi
+BOOKING_COLUMN_SCHEMA = {
+    'Tình trạng': 'category',
+    'Người thu tiền': 'category',
+    'Thành viên Genius': 'category',
+    'Tổng thanh toán': 'money',
+    'Hoa hồng': 'money',
+    'Check-in Date': 'date',
+    'Check-out Date': 'date',
+}
+
+def import_from_gsheet(sheet_id: str, gcp_creds_file_path: str, worksheet_name: Optional[str] = None,
+                       with_row_numbers: bool = False):
     """
     Hàm này sẽ đọc dữ liệu từ Google Sheet và thực hiện việc chuyển đổi kiểu dữ liệu
     một lần duy nhất và chính xác tại đây.
+    Nếu with_row_numbers=True thì trả về (df, số hàng trong sheet của từng dòng df).
     """
     try:
         gc = _get_gspread_client(gcp_creds_file_path)
         sh = gc.open_by_key(sheet_id)
         worksheet = sh.worksheet(worksheet_name) if worksheet_name else sh.sheet1
         data = worksheet.get_all_values()
-        if not data or len(data) < 2:
-            return pd.DataFrame()
-        
-        # === FIX: HANDLE DUPLICATE COLUMN NAMES ===
-        original_columns = data[0]
-        # Safe print for Windows encoding
-        try:
-            print(f"DEBUG: Original columns: {original_columns}")
-        except UnicodeEncodeError:
-            print(f"DEBUG: Original columns count: {len(original_columns)}")
-        
-        # Detect and fix duplicate columns
-        seen_columns = {}
-        clean_columns = []
-        for col in original_columns:
-            if col in seen_columns:
-                seen_columns[col] += 1
-                clean_columns.append(f"{col}_{seen_columns[col]}")
-                print(f"WARNING: Duplicate column '{col}' renamed to '{col}_{seen_columns[col]}'")
-            else:
-                seen_columns[col] = 0
-                clean_columns.append(col)
-        
-        df = pd.DataFrame(data[1:], columns=clean_columns)
-        # Safe print for Windows encoding
-        try:
-            print(f"DEBUG: Cleaned columns: {clean_columns}")
-        except UnicodeEncodeError:
-            print(f"DEBUG: Cleaned columns count: {len(clean_columns)}")
-        
-        # === SỬA LỖI: LỌC BỎ HÀNG TRỐNG ===
-        print(f"DEBUG: Original data has {len(df)} rows")
-        
-        # Loại bỏ hàng hoàn toàn trống
-        df = df.dropna(how='all')
-        print(f"DEBUG: After removing completely empty rows: {len(df)} rows")
-        
-        # Loại bỏ hàng không có Số đặt phòng hoặc Tên người đặt (hai trường quan trọng nhất)
-        if 'Số đặt phòng' in df.columns and 'Tên người đặt' in df.columns:
-            # Store original count for debugging
-            original_count = len(df)
-            
-            # Convert to string first to avoid errors with numeric values or NaN
-            df_booking_id_valid = (df['Số đặt phòng'].notna()) & (df['Số đặt phòng'].astype(str).str.strip() != '') & (df['Số đặt phòng'].astype(str).str.strip() != 'nan')
-            df_guest_name_valid = (df['Tên người đặt'].notna()) & (df['Tên người đặt'].astype(str).str.strip() != '') & (df['Tên người đặt'].astype(str).str.strip() != 'nan')
-            
-            # Show invalid bookings before removing them
-            invalid_mask = ~(df_booking_id_valid & df_guest_name_valid)
-            if invalid_mask.any():
-                invalid_bookings = df[invalid_mask][['Số đặt phòng', 'Tên người đặt']].head(3)
-                print(f"DEBUG: Sample invalid bookings to be removed: {invalid_bookings.to_dict('records')}")
-                
-                # CRITICAL DEBUG: Check if our target booking is being filtered out
-                target_id = '6481690399'
-                target_booking = df[df['Số đặt phòng'].astype(str) == target_id]
-                if not target_booking.empty:
-                    booking_data = target_booking[['Số đặt phòng', 'Tên người đặt']].iloc[0]
-                    print(f"DEBUG: Target booking {target_id} found - ID: '{booking_data['Số đặt phòng']}', Name: '{booking_data['Tên người đặt']}'")
-                    if target_booking.index[0] in df[invalid_mask].index:
-                        print(f"ERROR: Target booking {target_id} is being INCORRECTLY filtered out!")
-                        print(f"ERROR: ID valid: {df_booking_id_valid.iloc[target_booking.index[0]]}")
-                        print(f"ERROR: Name valid: {df_guest_name_valid.iloc[target_booking.index[0]]}")
-            
-            df = df[df_booking_id_valid & df_guest_name_valid]
-            final_count = len(df)
-            print(f"DEBUG: After removing rows with missing critical info: {final_count} rows")
-            
-            if final_count < original_count:
-                removed_count = original_count - final_count
-                print(f"DEBUG: Removed {removed_count} rows with missing info")
-        
-        # CRITICAL DEBUG: Check for target booking in RAW data before filtering
-        target_id = '6481690399'
-        raw_target_check = df[df['Số đặt phòng'].astype(str) == target_id]
-        if not raw_target_check.empty:
-            print(f"DEBUG RAW: Target booking {target_id} FOUND in raw data at row {raw_target_check.index[0]}")
-            print(f"DEBUG RAW: Data: {raw_target_check[['Số đặt phòng', 'Tên người đặt']].iloc[0].to_dict()}")
-        else:
-            print(f"DEBUG RAW: Target booking {target_id} NOT FOUND in raw data!")
-            print(f"DEBUG RAW: Sample booking IDs in raw data: {df['Số đặt phòng'].head(10).tolist()}")
-        
-        # Reset index sau khi loại bỏ hàng
-        df = df.reset_index(drop=True)
-        
-        if 'Tổng thanh toán' in df.columns:
-            df['Tổng thanh toán'] = pd.to_numeric(df['Tổng thanh toán'].astype(str).str.replace('[^\\d.]', '', regex=True), errors='coerce').fillna(0)
-        
-        # Xử lý cột Hoa hồng
-        if 'Hoa hồng' in df.columns:
-            df['Hoa hồng'] = pd.to_numeric(df['Hoa hồng'].astype(str).str.replace('[^\\d.]', '', regex=True), errors='coerce').fillna(0)
-        else:
-            # Nếu chưa có cột Hoa hồng, tạo mặc định = 0
-            df['Hoa hồng'] = 0
-        
-        # === SỬA LỖI QUAN TRỌNG NHẤT ===
-        # Ép Pandas đọc ngày tháng theo đúng định dạng YYYY-MM-DD từ sheet của bạn.
-        # Điều này loại bỏ mọi sự mơ hồ và sửa lỗi "dừng ở ngày 13".
-        # Chúng ta sẽ sử dụng các cột này trong toàn bộ ứng dụng.
-        if 'Check-in Date' in df.columns:
-            print(f"DEBUG: Processing Check-in Date column. Sample values: {df['Check-in Date'].head().tolist()}")
-            df['Check-in Date'] = pd.to_datetime(df['Check-in Date'], format='%Y-%m-%d', errors='coerce')
-            # Debug: Check for any NaT values after conversion
-            nat_count = df['Check-in Date'].isna().sum()
-            if nat_count > 0:
-                print(f"WARNING: {nat_count} Check-in Date values could not be parsed")
-                # Print problematic values
-                problematic = df[df['Check-in Date'].isna()]['Số đặt phòng'].tolist()[:5]
-                print(f"DEBUG: Problematic booking IDs: {problematic}")
-                
-        if 'Check-out Date' in df.columns:
-            print(f"DEBUG: Processing Check-out Date column. Sample values: {df['Check-out Date'].head().tolist()}")
-            df['Check-out Date'] = pd.to_datetime(df['Check-out Date'], format='%Y-%m-%d', errors='coerce')
-            # Debug: Check for any NaT values after conversion
-            nat_count = df['Check-out Date'].isna().sum()
-            if nat_count > 0:
-                print(f"WARNING: {nat_count} Check-out Date values could not be parsed")
-                # Print problematic values
-                problematic = df[df['Check-out Date'].isna()]['Số đặt phòng'].tolist()[:5]
-                print(f"DEBUG: Problematic booking IDs: {problematic}")
-            
-        return df
+        if data:
+            remember_worksheet_header(worksheet, data[0])
+
+        df, sheet_row_numbers = parse_booking_rows(data)
+        return (df, sheet_row_numbers) if with_row_numbers else df
     except Exception as e:
         print(f"ERROR importing from Google Sheet: {e}")
         raise
 
+def _dedupe_columns(columns: List[str]) -> List[str]:
+    """Đổi tên cột trùng thành 'Tên_1', 'Tên_2'... để DataFrame không có cột trùng"""
+    seen_columns = {}
+    clean_columns = []
+    for col in columns:
+        if col in seen_columns:
+            seen_columns[col] += 1
+            clean_columns.append(f"{col}_{seen_columns[col]}")
+            print(f"WARNING: Duplicate column '{col}' renamed to '{col}_{seen_columns[col]}'")
+        else:
+            seen_columns[col] = 0
+            clean_columns.append(col)
+    return clean_columns
+
+def _non_blank(series: pd.Series) -> pd.Series:
+    """Mask các ô có giá trị (bỏ ô trống, chỉ có khoảng trắng hoặc chuỗi 'nan')"""
+    stripped = series.fillna('').astype(str).str.strip()
+    return ~stripped.isin(['', 'nan'])
+
+def parse_booking_rows(data: List[List[str]]) -> Tuple[pd.DataFrame, List[int]]:
+    """
+    Chuyển kết quả get_all_values() (hàng đầu là header) thành DataFrame booking đã đúng kiểu.
+    Trả về (df, số hàng trong sheet của từng dòng df).
+    """
+    if not data or len(data) < 2:
+        return pd.DataFrame(), []
+
+    clean_columns = _dedupe_columns(data[0])
+    df = pd.DataFrame(data[1:], columns=clean_columns)
+    if IMPORT_DEBUG:
+        print(f"DEBUG: Columns: {clean_columns}")
+        print(f"DEBUG: Original data has {len(df)} rows")
+
+    # Loại bỏ hàng không có Số đặt phòng hoặc Tên người đặt (hai trường quan trọng nhất)
+    if 'Số đặt phòng' in df.columns and 'Tên người đặt' in df.columns:
+        valid_mask = _non_blank(df['Số đặt phòng']) & _non_blank(df['Tên người đặt'])
+        if not valid_mask.all():
+            if IMPORT_DEBUG:
+                invalid_bookings = df.loc[~valid_mask, ['Số đặt phòng', 'Tên người đặt']].head(3)
+                print(f"DEBUG: Sample invalid bookings to be removed: {invalid_bookings.to_dict('records')}")
+            df = df[valid_mask]
+            if IMPORT_DEBUG:
+                print(f"DEBUG: Removed {int((~valid_mask).sum())} rows with missing info, {len(df)} rows left")
+    else:
+        df = df.dropna(how='all')
+
+    # Số hàng trong sheet: index gốc tính từ data[1:] nên +2 (header là hàng 1)
+    sheet_row_numbers = (df.index + 2).tolist()
+    df = df.reset_index(drop=True)
+
+    df = convert_booking_dtypes(df)
+    return df, sheet_row_numbers
+
+def _parse_money_column(series: pd.Series) -> pd.Series:
+    """Chuỗi tiền (có thể có dấu phẩy, ký hiệu tiền tệ) -> int64, ô trống/lỗi = 0"""
+    if pd.api.types.is_integer_dtype(series.dtype):
+        return series.astype('int64')
+    return parse_money_series(series).round().astype('int64')
+
+def _to_category_column(series: pd.Series) -> pd.Series:
+    """
+    Cột ít giá trị khác nhau -> category. Luôn có category '' để fillna('')
+    và gán ô trống không bị lỗi "new category".
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        if '' in series.cat.categories:
+            return series
+        return series.cat.set_categories(sorted(set(series.cat.categories) | {''}))
+    values = series.fillna('').astype(str)
+    return values.astype(pd.CategoricalDtype(sorted(set(values.unique()) | {''})))
+
+def _set_string_value(df: pd.DataFrame, idx, column: str, value: str) -> None:
+    """Gán chuỗi vào một ô; cột category thì thêm category mới nếu cần"""
+    if isinstance(df[column].dtype, pd.CategoricalDtype) and value not in df[column].cat.categories:
+        df[column] = df[column].cat.add_categories([value])
+    df.loc[idx, column] = value
+
+def convert_booking_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Chuyển các cột trong BOOKING_COLUMN_SCHEMA từ chuỗi (như trong sheet) sang đúng kiểu:
+    tiền -> int64, ngày -> datetime64, cột trạng thái/người thu -> category.
+    Dùng chung cho import_from_gsheet và khi vá thêm dòng mới vào cache;
+    gọi lại trên DataFrame đã đúng kiểu thì không đổi gì.
+    """
+    # Nếu chưa có cột Hoa hồng, tạo mặc định = 0
+    if 'Hoa hồng' not in df.columns:
+        df['Hoa hồng'] = 0
+
+    for column, kind in BOOKING_COLUMN_SCHEMA.items():
+        if column not in df.columns:
+            continue
+        series = df[column]
+        if kind == 'money':
+            df[column] = _parse_money_column(series)
+        elif kind == 'category':
+            df[column] = _to_category_column(series)
+        elif kind == 'date' and not pd.api.types.is_datetime64_any_dtype(series.dtype):
+            # === SỬA LỖI QUAN TRỌNG NHẤT ===
+            # Ép Pandas đọc ngày tháng theo đúng định dạng YYYY-MM-DD từ sheet của bạn.
+            # Điều này loại bỏ mọi sự mơ hồ và sửa lỗi "dừng ở ngày 13".
+            df[column] = pd.to_datetime(series, format='%Y-%m-%d', errors='coerce')
+            nat_mask = df[column].isna() & _non_blank(series)
+            if nat_mask.any():
+                print(f"WARNING: {int(nat_mask.sum())} {column} values could not be parsed")
+                if IMPORT_DEBUG and 'Số đặt phòng' in df.columns:
+                    print(f"DEBUG: Problematic booking IDs: {df.loc[nat_mask, 'Số đặt phòng'].tolist()[:5]}")
+
+    return df
+
 def export_data_to_new_sheet(df: pd.DataFrame, gcp_creds_file_path: str, sheet_id: str) -> str:
     gc = _get_gspread_client(gcp_creds_file_path)
     spreadsheet = gc.open_by_key(sheet_id)
@@ -217,8 +241,8 @@ def append_multiple_bookings_to_sheet(bookings: List[Dict[str, Any]], gcp_creds_
         if bookings:
             print(f"Sample booking data keys: {list(bookings[0].keys())}")
         
-        # Get header from Google Sheet
-        header = worksheet.row_values(1)
+        # Get header from Google Sheet (cached per worksheet)
+        header = get_worksheet_header(worksheet)
         print(f"Google Sheet header: {header}")
         
         # Debug: Print EXACT header structure for diagnosis
@@ -371,8 +395,9 @@ def append_multiple_bookings_to_sheet(bookings: List[Dict[str, Any]], gcp_creds_
             
             # Save with enhanced error handling    
             try:
-                worksheet.append_rows(normalized_rows, value_input_option='USER_ENTERED')
+                append_response = worksheet.append_rows(normalized_rows, value_input_option='USER_ENTERED')
                 print(f"Successfully appended {len(normalized_rows)} rows using append_rows")
+                _register_appended_booking_rows(sheet_id, worksheet_name, bookings, append_response)
             except Exception as append_error:
                 print(f"CRITICAL: append_rows failed: {append_error}")
                 # Last resort: try basic append with minimal data
@@ -415,11 +440,92 @@ def append_multiple_bookings_to_sheet(bookings: List[Dict[str, Any]], gcp_creds_
         traceback.print_exc()
         raise
 
-def update_row_in_gsheet(sheet_id: str, gcp_creds_file_path: str, worksheet_name: str, booking_id: str, new_data: dict) -> bool:
+# Đọc ô ID của hàng lấy từ row index trước khi ghi - thêm một lần gọi Sheets cho mỗi lần sửa nên
+# mặc định tắt: row index được dựng lại mỗi lần tải toàn bộ, cập nhật khi append/xóa hàng và không
+# được dùng trong lúc đang xóa hàng. Bật (true) khi sheet hay bị chèn/xóa hàng bằng tay.
+SHEETS_ROW_GUARD = os.getenv("SHEETS_ROW_GUARD", "false").lower() == "true"
+# Kiểm tra giá trị sau khi ghi (từ response của batch_update, không đọc lại hàng)
+SHEETS_VERIFY_UPDATES = os.getenv("SHEETS_VERIFY_UPDATES", "false").lower() == "true"
+
+def _update_row_by_index(worksheet, sheet_id: str, worksheet_name: str, booking_id: str, new_data: dict, verify: bool) -> Optional[bool]:
+    """
+    Cập nhật một booking bằng một lần batch_update: số hàng lấy từ row index của snapshot,
+    số cột từ header cache. Trả về None nếu không dùng được (chưa có row index, hàng đã lệch).
+    """
+    from booking_store import get_booking_row_number  # Import tại chỗ để tránh import vòng
+    from gspread.utils import rowcol_to_a1
+
+    row_number = get_booking_row_number(sheet_id, worksheet_name, booking_id)
+    if not row_number:
+        return None
+
+    header = get_worksheet_header(worksheet)
+    if 'Số đặt phòng' not in header:
+        return None
+
+    if SHEETS_ROW_GUARD:
+        id_cell = worksheet.acell(rowcol_to_a1(row_number, header.index('Số đặt phòng') + 1)).value
+        if str(id_cell or '').strip() != str(booking_id).strip():
+            print(f"[UPDATE] Row index is stale for '{booking_id}' (row {row_number} has '{id_cell}'), using full scan")
+            return None
+
+    updates = []
+    for key, value in new_data.items():
+        if key in header:
+            updates.append({'range': rowcol_to_a1(row_number, header.index(key) + 1), 'values': [[str(value)]]})
+        else:
+            print(f"[UPDATE] WARNING: Column '{key}' not found in header. Skipping.")
+
+    if not updates:
+        print("[UPDATE] ERROR: No valid data to update.")
+        return False
+
+    response = worksheet.batch_update(updates, value_input_option='USER_ENTERED', include_values_in_response=verify)
+    print(f"[UPDATE] Updated {len(updates)} cells for ID '{booking_id}' at row {row_number} with one batch_update")
+
+    if verify:
+        verification_success = True
+        for update, result in zip(updates, (response or {}).get('responses', [])):
+            values = result.get('updatedData', {}).get('values') or [['']]
+            actual_value = values[0][0] if values[0] else ''
+            if str(actual_value) != update['values'][0][0]:
+                print(f"[UPDATE] WARNING: Verification failed for {update['range']}. "
+                      f"Expected: '{update['values'][0][0]}', Got: '{actual_value}'")
+                verification_success = False
+        if verification_success:
+            print(f"[UPDATE] ✅ All updates verified successfully for booking ID '{booking_id}'")
+        else:
+            print(f"[UPDATE] ⚠️  Some updates may not have been applied correctly")
+
+    return True
+
+def _register_appended_booking_rows(sheet_id: str, worksheet_name: str, bookings: List[Dict[str, Any]], append_response) -> None:
+    """Ghi số hàng của các booking vừa append (lấy từ updatedRange của response) vào row index"""
+    try:
+        updated_range = (append_response or {}).get('updates', {}).get('updatedRange', '')
+        match = re.search(r'![A-Z]+(\d+)', updated_range)
+        if not match:
+            return
+        first_row = int(match.group(1))
+        new_rows = {
+            str(booking['Số đặt phòng']): first_row + i
+            for i, booking in enumerate(bookings) if booking.get('Số đặt phòng')
+        }
+        from booking_store import register_appended_rows  # Import tại chỗ để tránh import vòng
+        register_appended_rows(sheet_id, worksheet_name, new_rows)
+    except Exception as e:
+        print(f"WARNING: Cannot update row index after append: {e}")
+
+def update_row_in_gsheet(sheet_id: str, gcp_creds_file_path: str, worksheet_name: str, booking_id: str, new_data: dict,
+                         verify: Optional[bool] = None) -> bool:
     """
     Tìm một hàng trong Google Sheet dựa trên booking_id và cập nhật nó.
     Enhanced with better logging and error handling to prevent data corruption.
+    Nếu row index của snapshot biết số hàng thì chỉ cần một lần batch_update;
+    nếu không thì tải toàn bộ sheet để tìm hàng như trước.
     """
+    if verify is None:
+        verify = SHEETS_VERIFY_UPDATES
     try:
         print(f"[UPDATE] Starting update Google Sheet for ID: {booking_id}")
         print(f"[UPDATE] Data to update: {new_data}")
@@ -428,6 +534,14 @@ def update_row_in_gsheet(sheet_id: str, gcp_creds_file_path: str, worksheet_name
         sh = gc.open_by_key(sheet_id)
         worksheet = sh.worksheet(worksheet_name)
         
+        try:
+            fast_result = _update_row_by_index(worksheet, sheet_id, worksheet_name, booking_id, new_data, verify)
+        except Exception as e:
+            print(f"[UPDATE] Indexed update failed, using full scan: {e}")
+            fast_result = None
+        if fast_result is not None:
+            return fast_result
+        
         # Lấy toàn bộ dữ liệu để tìm đúng hàng và cột
         print(f"[UPDATE] Reading all data from worksheet...")
         data = worksheet.get_all_values()
@@ -436,6 +550,7 @@ def update_row_in_gsheet(sheet_id: str, gcp_creds_file_path: str, worksheet_name
             return False
             
         header = data[0]
+        remember_worksheet_header(worksheet, header)
         print(f"[UPDATE] Worksheet header: {header}")
         print(f"[UPDATE] Total rows in sheet: {len(data)}")
         
@@ -549,10 +664,8 @@ def delete_row_in_gsheet(sheet_id: str, gcp_creds_file_path: str, worksheet_name
         sh = gc.open_by_key(sheet_id)
         worksheet = sh.worksheet(worksheet_name)
         
-        header = worksheet.row_values(1)
-        try:
-            id_col_index = header.index('Số đặt phòng') + 1
-        except ValueError:
+        id_col_index = get_column_index(worksheet, 'Số đặt phòng')
+        if id_col_index is None:
             print("Error: Cannot find 'Số đặt phòng' column.")
             return False
 
@@ -560,8 +673,16 @@ def delete_row_in_gsheet(sheet_id: str, gcp_creds_file_path: str, worksheet_name
         if not cell:
             print(f"Error: Cannot find row with ID {booking_id} to delete.")
             return False
-            
-        worksheet.delete_rows(cell.row)
+        
+        # Các hàng phía sau sẽ dịch lên: báo cho row index của snapshot
+        from booking_store import begin_sheet_row_deletion, finish_sheet_row_deletion
+        begin_sheet_row_deletion(sheet_id, worksheet_name)
+        try:
+            worksheet.delete_rows(cell.row)
+        except Exception:
+            finish_sheet_row_deletion(sheet_id, worksheet_name, success=False)
+            raise
+        finish_sheet_row_deletion(sheet_id, worksheet_name, [cell.row], [booking_id])
         print(f"Successfully deleted row containing ID {booking_id}.")
         return True
 
@@ -569,13 +690,28 @@ def delete_row_in_gsheet(sheet_id: str, gcp_creds_file_path: str, worksheet_name
         print(f"Critical error when deleting from Google Sheet: {e}")
         return False
 
-def delete_multiple_rows_in_gsheet(sheet_id: str, gcp_creds_file_path: str, worksheet_name: str, booking_ids: List[str]) -> bool:
+def coalesce_row_ranges(row_numbers: List[int]) -> List[Tuple[int, int]]:
     """
-    Xóa nhiều hàng trong Google Sheet dựa trên danh sách các booking_id.
-    Phiên bản này hiệu quả và đáng tin cậy hơn.
+    Gộp các số hàng (từ 1) thành các khoảng liên tiếp [start, end] (bao gồm cả hai đầu),
+    sắp xếp từ dưới lên để xóa lần lượt không làm lệch chỉ số của khoảng sau.
+    """
+    ranges = []
+    for row_number in sorted(set(row_numbers)):
+        if ranges and row_number == ranges[-1][1] + 1:
+            ranges[-1][1] = row_number
+        else:
+            ranges.append([row_number, row_number])
+    return [(start, end) for start, end in reversed(ranges)]
+
+def delete_bookings_in_gsheet(sheet_id: str, gcp_creds_file_path: str, worksheet_name: str, booking_ids: List[str]) -> Dict[str, str]:
+    """
+    Xóa nhiều booking trong Google Sheet bằng MỘT lần spreadsheets.batchUpdate:
+    các hàng liên tiếp được gộp thành một DeleteDimension.
+    Trả về kết quả theo từng ID: 'deleted', 'not_found' hoặc 'error'.
     """
+    results = {str(booking_id): 'not_found' for booking_id in booking_ids}
     if not booking_ids:
-        return True
+        return results
     try:
         print(f"Starting batch deletion on Google Sheet for IDs: {booking_ids}")
         gc = _get_gspread_client(gcp_creds_file_path)
@@ -586,51 +722,75 @@ def delete_multiple_rows_in_gsheet(sheet_id: str, gcp_creds_file_path: str, work
         all_data = worksheet.get_all_values()
         if not all_data:
             print("Sheet is empty, nothing to delete.")
-            return True
+            return results
 
         header = all_data[0]
+        remember_worksheet_header(worksheet, header)
         try:
             # Tìm chỉ số của cột 'Số đặt phòng'
             id_col_index = header.index('Số đặt phòng')
         except ValueError:
             print("Error: Cannot find 'Số đặt phòng' column in header.")
-            return False
-
-        # 2. Tạo một set các ID cần xóa để tra cứu nhanh
-        ids_to_delete_set = set(booking_ids)
-        rows_to_delete_indices = []
+            return {booking_id: 'error' for booking_id in results}
 
-        # 3. Tìm tất cả các chỉ số hàng cần xóa
+        # 2. Tìm tất cả các hàng cần xóa (một ID có thể nằm ở nhiều hàng)
+        rows_to_delete = {}
         # Duyệt từ hàng thứ 2 (bỏ qua header)
         for i, row in enumerate(all_data[1:]):
             # i bắt đầu từ 0, tương ứng với hàng 2 trong sheet
             row_index_in_sheet = i + 2 
-            if len(row) > id_col_index:
-                booking_id_in_row = row[id_col_index]
-                if booking_id_in_row in ids_to_delete_set:
-                    rows_to_delete_indices.append(row_index_in_sheet)
+            if len(row) > id_col_index and row[id_col_index] in results:
+                rows_to_delete[row_index_in_sheet] = row[id_col_index]
 
-        # 4. Xóa các hàng từ dưới lên trên để tránh lỗi sai chỉ số
-        if rows_to_delete_indices:
-            # Sắp xếp các chỉ số theo thứ tự giảm dần
-            sorted_rows_to_delete = sorted(rows_to_delete_indices, reverse=True)
-            print(f"Found {len(sorted_rows_to_delete)} rows to delete. Starting deletion...")
-            
-            for row_index in sorted_rows_to_delete:
-                worksheet.delete_rows(row_index)
-            
-            print(f"Successfully deleted {len(sorted_rows_to_delete)} rows.")
-        else:
+        if not rows_to_delete:
             print("No rows found matching the provided IDs.")
+            return results
+
+        # 3. Gộp các hàng liên tiếp, xóa từ dưới lên trong cùng một request
+        row_ranges = coalesce_row_ranges(list(rows_to_delete))
+        requests = [{
+            'deleteDimension': {
+                'range': {
+                    'sheetId': worksheet.id,
+                    'dimension': 'ROWS',
+                    'startIndex': start - 1,  # API dùng index từ 0, endIndex không bao gồm
+                    'endIndex': end,
+                }
+            }
+        } for start, end in row_ranges]
+        print(f"Found {len(rows_to_delete)} rows to delete in {len(row_ranges)} range(s). Sending one batchUpdate...")
         
-        return True
+        # Các hàng phía sau sẽ dịch lên: báo cho row index của snapshot
+        from booking_store import begin_sheet_row_deletion, finish_sheet_row_deletion
+        begin_sheet_row_deletion(sheet_id, worksheet_name)
+        try:
+            sh.batch_update({'requests': requests})
+        except Exception:
+            finish_sheet_row_deletion(sheet_id, worksheet_name, success=False)
+            raise
+        deleted_ids = sorted(set(rows_to_delete.values()))
+        finish_sheet_row_deletion(sheet_id, worksheet_name, list(rows_to_delete), deleted_ids)
+        
+        for booking_id in deleted_ids:
+            results[booking_id] = 'deleted'
+        print(f"Successfully deleted {len(rows_to_delete)} rows.")
+        return results
 
     except Exception as e:
         # In ra lỗi chi tiết hơn để debug
         import traceback
         print(f"Critical error when batch deleting on Google Sheet: {e}")
         traceback.print_exc()
-        return False
+        # batchUpdate là atomic: lỗi nghĩa là chưa hàng nào bị xóa
+        return {booking_id: 'error' for booking_id in results}
+
+def delete_multiple_rows_in_gsheet(sheet_id: str, gcp_creds_file_path: str, worksheet_name: str, booking_ids: List[str]) -> bool:
+    """
+    Xóa nhiều hàng trong Google Sheet dựa trên danh sách các booking_id.
+    Trả về False nếu có lỗi (ID không tìm thấy không tính là lỗi).
+    """
+    results = delete_bookings_in_gsheet(sheet_id, gcp_creds_file_path, worksheet_name, booking_ids)
+    return 'error' not in results.values()
 
 # ==============================================================================
 # LOGIC CHO MẪU TIN NHẮN (VỚI DEBUG VÀ XỬ LÝ LỖI NÂNG CAP)
@@ -890,9 +1050,12 @@ def create_demo_data() -> tuple[pd.DataFrame, pd.DataFrame]:
     active_bookings_demo = df_demo[df_demo['Tình trạng'] != 'Đã hủy'].copy()
     return df_demo, active_bookings_demo
 
-def prepare_dashboard_data(df: pd.DataFrame, start_date, end_date, sort_by=None, sort_order='asc') -> dict:
+def prepare_dashboard_data(df: pd.DataFrame, start_date, end_date, sort_by=None, sort_order='asc',
+                           rollups: Optional[pd.DataFrame] = None) -> dict:
     """
     Chuẩn bị tất cả dữ liệu cho Dashboard với bộ lọc và sắp xếp động.
+    rollups: bảng rollup đã lưu cùng snapshot (đúng generation của df) để không phải tính lại
+    các bảng toàn thời gian; None thì tính từ df.
     """
     if df.empty:
         return {
@@ -906,70 +1069,21 @@ def prepare_dashboard_data(df: pd.DataFrame, start_date, end_date, sort_by=None,
             'weekly_guests_all_time': pd.DataFrame()
         }
 
-    # Đảm bảo cột ngày tháng đúng định dạng
-    df = df.copy()
-    df['Check-in Date'] = pd.to_datetime(df['Check-in Date'])
-
-    # --- TÍNH TOÁN TRƯỚC KHI LỌC (ALL TIME DATA) ---
-    
-    # 1. Doanh thu hàng tháng trên toàn bộ dữ liệu
-    df_with_period = df.copy()
-    df_with_period['Month_Period'] = df_with_period['Check-in Date'].dt.to_period('M')
-    monthly_revenue = df_with_period.groupby('Month_Period')['Tổng thanh toán'].sum().reset_index()
-    monthly_revenue['Tháng'] = monthly_revenue['Month_Period'].dt.strftime('%Y-%m')
-    monthly_revenue = monthly_revenue[['Tháng', 'Tổng thanh toán']].rename(columns={'Tổng thanh toán': 'Doanh thu'})
-
-    # 2. Doanh thu đã thu hàng tháng
-    collected_df = df[df['Người thu tiền'].notna() & (df['Người thu tiền'] != '') & (df['Người thu tiền'] != 'N/A')].copy()
-    if not collected_df.empty:
-        collected_df['Month_Period'] = collected_df['Check-in Date'].dt.to_period('M')
-        monthly_collected_revenue = collected_df.groupby('Month_Period')['Tổng thanh toán'].sum().reset_index()
-        monthly_collected_revenue['Tháng'] = monthly_collected_revenue['Month_Period'].dt.strftime('%Y-%m')
-        monthly_collected_revenue = monthly_collected_revenue[['Tháng', 'Tổng thanh toán']].rename(columns={'Tổng thanh toán': 'Doanh thu đã thu'})
-    else:
-        monthly_collected_revenue = pd.DataFrame(columns=['Tháng', 'Doanh thu đã thu'])
-
-    # 3. Thống kê Genius
-    genius_stats = df.groupby('Thành viên Genius').agg({
-        'Tổng thanh toán': 'sum',
-        'Số đặt phòng': 'count'
-    }).reset_index()
-    genius_stats.columns = ['Thành viên Genius', 'Tổng doanh thu', 'Số lượng booking']
-
-    # 4. Khách hàng hàng tháng (all time)
-    monthly_guests = df_with_period.groupby('Month_Period').size().reset_index(name='Số khách')
-    monthly_guests['Tháng'] = monthly_guests['Month_Period'].dt.strftime('%Y-%m')
-    monthly_guests = monthly_guests[['Tháng', 'Số khách']]
-
-    # 5. Khách hàng hàng tuần (all time)
-    df_with_week = df.copy()
-    df_with_week['Week_Period'] = df_with_week['Check-in Date'].dt.to_period('W')
-    weekly_guests = df_with_week.groupby('Week_Period').size().reset_index(name='Số khách')
-    weekly_guests['Tuần'] = weekly_guests['Week_Period'].astype(str)
-    weekly_guests = weekly_guests[['Tuần', 'Số khách']]
-
-    # --- LỌC DỮ LIỆU THEO THỜI GIAN NGƯỜI DÙNG CHỌN ---
-    start_ts = pd.Timestamp(start_date)
-    end_ts = pd.Timestamp(end_date)
-    
-    # Lọc theo khoảng thời gian và loại bỏ booking tương lai
-    df_filtered = df[
-        (df['Check-in Date'] >= start_ts) & 
-        (df['Check-in Date'] <= end_ts) &
-        (df['Check-in Date'] <= pd.Timestamp.now())
-    ].copy()
-
-    # --- TÍNH TOÁN CÁC CHỈ SỐ THEO THỜI GIAN ĐÃ CHỌN ---
-    total_revenue_selected = df_filtered['Tổng thanh toán'].sum()
-    total_guests_selected = len(df_filtered)
-    
-    # Doanh thu theo người thu tiền (trong khoảng thời gian đã chọn)
-    collector_revenue_selected = df_filtered.groupby('Người thu tiền')['Tổng thanh toán'].sum().reset_index()
-    collector_revenue_selected = collector_revenue_selected[
-        collector_revenue_selected['Người thu tiền'].notna() & 
-        (collector_revenue_selected['Người thu tiền'] != '') & 
-        (collector_revenue_selected['Người thu tiền'] != 'N/A')
-    ]
+    # Các cột chuẩn hóa được tính một lần cho mỗi generation của cache,
+    # thống kê toàn thời gian đọc từ bảng rollup
+    aggregates = get_dashboard_aggregates(df)
+    all_time = aggregates.all_time_tables(rollups)
+    monthly_revenue = all_time['monthly_revenue']
+    monthly_collected_revenue = all_time['monthly_collected_revenue']
+    genius_stats = all_time['genius_stats']
+    monthly_guests = all_time['monthly_guests']
+    weekly_guests = all_time['weekly_guests']
+
+    # --- LỌC DỮ LIỆU THEO THỜI GIAN NGƯỜI DÙNG CHỌN (bỏ booking tương lai) ---
+    period = aggregates.period_summary(start_date, end_date, datetime.date.today())
+    total_revenue_selected = period['total_revenue']
+    total_guests_selected = period['total_guests']
+    collector_revenue_selected = period['collector_revenue']
 
     # --- SẮP XẾP ĐỘNG ---
     is_ascending = sort_order == 'asc'
@@ -994,205 +1108,53 @@ def prepare_dashboard_data(df: pd.DataFrame, start_date, end_date, sort_by=None,
         'weekly_guests_all_time': weekly_guests,
     }
 
-def check_duplicate_guests(new_bookings: List[Dict[str, Any]]) -> Dict[str, Any]:
+def check_duplicate_guests(new_bookings: List[Dict[str, Any]], df: Optional[pd.DataFrame] = None) -> Dict[str, Any]:
     """
     Kiểm tra khách trùng lặp trong danh sách booking mới với dữ liệu hiện có
+    (df của request, None thì đọc qua cache dùng chung - không chờ Google Sheets khi snapshot cũ)
     Improved logic: name + price + check-in/check-out dates
     """
     try:
-        # Lấy dữ liệu hiện có từ sheet
-        import os
-        GCP_CREDS_FILE_PATH = os.getenv("GCP_CREDS_FILE_PATH")
-        DEFAULT_SHEET_ID = os.getenv("DEFAULT_SHEET_ID")
-        WORKSHEET_NAME = os.getenv("WORKSHEET_NAME")
-        
-        try:
-            df = import_from_gsheet(DEFAULT_SHEET_ID, GCP_CREDS_FILE_PATH, WORKSHEET_NAME)
-        except Exception as e:
-            print(f"Error loading data for duplicate check: {e}")
-            df = pd.DataFrame()
+        if df is None:
+            import os
+            try:
+                from booking_store import read_booking_frame
+                df = read_booking_frame(os.getenv("DEFAULT_SHEET_ID"), os.getenv("GCP_CREDS_FILE_PATH"),
+                                        os.getenv("WORKSHEET_NAME"))
+            except Exception as e:
+                print(f"Error loading data for duplicate check: {e}")
+                df = pd.DataFrame()
             
         if df.empty:
             return {"has_duplicates": False, "duplicates": [], "clean_bookings": new_bookings}
         
-        duplicates = []
-        clean_bookings = []
-        
-        for booking in new_bookings:
-            guest_name = booking.get('guest_name', '').strip().lower()
-            check_in_date = booking.get('check_in_date', '')
-            check_out_date = booking.get('check_out_date', '')
-            total_payment = booking.get('total_payment', 0)
-            
-            if not guest_name:
-                clean_bookings.append(booking)
-                continue
-            
-            # Enhanced duplicate detection: name + price + dates
-            existing_matches = df[
-                df['Tên người đặt'].str.lower().str.contains(guest_name, na=False)
-            ].copy()
-            
-            if not existing_matches.empty:
-                # Check for exact or similar matches
-                try:
-                    new_checkin = pd.to_datetime(check_in_date)
-                    new_checkout = pd.to_datetime(check_out_date)
-                    
-                    for _, existing in existing_matches.iterrows():
-                        existing_checkin = pd.to_datetime(existing['Check-in Date'])
-                        existing_checkout = pd.to_datetime(existing['Check-out Date'])
-                        existing_payment = existing.get('Tổng thanh toán', 0)
-                        
-                        # Check multiple criteria for duplicates
-                        date_match = abs((new_checkin - existing_checkin).days) <= 3 and abs((new_checkout - existing_checkout).days) <= 3
-                        price_match = abs(float(total_payment) - float(existing_payment)) <= 100000  # 100k VND tolerance
-                        exact_dates = new_checkin.date() == existing_checkin.date() and new_checkout.date() == existing_checkout.date()
-                        
-                        # High confidence duplicate if multiple criteria match
-                        confidence_score = 0
-                        if date_match: confidence_score += 30
-                        if price_match: confidence_score += 25
-                        if exact_dates: confidence_score += 45
-                        
-                        if confidence_score >= 50:  # Threshold for duplicate detection
-                            duplicates.append({
-                                "new_booking": booking,
-                                "existing_booking": {
-                                    "booking_id": existing['Số đặt phòng'],
-                                    "guest_name": existing['Tên người đặt'],
-                                    "check_in_date": existing['Check-in Date'].strftime('%Y-%m-%d') if pd.notna(existing['Check-in Date']) else 'N/A',
-                                    "check_out_date": existing['Check-out Date'].strftime('%Y-%m-%d') if pd.notna(existing['Check-out Date']) else 'N/A',
-                                    "total_payment": existing.get('Tổng thanh toán', 0),
-                                    "status": existing.get('Tình trạng', 'N/A')
-                                },
-                                "confidence_score": confidence_score,
-                                "match_reasons": {
-                                    "date_match": date_match,
-                                    "price_match": price_match,
-                                    "exact_dates": exact_dates
-                                }
-                            })
-                            break
-                    else:
-                        clean_bookings.append(booking)
-                except Exception as parse_error:
-                    print(f"Error parsing dates for duplicate check: {parse_error}")
-                    clean_bookings.append(booking)
-            else:
-                clean_bookings.append(booking)
-        
-        return {
-            "has_duplicates": len(duplicates) > 0,
-            "duplicates": duplicates,
-            "clean_bookings": clean_bookings
-        }
+        # Một lần chấm điểm vectorized cho cả lô (ứng viên lấy từ chỉ mục tên khách)
+        return check_new_bookings(df, new_bookings)
         
     except Exception as e:
         print(f"Error checking duplicates: {e}")
         return {"has_duplicates": False, "duplicates": [], "clean_bookings": new_bookings}
 
-def analyze_existing_duplicates() -> Dict[str, Any]:
+def analyze_existing_duplicates(df: Optional[pd.DataFrame] = None) -> Dict[str, Any]:
     """
     Phân tích và tìm các booking trùng lặp trong dữ liệu hiện có
+    (dựng từ các cặp trùng lưu cùng snapshot, xem booking_store.load_duplicate_report).
+    df: dữ liệu request đã tải, None thì đọc qua cache dùng chung như check_duplicate_guests.
     """
     try:
-        # Lấy dữ liệu hiện có từ sheet
         import os
-        GCP_CREDS_FILE_PATH = os.getenv("GCP_CREDS_FILE_PATH")
         DEFAULT_SHEET_ID = os.getenv("DEFAULT_SHEET_ID")
         WORKSHEET_NAME = os.getenv("WORKSHEET_NAME")
         
         try:
-            df = import_from_gsheet(DEFAULT_SHEET_ID, GCP_CREDS_FILE_PATH, WORKSHEET_NAME)
+            from booking_store import read_booking_frame, load_duplicate_report
+            if df is None:
+                df = read_booking_frame(DEFAULT_SHEET_ID, os.getenv("GCP_CREDS_FILE_PATH"), WORKSHEET_NAME)
         except Exception as e:
             print(f"Error loading data for duplicate analysis: {e}")
-            df = pd.DataFrame()
-            
-        if df.empty:
-            return {"duplicate_groups": [], "total_groups": 0, "total_duplicates": 0}
-        
-        # Clean and prepare data
-        df_clean = df[df['Tình trạng'] != 'Đã hủy'].copy()
-        if df_clean.empty:
-            return {"duplicates": [], "total_duplicates": 0}
-        
-        duplicate_groups = []
-        processed_ids = set()
-        
-        for i, booking in df_clean.iterrows():
-            if booking['Số đặt phòng'] in processed_ids:
-                continue
-                
-            guest_name = str(booking['Tên người đặt']).strip().lower()
-            if not guest_name or guest_name == 'nan':
-                continue
-            
-            # Find potential duplicates for this booking
-            similar_bookings = []
-            
-            for j, other_booking in df_clean.iterrows():
-                if i == j or other_booking['Số đặt phòng'] in processed_ids:
-                    continue
-                
-                other_guest_name = str(other_booking['Tên người đặt']).strip().lower()
-                if not other_guest_name or other_guest_name == 'nan':
-                    continue
-                
-                # Check name similarity
-                if guest_name in other_guest_name or other_guest_name in guest_name:
-                    try:
-                        # Check date and price similarity
-                        checkin1 = pd.to_datetime(booking['Check-in Date'])
-                        checkout1 = pd.to_datetime(booking['Check-out Date'])
-                        payment1 = float(booking.get('Tổng thanh toán', 0))
-                        
-                        checkin2 = pd.to_datetime(other_booking['Check-in Date'])
-                        checkout2 = pd.to_datetime(other_booking['Check-out Date'])
-                        payment2 = float(other_booking.get('Tổng thanh toán', 0))
-                        
-                        # Calculate similarity score
-                        date_diff = abs((checkin1 - checkin2).days)
-                        price_diff = abs(payment1 - payment2)
-                        
-                        if date_diff <= 3 and price_diff <= 100000:  # Within 3 days and 100k VND
-                            similar_bookings.append({
-                                "booking_id": other_booking['Số đặt phòng'],
-                                "guest_name": other_booking['Tên người đặt'],
-                                "check_in_date": checkin2.strftime('%Y-%m-%d') if pd.notna(checkin2) else 'N/A',
-                                "check_out_date": checkout2.strftime('%Y-%m-%d') if pd.notna(checkout2) else 'N/A',
-                                "total_payment": payment2,
-                                "status": other_booking.get('Tình trạng', 'N/A'),
-                                "date_diff": date_diff,
-                                "price_diff": price_diff
-                            })
-                            processed_ids.add(other_booking['Số đặt phòng'])
-                    except:
-                        continue
-            
-            if similar_bookings:
-                # Add the original booking to the group
-                main_booking = {
-                    "booking_id": booking['Số đặt phòng'],
-                    "guest_name": booking['Tên người đặt'],
-                    "check_in_date": pd.to_datetime(booking['Check-in Date']).strftime('%Y-%m-%d') if pd.notna(booking['Check-in Date']) else 'N/A',
-                    "check_out_date": pd.to_datetime(booking['Check-out Date']).strftime('%Y-%m-%d') if pd.notna(booking['Check-out Date']) else 'N/A',
-                    "total_payment": float(booking.get('Tổng thanh toán', 0)),
-                    "status": booking.get('Tình trạng', 'N/A')
-                }
-                
-                duplicate_groups.append({
-                    "main_booking": main_booking,
-                    "similar_bookings": similar_bookings,
-                    "group_size": len(similar_bookings) + 1
-                })
-                processed_ids.add(booking['Số đặt phòng'])
+            return get_duplicate_report(pd.DataFrame())
         
-        return {
-            "duplicate_groups": duplicate_groups,
-            "total_groups": len(duplicate_groups),
-            "total_duplicates": sum(group["group_size"] for group in duplicate_groups)
-        }
+        return load_duplicate_report(df, DEFAULT_SHEET_ID, WORKSHEET_NAME)
         
     except Exception as e:
         print(f"Error analyzing existing duplicates: {e}")
@@ -1412,6 +1374,35 @@ Return [] if no booking info found."""
         traceback.print_exc()
         return [{"error": f"Image processing error: {str(main_error)}"}]
 
+# Các định dạng ngày, nhóm theo "hình dạng" chuỗi: chỉ thử strptime với nhóm khớp thay vì
+# lần lượt cả tám định dạng. Ngày/tháng đảo được thì thử theo thứ tự của nhóm (dayfirst trước).
+_DATE_SHAPES = [
+    (re.compile(r'^\d{4}-\d{1,2}-\d{1,2}$'), ['%Y-%m-%d']),                # 2025-01-15
+    (re.compile(r'^\d{1,2}/\d{1,2}/\d{4}$'), ['%d/%m/%Y', '%m/%d/%Y']),    # 15/01/2025, 01/15/2025
+    (re.compile(r'^\d{1,2}-\d{1,2}-\d{4}$'), ['%d-%m-%Y', '%m-%d-%Y']),    # 15-01-2025, 01-15-2025
+    (re.compile(r'^\d{4}/\d{1,2}/\d{1,2}$'), ['%Y/%m/%d']),                # 2025/01/15
+    (re.compile(r'^\d{1,2}\.\d{1,2}\.\d{4}$'), ['%d.%m.%Y']),              # 15.01.2025
+    (re.compile(r'^\d{4}\.\d{1,2}\.\d{1,2}$'), ['%Y.%m.%d']),              # 2025.01.15
+]
+
+@functools.lru_cache(maxsize=4096)
+def _parse_date_string(date_str: str, dayfirst: bool = True) -> Optional[datetime.date]:
+    """
+    Chuỗi ngày (đã strip) -> datetime.date theo _DATE_SHAPES, None nếu không khớp.
+    dayfirst=False đảo thứ tự thử ngày/tháng (giống pd.to_datetime mặc định).
+    Có memo vì cùng một ngày xuất hiện ở rất nhiều dòng.
+    """
+    for shape, formats in _DATE_SHAPES:
+        if not shape.match(date_str):
+            continue
+        for fmt in (formats if dayfirst else formats[::-1]):
+            try:
+                return datetime.datetime.strptime(date_str, fmt).date()
+            except ValueError:
+                continue
+        return None
+    return None
+
 def normalize_date_format(date_str: str) -> str:
     """
     Normalize various date formats to YYYY-MM-DD
@@ -1421,24 +1412,9 @@ def normalize_date_format(date_str: str) -> str:
     
     date_str = date_str.strip()
     
-    # Common date formats to try
-    formats_to_try = [
-        '%Y-%m-%d',      # 2025-01-15
-        '%d/%m/%Y',      # 15/01/2025
-        '%m/%d/%Y',      # 01/15/2025
-        '%d-%m-%Y',      # 15-01-2025
-        '%m-%d-%Y',      # 01-15-2025
-        '%Y/%m/%d',      # 2025/01/15
-        '%d.%m.%Y',      # 15.01.2025
-        '%Y.%m.%d',      # 2025.01.15
-    ]
-    
-    for fmt in formats_to_try:
-        try:
-            parsed_date = datetime.datetime.strptime(date_str, fmt)
-            return parsed_date.strftime('%Y-%m-%d')
-        except ValueError:
-            continue
+    parsed_date = _parse_date_string(date_str, dayfirst=True)
+    if parsed_date is not None:
+        return parsed_date.strftime('%Y-%m-%d')
     
     # If no format matches, return original string
     print(f"⚠️ Could not normalize date format: {date_str}")
@@ -1455,8 +1431,11 @@ def parse_app_standard_date(date_input: Any) -> Optional[datetime.date]:
     if isinstance(date_input, pd.Timestamp):
         return date_input.date()
 
-    date_str = str(date_input).strip().lower()
-    
+    return _parse_app_date_string(str(date_input).strip().lower())
+
+@functools.lru_cache(maxsize=4096)
+def _parse_app_date_string(date_str: str) -> Optional[datetime.date]:
+    """Phần chuỗi của parse_app_standard_date, có memo theo chuỗi"""
     # Thử parse định dạng "ngày DD tháng MM năm YYYY"
     try:
         if "ngày" in date_str and "tháng" in date_str and "năm" in date_str:
@@ -1469,6 +1448,11 @@ def parse_app_standard_date(date_input: Any) -> Optional[datetime.date]:
     except:
         pass
 
+    # Các định dạng số thường gặp: nhận theo hình dạng, tháng trước như pd.to_datetime
+    parsed_date = _parse_date_string(date_str, dayfirst=False)
+    if parsed_date is not None:
+        return parsed_date
+
     # Thử parse các định dạng khác
     try:
         return pd.to_datetime(date_str).date()
@@ -1487,35 +1471,41 @@ def get_daily_activity(date_to_check: datetime.date, df: pd.DataFrame) -> dict:
     if df is None or df.empty:
         return {'check_in': [], 'check_out': [], 'staying_over': []}
 
-    df_local = df.copy()
-
-    # Chuyển đổi cột datetime sang date để so sánh chính xác ngày.
-    df_local['Check-in Date'] = pd.to_datetime(df_local['Check-in Date'], errors='coerce').dt.date
-    df_local['Check-out Date'] = pd.to_datetime(df_local['Check-out Date'], errors='coerce').dt.date
-
-    # Lọc các booking có tình trạng OK
-    active_bookings = df_local[df_local['Tình trạng'] != 'Đã hủy'].copy()
-    if active_bookings.empty:
-        return {'check_in': [], 'check_out': [], 'staying_over': []}
-
-    # 1. Lấy khách CHECK-IN hôm nay
-    check_ins_df = active_bookings[active_bookings['Check-in Date'] == date_to_check]
-
-    # 2. Lấy khách CHECK-OUT hôm nay
-    check_outs_df = active_bookings[active_bookings['Check-out Date'] == date_to_check]
-
-    # 3. Lấy khách ĐANG Ở (không check-in và cũng không check-out hôm nay)
-    staying_over_df = active_bookings[
-        (active_bookings['Check-in Date'] < date_to_check) &
-        (active_bookings['Check-out Date'] > date_to_check)
-    ]
+    # 1. Khách CHECK-IN hôm nay, 2. khách CHECK-OUT hôm nay,
+    # 3. khách ĐANG Ở (không check-in và cũng không check-out hôm nay) - chỉ booking chưa hủy.
+    # Tra trong interval index của generation này thay vì copy df và lọc lại ba lần
+    activity = get_booking_interval_index(df).activity(date_to_check)
     
-    # Trả về toàn bộ thông tin của các booking này dưới dạng dictionary
-    return {
-        'check_in': check_ins_df.to_dict(orient='records'),
-        'check_out': check_outs_df.to_dict(orient='records'),
-        'staying_over': staying_over_df.to_dict(orient='records')
-    }
+    # Trả về toàn bộ thông tin của các booking này dưới dạng dictionary (ngày dạng date như trước)
+    records = _activity_records(df, np.concatenate(list(activity.values())))
+    return {key: [records[pos] for pos in positions.tolist()] for key, positions in activity.items()}
+
+def get_activity_range(first_date: datetime.date, last_date: datetime.date, df: pd.DataFrame) -> dict:
+    """
+    {ngày: get_daily_activity(ngày)} cho mọi ngày từ first_date tới last_date (vd. cả tuần),
+    mỗi booking chỉ chuyển thành dictionary một lần dù xuất hiện ở nhiều ngày.
+    """
+    if df is None or df.empty:
+        return {}
+
+    activities = get_booking_interval_index(df).activity_between(first_date, last_date)
+    positions = [p for activity in activities.values() for p in activity.values()]
+    records = _activity_records(df, np.concatenate(positions) if positions else np.zeros(0, dtype=np.int64))
+    return {day: {key: [records[pos] for pos in rows.tolist()] for key, rows in activity.items()}
+            for day, activity in activities.items()}
+
+def _activity_records(df: pd.DataFrame, positions: np.ndarray) -> dict:
+    """{vị trí dòng: dictionary của dòng} với Check-in/Check-out Date là datetime.date"""
+    positions = np.unique(positions)
+    if not len(positions):
+        return {}
+    dates = get_booking_dates(df)
+    records = df.iloc[positions].to_dict(orient='records')
+    for record, check_in, check_out in zip(records, dates.check_in[positions].astype(object),
+                                           dates.check_out[positions].astype(object)):
+        record['Check-in Date'] = check_in
+        record['Check-out Date'] = check_out
+    return dict(zip(positions.tolist(), records))
 
 def get_overall_calendar_day_info(date_to_check: datetime.date, df: pd.DataFrame, total_capacity: int) -> dict:
     """
@@ -1527,20 +1517,8 @@ def get_overall_calendar_day_info(date_to_check: datetime.date, df: pd.DataFrame
             'status_text': "Trống", 'status_color': 'empty' # Màu cho ngày trống
         }
 
-    df_local = df.copy()
-
-    df_local['Check-in Date'] = pd.to_datetime(df_local['Check-in Date'], errors='coerce').dt.date
-    df_local['Check-out Date'] = pd.to_datetime(df_local['Check-out Date'], errors='coerce').dt.date
-
-    active_on_date = df_local[
-        (df_local['Check-in Date'].notna()) &
-        (df_local['Check-out Date'].notna()) &
-        (df_local['Check-in Date'] <= date_to_check) & 
-        (df_local['Check-out Date'] > date_to_check) &
-        (df_local['Tình trạng'] != 'Đã hủy')
-    ]
-    
-    occupied_units = len(active_on_date)
+    # Tra trong occupancy index (dựng một lần cho mỗi generation của cache) thay vì lọc lại cả DataFrame
+    occupied_units = get_occupancy_index(df).occupied_on(date_to_check)
     available_units = max(0, total_capacity - occupied_units)
     
     # Quyết định văn bản và màu sắc dựa trên tình trạng
@@ -1593,13 +1571,16 @@ def update_booking_by_id(df: pd.DataFrame, booking_id: str, new_data: dict) -> p
         idx = index_to_update[0]
         for key, value in new_data.items():
             if key in df.columns:
-                # Chuyển đổi kiểu dữ liệu trước khi gán
-                if 'Date' in key and value:
-                    df.loc[idx, key] = pd.to_datetime(value)
-                elif 'thanh toán' in key.lower() and value:
-                    df.loc[idx, key] = float(value)
+                # Chuyển đổi kiểu dữ liệu trước khi gán (giống convert_booking_dtypes)
+                if key in ('Check-in Date', 'Check-out Date') and value:
+                    df.loc[idx, key] = pd.to_datetime(value, format='%Y-%m-%d', errors='coerce')
+                elif key in ('Tổng thanh toán', 'Hoa hồng'):
+                    # Cùng bộ đọc tiền với lúc import sheet (_parse_money_column)
+                    amount = parse_amount(value)
+                    df.loc[idx, key] = 0 if amount is None else int(round(amount))
                 else:
-                    df.loc[idx, key] = value
+                    # update_row_in_gsheet ghi str(value) nên giữ dạng chuỗi như khi đọc lại từ sheet
+                    _set_string_value(df, idx, key, '' if value is None else str(value))
         
         print(f"Updated booking with ID: {booking_id}")
     else:
@@ -2140,7 +2121,7 @@ def update_quick_note_in_sheet(note_id: str, note_data: dict) -> bool:
             
             # Check headers first
             print(f"🔍 [DEBUG] STEP 3: Getting headers")
-            headers = worksheet.row_values(1)
+            headers = get_worksheet_header(worksheet)
             print(f"🔍 [DEBUG] STEP 4: Sheet headers: {headers}")
             
             # FIXED: Debug the IDs to see what we're working with
@@ -2263,7 +2244,7 @@ def create_note_directly(note_data: dict, note_id: str) -> bool:
             print("✅ Created new QuickNotes worksheet with headers")
         
         # Get headers
-        headers = worksheet.row_values(1)
+        headers = get_worksheet_header(worksheet)
         print(f"🔍 [DEBUG] Sheet headers: {headers}")
         
         # Prepare row data
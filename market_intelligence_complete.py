@@ -16,6 +16,8 @@ from typing import Dict, List, Optional, Any
 from datetime import datetime
 import re
 
+from money import parse_amount
+
 class HotelMarketIntelligence:
     """
     Complete hotel market intelligence system
@@ -641,11 +643,9 @@ class MarketAnalyzer:
             props = locations[area]["properties"]
             prices = []
             for prop in props:
-                price_str = prop["price"].replace(",", "").replace("VND", "").strip()
-                try:
-                    prices.append(int(price_str))
-                except:
-                    continue
+                price = parse_amount(prop["price"])
+                if price is not None:
+                    prices.append(int(price))
             
             locations[area]["avg_price"] = sum(prices) // len(prices) if prices else 0
         
@@ -11,6 +11,8 @@ from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 import pandas as pd
 
+from money import format_vnd, to_vnd
+
 try:
     from crawl4ai import AsyncWebCrawler
     CRAWL4AI_AVAILABLE = True
@@ -273,7 +275,7 @@ class MarketPriceAnalyzer:
                     cleaned_prop = {
                         'name': prop.get('name', 'Unknown')[:100],  # Giới hạn độ dài
                         'price_vnd': price_vnd,
-                        'price_display': f"{price_vnd:,.0f}₫",
+                        'price_display': format_vnd(price_vnd, '₫'),
                         'rating': self._clean_rating(prop.get('rating', '')),
                         'location': prop.get('location', '')[:100],
                         'room_type': prop.get('room_type', 'Standard')
@@ -290,47 +292,8 @@ class MarketPriceAnalyzer:
     def _extract_price_vnd(self, price_text: str) -> float:
         """Trích xuất và chuyển đổi giá về VND"""
         try:
-            # Loại bỏ các ký tự không cần thiết
-            price_clean = re.sub(r'[^\d.,]', '', price_text)
-            
-            # Tìm số
-            numbers = re.findall(r'[\d.,]+', price_clean)
-            if not numbers:
-                return 0
-            
-            # Lấy số lớn nhất (thường là giá chính)
-            max_number = max(numbers, key=len)
-            
-            # Xử lý dấu phẩy và chấm
-            if ',' in max_number and '.' in max_number:
-                # Format: 1,234.56 hoặc 1.234,56
-                if max_number.rfind(',') > max_number.rfind('.'):
-                    # Format: 1.234,56 (European)
-                    max_number = max_number.replace('.', '').replace(',', '.')
-                else:
-                    # Format: 1,234.56 (US)
-                    max_number = max_number.replace(',', '')
-            elif ',' in max_number:
-                # Chỉ có dấu phẩy - có thể là separator hoặc decimal
-                if len(max_number.split(',')[-1]) <= 2:
-                    # Có thể là decimal
-                    max_number = max_number.replace(',', '.')
-                else:
-                    # Là separator
-                    max_number = max_number.replace(',', '')
-            
-            price_float = float(max_number)
-            
-            # Detect currency và convert về VND
-            if 'USD' in price_text.upper() or '$' in price_text:
-                price_float *= 24000  # USD to VND approximation
-            elif 'EUR' in price_text.upper() or '€' in price_text:
-                price_float *= 26000  # EUR to VND approximation
-            elif price_float < 1000:  # Có thể là USD
-                price_float *= 24000
-            
-            return price_float
-            
+            # Lấy cụm số dài nhất (thường là giá chính); giá không ghi tiền tệ mà < 1000 coi là USD
+            return to_vnd(price_text, pick='longest', small_amount_currency='USD')
         except Exception as e:
             print(f"⚠️ Lỗi parse giá '{price_text}': {e}")
             return 0
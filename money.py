@@ -0,0 +1,150 @@
+"""
+Đọc và định dạng tiền dùng chung cho toàn app (sheet booking, phí taxi, giá thị trường).
+
+Một số tiền là cụm chữ số đầu tiên trong chuỗi, có thể có dấu ngăn cách nghìn kiểu VND/US
+("1,200,000", "1.200.000", "30 000") hoặc phần thập phân kiểu US/EU ("45.50", "1.234,56"):
+- có cả ',' và '.': dấu đứng sau cùng là dấu thập phân;
+- chỉ một loại dấu, xuất hiện một lần và theo sau không phải đúng 3 chữ số: dấu thập phân
+  ("12.5", "1200000.0", "12,50");
+- còn lại là dấu ngăn cách nghìn.
+Tiền tệ nhận theo ký hiệu/mã trong chuỗi ($/USD, €/EUR, đ/₫/VND).
+
+Có hai API cho cùng một quy tắc: parse_money_series / to_vnd_series cho cả cột (factorize,
+mỗi giá trị khác nhau chỉ đọc một lần rồi trải lại theo mã - cột tiền trong sheet lặp lại rất
+nhiều; cột đã là số giữ nguyên) và parse_amount / to_vnd cho từng giá trị, có memo theo chuỗi.
+"""
+import re
+from functools import lru_cache
+from typing import Any, Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+# Tỷ giá xấp xỉ để quy giá thị trường về VND
+EXCHANGE_RATES_TO_VND = {'VND': 1, 'USD': 24000, 'EUR': 26000}
+
+# Giá không ghi tiền tệ mà nhỏ hơn ngưỡng này thì gần như chắc chắn không phải VND
+SMALL_AMOUNT_THRESHOLD = 1000
+
+# Cụm chữ số với dấu ngăn cách; khoảng trắng chỉ được coi là ngăn cách nghìn khi theo sau
+# là đúng 3 chữ số ("30 000đ"), để "2 khách 300,000" không bị gộp thành một số
+_NUMBER_PATTERN = r'\d+(?:(?:[.,]|[ \u00a0](?=\d{3}(?!\d)))\d+)*'
+_NUMBER_RE = re.compile(_NUMBER_PATTERN)
+_SPACE_RE = re.compile(r'[ \u00a0]')
+_SEPARATOR_RE = re.compile(r'[.,]')
+
+_CURRENCY_PATTERNS = [
+    ('USD', re.compile(r'\$|usd', re.IGNORECASE)),
+    ('EUR', re.compile(r'€|eur', re.IGNORECASE)),
+    ('VND', re.compile(r'đ|₫|vnd', re.IGNORECASE)),
+]
+
+_MEMO_SIZE = 8192
+
+
+def _number_value(token: str) -> float:
+    """Một cụm chữ số (khớp _NUMBER_PATTERN) -> số theo quy tắc dấu ngăn cách ở đầu module"""
+    token = _SPACE_RE.sub('', token)
+    has_comma, has_dot = ',' in token, '.' in token
+    decimal = None
+    if has_comma and has_dot:
+        decimal = token[max(token.rfind(','), token.rfind('.'))]
+    elif has_comma or has_dot:
+        sep = ',' if has_comma else '.'
+        if token.count(sep) == 1 and len(token) - token.rfind(sep) - 1 != 3:
+            decimal = sep
+
+    if decimal:
+        head, _, tail = token.rpartition(decimal)
+        return float(_SEPARATOR_RE.sub('', head) + '.' + tail)
+    return float(_SEPARATOR_RE.sub('', token))
+
+
+def _parse_number_text(text: str, pick: str = 'first') -> Optional[float]:
+    tokens = _NUMBER_RE.findall(text)
+    if not tokens:
+        return None
+    # 'longest': cụm dài nhất (giá chính trong chuỗi giá cào về), ngược lại lấy cụm đầu tiên
+    token = max(tokens, key=len) if pick == 'longest' else tokens[0]
+    return _number_value(token)
+
+
+def _currency_of(text: str) -> Optional[str]:
+    for currency, pattern in _CURRENCY_PATTERNS:
+        if pattern.search(text):
+            return currency
+    return None
+
+
+# Bản có memo cho API từng giá trị; API theo cột tự đọc mỗi giá trị khác nhau đúng một lần
+# nên dùng bản không memo để khỏi đẩy các giá trị hay gặp ra khỏi cache
+_parse_text = lru_cache(maxsize=_MEMO_SIZE)(_parse_number_text)
+detect_currency = lru_cache(maxsize=_MEMO_SIZE)(_currency_of)
+detect_currency.__doc__ = "'USD' / 'EUR' / 'VND' theo ký hiệu hoặc mã trong chuỗi, None nếu không ghi"
+
+
+def _amount(value, pick: str, parse_text) -> Optional[float]:
+    if value is None:
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return None if pd.isna(value) else float(value)
+    return parse_text(str(value), pick)
+
+
+def _vnd(value, pick: str, small_amount_currency: Optional[str], parse_text, currency_of) -> float:
+    amount = _amount(value, pick, parse_text)
+    if amount is None:
+        return 0.0
+    currency = currency_of(value) if isinstance(value, str) else None
+    if currency is None:
+        currency = small_amount_currency if small_amount_currency and amount < SMALL_AMOUNT_THRESHOLD else 'VND'
+    return amount * EXCHANGE_RATES_TO_VND[currency]
+
+
+def parse_amount(value, pick: str = 'first') -> Optional[float]:
+    """Giá trị tiền (chuỗi hoặc số) -> float, None nếu không có số nào"""
+    return _amount(value, pick, _parse_text)
+
+
+def to_vnd(value, pick: str = 'first', small_amount_currency: Optional[str] = None) -> float:
+    """
+    Giá trị tiền -> VND (0 nếu không đọc được). Chuỗi không ghi tiền tệ được coi là VND;
+    nếu có small_amount_currency thì số nhỏ hơn SMALL_AMOUNT_THRESHOLD được coi là tiền đó.
+    """
+    return _vnd(value, pick, small_amount_currency, _parse_text, detect_currency)
+
+
+def format_vnd(amount, symbol: str = 'đ') -> str:
+    """1200000 -> '1,200,000đ'"""
+    return f"{amount:,.0f}{symbol}"
+
+
+def _map_distinct(series: pd.Series, parse: Callable[[Any], Optional[float]]) -> pd.Series:
+    """parse cho từng giá trị khác nhau của cột (factorize), rồi trải lại theo mã - ô trống là NaN"""
+    codes, uniques = pd.factorize(series)
+    parsed = np.array([parse(value) for value in uniques], dtype='float64')
+    return pd.Series(np.append(parsed, np.nan)[codes], index=series.index)
+
+
+def _is_number_dtype(series: pd.Series) -> bool:
+    return pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype)
+
+
+def parse_money_series(series: pd.Series, default: Optional[float] = 0.0) -> pd.Series:
+    """
+    Cột tiền -> float64 theo cùng quy tắc với parse_amount (cụm số đầu tiên). Cột đã là số
+    được giữ nguyên; ô không có số lấy default (None thì để NaN).
+    """
+    if _is_number_dtype(series):
+        values = series.astype('float64')
+    else:
+        values = _map_distinct(series, lambda value: _amount(value, 'first', _parse_number_text))
+    return values if default is None else values.fillna(default)
+
+
+def to_vnd_series(series: pd.Series, small_amount_currency: Optional[str] = None) -> pd.Series:
+    """Cột tiền -> VND (float64, 0 nếu không đọc được), quy đổi theo tiền tệ ghi trong từng ô"""
+    if _is_number_dtype(series):
+        return series.astype('float64').fillna(0)
+    return _map_distinct(series, lambda value: _vnd(value, 'first', small_amount_currency,
+                                                    _parse_number_text, _currency_of)).fillna(0)
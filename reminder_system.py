@@ -8,7 +8,9 @@ from datetime import datetime, timedelta
 from typing import List, Dict
 import pandas as pd
 from email_service import send_checkin_reminder, send_checkout_reminder, send_payment_reminder
-from logic import import_from_gsheet
+from booking_store import read_booking_frame
+from booking_receivables import overdue_bookings
+from booking_indexes import get_booking_dates, get_booking_day_index
 import os
 from dotenv import load_dotenv
 
@@ -120,26 +122,16 @@ class HotelReminderSystem:
             print(f"[ERROR] Error in check_and_send_reminders: {e}")
     
     def _load_booking_data(self) -> pd.DataFrame:
-        """Load booking data từ Google Sheets"""
+        """Load booking data qua cache dùng chung (snapshot cũ được làm mới ở nền, không chờ Sheets)"""
         try:
-            df = import_from_gsheet(
+            df = read_booking_frame(
                 self.default_sheet_id, 
                 self.gcp_creds_file_path, 
                 self.worksheet_name
             )
             
-            if df.empty:
-                return df
-                
-            # Convert date columns
-            date_columns = ['Check-in Date', 'Check-out Date']
-            for col in date_columns:
-                if col in df.columns:
-                    df[col] = pd.to_datetime(df[col], errors='coerce')
-            
-            # Filter active bookings only
-            df = df[df['Tình trạng'] != 'Đã hủy'].copy()
-            
+            # Snapshot dùng chung với app (cùng DataFrame cho mỗi generation, kèm cột ngày chuẩn
+            # và bảng công nợ tính sẵn) - không sửa tại chỗ; booking đã hủy được lọc ở từng bước
             return df
             
         except Exception as e:
@@ -153,8 +145,8 @@ class HotelReminderSystem:
                 return pd.DataFrame()
                 
             # Filter check-in today
-            checkin_mask = df['Check-in Date'].dt.date == today
-            checkin_today = df[checkin_mask].copy()
+            # Tra theo ngày trong chỉ mục check-in dùng chung với dashboard
+            checkin_today = df.iloc[get_booking_day_index(df).check_ins(today, active_only=True)].copy()
             
             print(f"[INFO] Found {len(checkin_today)} check-ins today")
             return checkin_today
@@ -170,8 +162,7 @@ class HotelReminderSystem:
                 return pd.DataFrame()
                 
             # Filter check-out today
-            checkout_mask = df['Check-out Date'].dt.date == today
-            checkout_today = df[checkout_mask].copy()
+            checkout_today = df.iloc[get_booking_day_index(df).check_outs(today, active_only=True)].copy()
             
             print(f"[INFO] Found {len(checkout_today)} check-outs today")
             return checkout_today
@@ -186,20 +177,9 @@ class HotelReminderSystem:
             if 'Check-in Date' not in df.columns or 'Người thu tiền' not in df.columns:
                 return pd.DataFrame()
             
-            # Filter criteria:
-            # 1. Đã check-in (Check-in Date <= today)
-            # 2. Chưa thu tiền (Người thu tiền không phải LOC LE/THAO LE)
-            # 3. Không bị hủy
-            
-            checked_in_mask = df['Check-in Date'].dt.date <= today
-            collected_values = ['LOC LE', 'THAO LE']
-            collector_series = df['Người thu tiền'].fillna('').astype(str)
-            not_collected_mask = ~collector_series.isin(collected_values)
-            not_cancelled_mask = df['Tình trạng'] != 'Đã hủy'
-            
-            # Combine all conditions
-            overdue_mask = checked_in_mask & not_collected_mask & not_cancelled_mask
-            payment_overdue = df[overdue_mask].copy()
+            # Đã check-in (<= today), chưa thu tiền (không phải LOC LE/THAO LE), không bị hủy -
+            # cùng bảng công nợ với panel quá hạn trên dashboard
+            payment_overdue = overdue_bookings(df, today)
             
             print(f"[INFO] Found {len(payment_overdue)} payment overdue")
             return payment_overdue
@@ -224,7 +204,7 @@ class HotelReminderSystem:
             today = datetime.now().date()
             results = {
                 "check_time": start_time.strftime('%d/%m/%Y %H:%M:%S'),
-                "total_bookings": len(df),
+                "total_bookings": int(get_booking_dates(df).active.sum()),
                 "checkin_today": 0,
                 "checkout_today": 0, 
                 "payment_overdue": 0,
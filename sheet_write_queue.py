@@ -0,0 +1,457 @@
+"""
+Sheet Write Queue - Durable write-behind queue cho Google Sheets
+Các route cập nhật một hàng (thu tiền, sửa số tiền, hoàn thành ghi chú) ghi thay đổi vào
+journal SQLite rồi trả lời ngay; một thread nền gom các thay đổi theo từng hàng và gửi
+lên Sheets bằng một lần values.batchUpdate, tự thử lại với backoff khi gặp 429/5xx.
+Booking cache được cập nhật lạc quan ngay lúc đưa vào hàng đợi.
+"""
+
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+BASE_DIR = Path(__file__).resolve().parent
+WRITE_QUEUE_DB_PATH = os.getenv("SHEETS_WRITE_QUEUE_DB", str(BASE_DIR / "sheet_write_queue.db"))
+WRITE_BEHIND_ENABLED = os.getenv("SHEETS_WRITE_BEHIND", "true").lower() == "true"
+DRAIN_INTERVAL_SECONDS = float(os.getenv("SHEETS_WRITE_QUEUE_INTERVAL", "1"))
+MAX_ATTEMPTS = int(os.getenv("SHEETS_WRITE_QUEUE_MAX_ATTEMPTS", "8"))
+
+BATCH_LIMIT = 200
+LEASE_SECONDS = 60
+RETRY_BASE_SECONDS = 2
+RETRY_MAX_SECONDS = 300
+FAILED_RETENTION_SECONDS = 7 * 24 * 3600
+
+
+class SheetWriteQueue:
+    """
+    Journal các thay đổi chờ ghi lên Google Sheets:
+    - Mỗi hàng là một lần cập nhật {cột: giá trị} cho hàng có key_column = key_value
+    - Thay đổi mới cho cùng một hàng (chưa gửi) được gộp vào thay đổi cũ
+    - `queue_lease` đảm bảo chỉ một gunicorn worker gửi tại một thời điểm
+    """
+
+    def __init__(self, db_path: str = WRITE_QUEUE_DB_PATH):
+        self.db_path = db_path
+        self._initialize_database()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def _initialize_database(self):
+        """Tạo bảng journal nếu chưa có"""
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS sheet_writes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sheet_id TEXT NOT NULL,
+                    worksheet_name TEXT,
+                    key_column TEXT NOT NULL,
+                    key_value TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    last_error TEXT
+                )
+            ''')
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_sheet_writes_due
+                ON sheet_writes (status, next_attempt_at)
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS queue_lease (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def enqueue_update(self, sheet_id: str, worksheet_name: Optional[str], key_column: str,
+                       key_value: str, data: Dict[str, Any]) -> int:
+        """Đưa một cập nhật vào hàng đợi, gộp với cập nhật đang chờ của cùng hàng. Trả về id"""
+        now = time.time()
+        data = {column: '' if value is None else str(value) for column, value in data.items()}
+
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('''
+                SELECT id, data FROM sheet_writes
+                WHERE status = 'pending' AND sheet_id = ? AND IFNULL(worksheet_name, '') = ?
+                  AND key_column = ? AND key_value = ?
+                ORDER BY id DESC LIMIT 1
+            ''', (sheet_id, worksheet_name or '', key_column, str(key_value))).fetchone()
+
+            if row:
+                write_id, existing = row
+                merged = json.loads(existing)
+                merged.update(data)
+                conn.execute('''
+                    UPDATE sheet_writes SET data = ?, updated_at = ?, next_attempt_at = MIN(next_attempt_at, ?)
+                    WHERE id = ?
+                ''', (json.dumps(merged, ensure_ascii=False), now, now, write_id))
+            else:
+                cursor = conn.execute('''
+                    INSERT INTO sheet_writes
+                        (sheet_id, worksheet_name, key_column, key_value, data, next_attempt_at, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (sheet_id, worksheet_name, key_column, str(key_value),
+                      json.dumps(data, ensure_ascii=False), now, now, now))
+                write_id = cursor.lastrowid
+            conn.commit()
+        finally:
+            conn.close()
+
+        return write_id
+
+    def get_pending_updates(self, sheet_id: str, worksheet_name: Optional[str], key_column: str) -> List[Dict[str, Any]]:
+        """Các cập nhật chưa ghi xong của một worksheet (theo thứ tự), để áp lại sau khi tải toàn bộ"""
+        conn = self._connect()
+        try:
+            rows = conn.execute('''
+                SELECT key_value, data FROM sheet_writes
+                WHERE status IN ('pending', 'in_flight') AND sheet_id = ?
+                  AND IFNULL(worksheet_name, '') = ? AND key_column = ?
+                ORDER BY id
+            ''', (sheet_id, worksheet_name or '', key_column)).fetchall()
+        finally:
+            conn.close()
+        return [{'key_value': key_value, 'data': json.loads(data)} for key_value, data in rows]
+
+    def acquire_lease(self, owner: str, name: str = 'drain') -> bool:
+        """Giành quyền gửi hàng đợi (hết hạn sau LEASE_SECONDS nếu worker chết)"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT owner, expires_at FROM queue_lease WHERE name = ?', (name,)).fetchone()
+            if row and row[0] != owner and row[1] > now:
+                conn.rollback()
+                return False
+            conn.execute('INSERT OR REPLACE INTO queue_lease (name, owner, expires_at) VALUES (?, ?, ?)',
+                         (name, owner, now + LEASE_SECONDS))
+            conn.commit()
+            return True
+        finally:
+            conn.close()
+
+    def release_lease(self, owner: str, name: str = 'drain'):
+        conn = self._connect()
+        try:
+            conn.execute('DELETE FROM queue_lease WHERE name = ? AND owner = ?', (name, owner))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def claim_due(self, limit: int = BATCH_LIMIT) -> List[Dict[str, Any]]:
+        """Lấy các cập nhật đến hạn và đánh dấu in_flight"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            # Cập nhật bị kẹt in_flight (worker chết giữa chừng) được đưa lại hàng đợi
+            conn.execute('''
+                UPDATE sheet_writes SET status = 'pending'
+                WHERE status = 'in_flight' AND updated_at < ?
+            ''', (now - LEASE_SECONDS,))
+            conn.execute(
+                "DELETE FROM sheet_writes WHERE status = 'failed' AND updated_at < ?",
+                (now - FAILED_RETENTION_SECONDS,)
+            )
+            rows = conn.execute('''
+                SELECT id, sheet_id, worksheet_name, key_column, key_value, data, attempts
+                FROM sheet_writes
+                WHERE status = 'pending' AND next_attempt_at <= ?
+                ORDER BY id LIMIT ?
+            ''', (now, limit)).fetchall()
+            if rows:
+                conn.executemany(
+                    "UPDATE sheet_writes SET status = 'in_flight', updated_at = ? WHERE id = ?",
+                    [(now, row[0]) for row in rows]
+                )
+            conn.commit()
+        finally:
+            conn.close()
+
+        return [{
+            'id': row[0],
+            'sheet_id': row[1],
+            'worksheet_name': row[2],
+            'key_column': row[3],
+            'key_value': row[4],
+            'data': json.loads(row[5]),
+            'attempts': row[6],
+        } for row in rows]
+
+    def mark_done(self, write_ids: List[int]):
+        if not write_ids:
+            return
+        conn = self._connect()
+        try:
+            conn.executemany('DELETE FROM sheet_writes WHERE id = ?', [(write_id,) for write_id in write_ids])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def mark_retry(self, write_ids: List[int], error: str) -> List[int]:
+        """Hẹn gửi lại với exponential backoff; trả về các id đã vượt MAX_ATTEMPTS (chuyển sang failed)"""
+        if not write_ids:
+            return []
+        now = time.time()
+        given_up = []
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for write_id in write_ids:
+                row = conn.execute('SELECT attempts FROM sheet_writes WHERE id = ?', (write_id,)).fetchone()
+                if not row:
+                    continue
+                attempts = row[0] + 1
+                if attempts >= MAX_ATTEMPTS:
+                    status, next_attempt_at = 'failed', now
+                    given_up.append(write_id)
+                else:
+                    delay = min(RETRY_BASE_SECONDS * (2 ** (attempts - 1)), RETRY_MAX_SECONDS)
+                    status, next_attempt_at = 'pending', now + delay * random.uniform(0.8, 1.2)
+                conn.execute('''
+                    UPDATE sheet_writes
+                    SET status = ?, attempts = ?, next_attempt_at = ?, updated_at = ?, last_error = ?
+                    WHERE id = ?
+                ''', (status, attempts, next_attempt_at, now, error[:500], write_id))
+            conn.commit()
+        finally:
+            conn.close()
+        return given_up
+
+    def mark_failed(self, write_ids: List[int], error: str):
+        """Lỗi không thể thử lại (ví dụ không tìm thấy hàng): giữ lại để xem, không gửi nữa"""
+        if not write_ids:
+            return
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.executemany('''
+                UPDATE sheet_writes SET status = 'failed', updated_at = ?, last_error = ? WHERE id = ?
+            ''', [(now, error[:500], write_id) for write_id in write_ids])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Số cập nhật theo trạng thái, tuổi của cập nhật chờ lâu nhất và lỗi gần nhất"""
+        conn = self._connect()
+        try:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM sheet_writes GROUP BY status').fetchall())
+            oldest = conn.execute(
+                "SELECT MIN(created_at) FROM sheet_writes WHERE status IN ('pending', 'in_flight')"
+            ).fetchone()[0]
+            last_error = conn.execute(
+                'SELECT last_error FROM sheet_writes WHERE last_error IS NOT NULL ORDER BY updated_at DESC LIMIT 1'
+            ).fetchone()
+        finally:
+            conn.close()
+
+        return {
+            'enabled': WRITE_BEHIND_ENABLED,
+            'pending': counts.get('pending', 0),
+            'in_flight': counts.get('in_flight', 0),
+            'failed': counts.get('failed', 0),
+            'oldest_pending_seconds': round(time.time() - oldest, 1) if oldest else None,
+            'last_error': last_error[0] if last_error else None,
+        }
+
+
+def _is_retryable(error: Exception) -> bool:
+    """429 và 5xx thì thử lại; các lỗi 4xx khác (sai range, không có quyền...) thì không"""
+    response = getattr(error, 'response', None)
+    status_code = getattr(response, 'status_code', None)
+    if status_code is None:
+        # Lỗi mạng / timeout: thử lại (số lần vẫn bị giới hạn bởi MAX_ATTEMPTS)
+        return True
+    return status_code == 429 or status_code >= 500
+
+
+def _quote_sheet_title(title: str) -> str:
+    return "'" + title.replace("'", "''") + "'"
+
+
+def drain_once(queue: SheetWriteQueue, gcp_creds_file_path: str) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Gửi một lô cập nhật đến hạn: mỗi worksheet đọc cột khóa một lần để tìm số hàng,
+    mỗi spreadsheet gửi một values.batchUpdate. Trả về các cập nhật đã ghi / bị bỏ.
+    """
+    items = queue.claim_due(BATCH_LIMIT)
+    result = {'written': [], 'failed': []}
+    if not items:
+        return result
+
+    # Import tại chỗ để tránh import vòng (logic -> booking_store -> ...)
+    from logic import _get_gspread_client, get_worksheet_header
+    from gspread.utils import rowcol_to_a1
+
+    items_by_sheet = {}
+    for item in items:
+        items_by_sheet.setdefault(item['sheet_id'], []).append(item)
+
+    for sheet_id, sheet_items in items_by_sheet.items():
+        pending = list(sheet_items)
+        try:
+            spreadsheet = _get_gspread_client(gcp_creds_file_path).open_by_key(sheet_id)
+            value_ranges = []
+            ready = []
+
+            items_by_worksheet = {}
+            for item in sheet_items:
+                items_by_worksheet.setdefault((item['worksheet_name'], item['key_column']), []).append(item)
+
+            for (worksheet_name, key_column), worksheet_items in items_by_worksheet.items():
+                worksheet = spreadsheet.worksheet(worksheet_name) if worksheet_name else spreadsheet.sheet1
+                header = get_worksheet_header(worksheet)
+                if key_column not in header:
+                    queue.mark_failed([item['id'] for item in worksheet_items], f"Column '{key_column}' not found")
+                    result['failed'].extend(worksheet_items)
+                    pending = [item for item in pending if item not in worksheet_items]
+                    continue
+
+                row_by_key = {}
+                for row_number, value in enumerate(worksheet.col_values(header.index(key_column) + 1)[1:], start=2):
+                    row_by_key.setdefault(str(value).strip(), row_number)
+
+                for item in worksheet_items:
+                    row_number = row_by_key.get(str(item['key_value']).strip())
+                    if row_number is None:
+                        queue.mark_failed([item['id']], f"Row with {key_column}='{item['key_value']}' not found")
+                        result['failed'].append(item)
+                        pending.remove(item)
+                        continue
+                    for column, value in item['data'].items():
+                        if column not in header:
+                            print(f"[WRITE_QUEUE] WARNING: Column '{column}' not found in '{worksheet.title}'. Skipping.")
+                            continue
+                        value_ranges.append({
+                            'range': f"{_quote_sheet_title(worksheet.title)}!{rowcol_to_a1(row_number, header.index(column) + 1)}",
+                            'values': [[value]],
+                        })
+                    ready.append(item)
+
+            if value_ranges:
+                spreadsheet.values_batch_update({'valueInputOption': 'USER_ENTERED', 'data': value_ranges})
+            queue.mark_done([item['id'] for item in ready])
+            result['written'].extend(ready)
+            print(f"[WRITE_QUEUE] Wrote {len(ready)} queued update(s) ({len(value_ranges)} cells) with one batchUpdate")
+
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if _is_retryable(e):
+                given_up = set(queue.mark_retry([item['id'] for item in pending], error))
+                result['failed'].extend(item for item in pending if item['id'] in given_up)
+                print(f"[WRITE_QUEUE] Write failed, will retry {len(pending) - len(given_up)} update(s): {error}")
+            else:
+                queue.mark_failed([item['id'] for item in pending], error)
+                result['failed'].extend(pending)
+                print(f"[WRITE_QUEUE] Write failed permanently for {len(pending)} update(s): {error}")
+
+    return result
+
+
+# Global instance
+_write_queue = None
+_worker_thread = None
+_worker_lock = threading.Lock()
+_wake_event = threading.Event()
+_failure_handlers: List[Callable[[List[Dict[str, Any]]], None]] = []
+
+
+def get_write_queue() -> Optional[SheetWriteQueue]:
+    """Get global write queue (None nếu không mở được file SQLite)"""
+    global _write_queue
+    if _write_queue is None:
+        try:
+            _write_queue = SheetWriteQueue()
+        except Exception as e:
+            print(f"[WRITE_QUEUE] Cannot open write queue at {WRITE_QUEUE_DB_PATH}: {e}")
+            return None
+    return _write_queue
+
+
+def _worker_loop(gcp_creds_file_path: str):
+    owner = f"{os.getpid()}-{threading.get_ident()}"
+    while True:
+        _wake_event.wait(DRAIN_INTERVAL_SECONDS)
+        _wake_event.clear()
+        queue = get_write_queue()
+        if queue is None:
+            continue
+        try:
+            if not queue.acquire_lease(owner):
+                continue
+            try:
+                while True:
+                    result = drain_once(queue, gcp_creds_file_path)
+                    if result['failed']:
+                        for handler in _failure_handlers:
+                            handler(result['failed'])
+                    if not result['written']:
+                        break
+            finally:
+                queue.release_lease(owner)
+        except Exception as e:
+            print(f"[WRITE_QUEUE] Worker error: {e}")
+
+
+def start_write_queue_worker(gcp_creds_file_path: str,
+                             on_failure: Optional[Callable[[List[Dict[str, Any]]], None]] = None):
+    """
+    Khởi động thread gửi hàng đợi (một thread mỗi process, gọi nhiều lần không sao).
+    on_failure nhận danh sách cập nhật bị bỏ để caller hoàn tác cache lạc quan.
+    """
+    global _worker_thread
+    with _worker_lock:
+        if on_failure is not None and on_failure not in _failure_handlers:
+            _failure_handlers.append(on_failure)
+        if _worker_thread is None or not _worker_thread.is_alive():
+            _worker_thread = threading.Thread(
+                target=_worker_loop, args=(gcp_creds_file_path,), name='sheet-write-queue', daemon=True
+            )
+            _worker_thread.start()
+
+
+def enqueue_sheet_update(sheet_id: str, worksheet_name: Optional[str], key_column: str,
+                         key_value: str, data: Dict[str, Any]) -> bool:
+    """Đưa cập nhật vào hàng đợi và đánh thức worker. False nếu hàng đợi không dùng được"""
+    queue = get_write_queue()
+    if queue is None:
+        return False
+    try:
+        write_id = queue.enqueue_update(sheet_id, worksheet_name, key_column, key_value, data)
+    except Exception as e:
+        print(f"[WRITE_QUEUE] Error enqueuing update for {key_column}='{key_value}': {e}")
+        return False
+    print(f"[WRITE_QUEUE] Queued update #{write_id} for {key_column}='{key_value}': {list(data)}")
+    _wake_event.set()
+    return True
+
+
+def get_pending_sheet_updates(sheet_id: str, worksheet_name: Optional[str], key_column: str) -> List[Dict[str, Any]]:
+    """Các cập nhật còn trong hàng đợi của một worksheet (rỗng nếu không đọc được)"""
+    queue = get_write_queue()
+    if queue is None:
+        return []
+    try:
+        return queue.get_pending_updates(sheet_id, worksheet_name, key_column)
+    except Exception as e:
+        print(f"[WRITE_QUEUE] Error reading pending updates: {e}")
+        return []
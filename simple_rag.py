@@ -302,8 +302,29 @@ class SimpleHotelRAG:
             except:
                 pass
         
+        guest_context['booking_history'] = self._get_guest_bookings(guest_name)
         return guest_context
     
+    def _get_guest_bookings(self, guest_name: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """Booking gần nhất của khách, tra qua chỉ mục tên dùng chung (không phân biệt dấu)"""
+        try:
+            from booking_store import read_booking_frame
+            from booking_indexes import find_guest_bookings
+            
+            df = read_booking_frame(os.getenv("DEFAULT_SHEET_ID"), os.getenv("GCP_CREDS_FILE_PATH"),
+                                    os.getenv("WORKSHEET_NAME"))
+            bookings = find_guest_bookings(df, guest_name).tail(limit)
+            return [{
+                'booking_id': str(row.get('Số đặt phòng', '')),
+                'guest_name': row.get('Tên người đặt', ''),
+                'check_in': str(row.get('Check-in Date', ''))[:10],
+                'check_out': str(row.get('Check-out Date', ''))[:10],
+                'status': row.get('Tình trạng', '')
+            } for row in bookings.to_dict('records')]
+        except Exception as e:
+            print(f"Error getting guest bookings: {e}")
+            return []
+    
     def save_guest_interaction(self, guest_name: str, booking_id: str, interaction_data: Dict[str, Any]):
         """Save guest interaction for future context"""
         conn = sqlite3.connect(self.db_path)
@@ -444,41 +465,32 @@ class SimpleHotelRAG:
         """Get live booking data for arrival queries"""
         
         try:
-            from datetime import datetime, timedelta
-            import pandas as pd
-            
-            # Import the booking data function
-            from logic import import_from_gsheet
+            from booking_store import read_booking_frame
+            from booking_indexes import get_booking_day_index
             
-            # Get current booking data
-            df = import_from_gsheet()
+            # Snapshot dùng chung với app (trước đây gọi import_from_gsheet() thiếu tham số nên luôn lỗi)
+            df = read_booking_frame(os.getenv("DEFAULT_SHEET_ID"), os.getenv("GCP_CREDS_FILE_PATH"),
+                                    os.getenv("WORKSHEET_NAME"))
             if df is None or df.empty:
                 return []
             
-            # Get today and tomorrow dates
-            today = datetime.now().strftime('%Y-%m-%d')
-            tomorrow = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
-            
-            # Filter for arrivals today and tomorrow
-            arrival_data = []
+            today = datetime.now().date()
+            tomorrow = today + timedelta(days=1)
+            day_index = get_booking_day_index(df)
+            query_lower = query.lower()
             
-            # Check for today's arrivals
-            if 'today' in query.lower() or 'hôm nay' in query.lower():
-                today_arrivals = df[df['Check-in Date'] == today]
-                for _, row in today_arrivals.iterrows():
-                    arrival_data.append({
-                        'date': 'today',
-                        'guest_name': row.get('Tên người đặt', 'Unknown'),
-                        'booking_id': str(row.get('Số đặt phòng', '')),
-                        'status': row.get('Tình trạng', 'Unknown')
-                    })
+            # Khách đến hôm nay / ngày mai, tra theo ngày trong chỉ mục check-in
+            wanted = []
+            if 'today' in query_lower or 'hôm nay' in query_lower:
+                wanted.append(('today', today))
+            if 'tomorrow' in query_lower or 'ngày mai' in query_lower or 'mai' in query_lower:
+                wanted.append(('tomorrow', tomorrow))
             
-            # Check for tomorrow's arrivals  
-            if 'tomorrow' in query.lower() or 'ngày mai' in query.lower() or 'mai' in query.lower():
-                tomorrow_arrivals = df[df['Check-in Date'] == tomorrow]
-                for _, row in tomorrow_arrivals.iterrows():
+            arrival_data = []
+            for label, day in wanted:
+                for row in df.iloc[day_index.check_ins(day)].to_dict('records'):
                     arrival_data.append({
-                        'date': 'tomorrow', 
+                        'date': label,
                         'guest_name': row.get('Tên người đặt', 'Unknown'),
                         'booking_id': str(row.get('Số đặt phòng', '')),
                         'status': row.get('Tình trạng', 'Unknown')
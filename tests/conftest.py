@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Các module của app nằm ở thư mục gốc repo (không đóng gói)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
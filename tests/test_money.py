@@ -0,0 +1,105 @@
+"""
+Kiểm tra thuộc tính của money trên dữ liệu sinh ngẫu nhiên (seed cố định để lặp lại được).
+"""
+import math
+import random
+
+import pandas as pd
+import pytest
+
+from money import (
+    EXCHANGE_RATES_TO_VND, format_vnd, parse_amount, parse_money_series, to_vnd, to_vnd_series
+)
+
+SAMPLES = 2000
+
+
+def _group(n: int, sep: str) -> str:
+    """1234567 -> '1<sep>234<sep>567'"""
+    return f"{n:,}".replace(',', sep)
+
+
+def _money_string(rng: random.Random) -> str:
+    """Chuỗi tiền kiểu sheet/giá cào về: VND, USD hoặc EUR, nhiều cách viết số"""
+    whole = rng.choice([rng.randint(0, 999), rng.randint(1000, 99_999_999)])
+    cents = rng.randint(0, 99)
+    number = rng.choice([
+        str(whole),
+        _group(whole, ','),
+        _group(whole, '.'),
+        _group(whole, ' '),
+        f"{_group(whole, ',')}.{cents:02d}",
+        f"{_group(whole, '.')},{cents:02d}",
+        f"{whole}.{cents % 10}",
+    ])
+    template = rng.choice([
+        '{}', '{}đ', '{} đ', '{}₫', '{} VND', 'VND {}', '${}', '{} USD', 'US${}',
+        '€{}', '{} EUR', '{}€', 'Giá: {}đ/đêm', '  {}  ', '{}đ (2 khách)',
+    ])
+    return template.format(number)
+
+
+@pytest.fixture
+def rng():
+    return random.Random(20260322)
+
+
+def test_scalar_matches_series(rng):
+    values = [_money_string(rng) for _ in range(SAMPLES)]
+    series = parse_money_series(pd.Series(values), default=None)
+    vnd_series = to_vnd_series(pd.Series(values), small_amount_currency='USD')
+    for value, from_series, vnd in zip(values, series, vnd_series):
+        assert parse_amount(value) == from_series, value
+        assert to_vnd(value, small_amount_currency='USD') == vnd, value
+
+
+def test_format_vnd_round_trip(rng):
+    for n in [0, 1, 999, 1000, 1234, 1_200_000] + [rng.randint(0, 10 ** 10) for _ in range(SAMPLES)]:
+        assert parse_amount(format_vnd(n)) == n
+        assert parse_amount(format_vnd(n, symbol=' VND')) == n
+
+
+def test_us_and_eu_separators(rng):
+    for _ in range(SAMPLES):
+        whole = rng.randint(1000, 999_999_999)
+        cents = rng.randint(1, 99)
+        expected = whole + cents / 100
+        us = f"{_group(whole, ',')}.{cents:02d}"
+        eu = f"{_group(whole, '.')},{cents:02d}"
+        assert math.isclose(parse_amount(us), expected), us
+        assert math.isclose(parse_amount(eu), expected), eu
+        # Chỉ có dấu ngăn cách nghìn
+        assert parse_amount(_group(whole, ',')) == whole
+        assert parse_amount(_group(whole, '.')) == whole
+        assert parse_amount(_group(whole, ' ')) == whole
+
+    # Một dấu duy nhất, theo sau không phải đúng 3 chữ số: dấu thập phân
+    assert parse_amount('12.5') == 12.5
+    assert parse_amount('12,50') == 12.5
+    assert parse_amount('1200000.0') == 1200000
+
+
+def test_currency_conversion():
+    assert to_vnd('$45.50') == 45.5 * EXCHANGE_RATES_TO_VND['USD']
+    assert to_vnd('45,50 EUR') == 45.5 * EXCHANGE_RATES_TO_VND['EUR']
+    assert to_vnd('1.200.000đ') == 1_200_000
+    assert to_vnd('45', small_amount_currency='USD') == 45 * EXCHANGE_RATES_TO_VND['USD']
+    assert to_vnd('450000', small_amount_currency='USD') == 450_000
+
+
+@pytest.mark.parametrize('value', [None, '', '   ', 'abc', 'đ', 'N/A', '$', '--', float('nan')])
+def test_empty_and_garbage_return_none(value):
+    assert parse_amount(value) is None
+    assert to_vnd(value) == 0
+    assert math.isnan(parse_money_series(pd.Series([value], dtype=object), default=None)[0])
+    assert parse_money_series(pd.Series([value], dtype=object))[0] == 0
+
+
+def test_garbage_never_raises(rng):
+    alphabet = 'abcxyz.,-đ$€ ₫ /:()' + '0123456789'
+    values = [''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 12))) for _ in range(SAMPLES)]
+    series = parse_money_series(pd.Series(values), default=None)
+    for value, from_series in zip(values, series):
+        amount = parse_amount(value)
+        assert amount is None or amount >= 0
+        assert (amount is None and math.isnan(from_series)) or amount == from_series, value